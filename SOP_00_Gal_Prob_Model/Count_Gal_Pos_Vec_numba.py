@@ -10,22 +10,23 @@ Input variables:
     [dimension]:     dim of magnitude space (for now only "6")
     [cube size]:     length of multi-d cube in magnitude unit
     [band_ID]:       band index to use in calculation (default: 034567)
+    [-cache]:        read columns from columnar catalog cache (see TF_To_Columnar_Catalog.py)
 
 -------------------------------------------------------
-Latest update 2020.11.11 Jordan Wu'''
+Latest update 2026.10.18 Jordan Wu'''
 
 # Load Modules
 #======================================================
 from __future__ import print_function
 import time
 import numpy as np
-from numba import jit
 from sys import argv, exit
 from os import chdir, system, path
 from argparse import ArgumentParser
 from All_Variables import *
 from Hsieh_Functions import *
 from Useful_Functions import *
+from Catalog_Cache import open_catalog_cache, load_column_array
 
 # Global Variables
 #======================================================
@@ -34,67 +35,16 @@ JHK_system = 'ukidss' #'2mass'
 
 # Functions
 #======================================================
-def Remove_AGB(mag_list, IR2_mag_ID, IR3_mag_ID, MP1_mag_ID):
+def Filter_Bright_Faint(pos_vec_array):
     '''
-    This is to check if object in input catalog is AGB
-    Input datatype: magnitude, int, int, int
+    This is to filter out bright (-9999), faint (9999) and sources we want
     '''
-    # Initialize AGB flag
-    AGB_flag = 'Not_AGB'
-    # Remove AGB if IR2, IR3, MP1 band all exists in input
-    if (IR2_mag_ID is not np.nan) and (IR3_mag_ID is not np.nan) and (MP1_mag_ID is not np.nan):
-        if (mag_list[IR2_mag_ID] != 'no') and (mag_list[IR3_mag_ID] != 'no') and (mag_list[MP1_mag_ID] != 'no'):
-            X23 = mag_list[IR2_mag_ID] - mag_list[IR3_mag_ID]
-            Y35 = mag_list[IR3_mag_ID] - mag_list[MP1_mag_ID]
-            if index_AGB(X23, Y35, [0, 0, 2, 5], [-1, 0, 2, 2]) < 0:
-                AGB_flag = 'AGB'
-    return AGB_flag
-
-@jit(nopython=True)
-def filter_bright_faint(pos_vec_array):
-    '''
-    This is to filter out bright, faint and sources we want
-    Note: np.any can't do well
-    '''
-    bright = []
-    faint  = []
-    source = []
-    for i in range(len(pos_vec_array)):
-        pos_vec_array_sub = pos_vec_array[i]
-        # Filiter out Bright/Faint Sources
-        if np.shape(np.where(pos_vec_array_sub == -9999)[0])[0] > 0:
-            bright.append(pos_vec_array_sub)
-        elif np.shape(np.where(pos_vec_array_sub == 9999)[0])[0] > 0:
-            faint.append(pos_vec_array_sub)
-        else:
-            source.append(pos_vec_array_sub)
-    return bright, faint, source
-
-@jit(nopython=True)
-def cascade_array_pos(sort_position):
-    '''
-    Use this to find out sources locate in same position and cascade them
-    Note: No tuple() support in numba, No format() support in numba
-    '''
-    # Input
-    after_cascade_pos = []
-    after_cascade_value = []
-    start = 0
-    end   = 0
-    for i in range(len(sort_position)-1):
-        # Get reference and target
-        tar, ref = sort_position[i], sort_position[i+1]
-        end += 1
-        # Determine repeated or not
-        if not np.all(np.equal(tar, ref)):
-            after_cascade_pos.append(sort_position[start])
-            after_cascade_value.append(end-start)
-            start = end
-    # Include the last term
-    after_cascade_pos.append(sort_position[start])
-    after_cascade_value.append(len(sort_position)-start)
-    return after_cascade_pos, after_cascade_value
+    bright_mask = np.any(pos_vec_array == -9999, axis=1)
+    faint_mask  = np.any(pos_vec_array == 9999, axis=1) & ~bright_mask
+    source_mask = ~(bright_mask | faint_mask)
+    return pos_vec_array[bright_mask], pos_vec_array[faint_mask], pos_vec_array[source_mask]
 
+#======================================================
 # Main Program
 #======================================================
 if __name__ == '__main__':
@@ -126,6 +76,7 @@ if __name__ == '__main__':
     parser.add_argument('dimension', type=int, help='dim of magnitude space (for now only "6")')
     parser.add_argument('cube_size', type=float, help='length of multi-d cube (unit: magnitude)')
     parser.add_argument('-band_ID', '--band_index', type=str, dest='band_IDs', help='Band index to use in calculation (e.g. 012345)')
+    parser.add_argument('-cache', '--column_cache', action='store_true', dest='column_cache', help='Read columns from columnar catalog cache (built on first use)')
 
     args = parser.parse_args()
     inpcat    = args.input_catalog
@@ -135,6 +86,7 @@ if __name__ == '__main__':
     dim       = args.dimension
     cube      = args.cube_size
     band_IDs  = args.band_IDs
+    column_cache = args.column_cache
 
     if band_IDs is None:
         band_ID = band_ID
@@ -181,48 +133,45 @@ if __name__ == '__main__':
     # Load Galaxy Catalog
     l_start = time.time()
     print("\nLoading input catalog ...")
-    with open(str(argv[1]), 'r') as catalogs:
-        catalog = catalogs.readlines()
+    if datatype not in ['flux', 'mag']:
+        exit('Input type error')
+    inp_ID = flux_ID if datatype == 'flux' else mag_ID
+    if column_cache:
+        schema    = open_catalog_cache(inpcat)
+        inp_array = load_column_array(schema, inp_ID, dtype=float)
+        qua_array = load_column_array(schema, qua_ID, dtype=str) if qualabel else None
+    else:
+        with open(inpcat, 'r') as catalogs:
+            catalog = catalogs.readlines()
+        row_lists = [line.split() for line in catalog]
+        inp_array = get_column_array(row_lists, inp_ID, dtype=float)
+        qua_array = get_column_array(row_lists, qua_ID) if qualabel else None
     l_end   = time.time()
     print("Loading catalog took {:.3f} secs\n".format(l_end-l_start))
 
     # Calculate Galaxy Position Vector
     c_start = time.time()
-    pos_vec = []
-    for i in range(len(catalog)):
-        drawProgressBar(float(i+1)/len(catalog))
-        # Unit transformation
-        line = catalog[i]
-        lines = line.split()
-        if datatype == 'flux':
-            mag_list = mJy_to_mag(lines, flux_ID=flux_ID, f0_list=f0_list, qua_ID=qua_ID, Qua=qualabel)
-        elif datatype == 'mag':
-            mag_list = mag_to_mag(lines, mag_ID=mag_ID, qua_ID=qua_ID, Qua=qualabel)
-        else:
-            exit('Input type error')
-        SEQ_vector = [sort_up_lack999(mag_list[i], axlim_list[i], cube) for i in range(len(axlim_list))]
-        AGB_flag   = Remove_AGB(mag_list, IR2_mag_ID, IR3_mag_ID, MP1_mag_ID)
-        if AGB_flag != 'AGB':
-            pos_vec.append(SEQ_vector)
+    if datatype == 'flux':
+        mag_array, valid = mJy_to_mag_array(inp_array, f0_list=f0_list, qua_array=qua_array, Qua=qualabel)
+    elif datatype == 'mag':
+        mag_array, valid = mag_to_mag_array(inp_array, qua_array=qua_array, Qua=qualabel)
+    SEQ_array = sort_up_lack999_array(mag_array, valid, axlim_list, cube)
+    AGB_mask  = AGB_mask_array(mag_array, valid, IR2_mag_ID, IR3_mag_ID, MP1_mag_ID)
+    pos_vec   = SEQ_array[~AGB_mask]
     c_end   = time.time()
     print("\n\nCalculate all sources position in n-dim space took {:.3f} secs\n".format(c_end-c_start))
 
     # Galaxy filter
     f_start = time.time()
-    pos_vec_array = np.array(pos_vec)
-    bright, faint, source = filter_bright_faint(pos_vec_array)
-    source_array = np.array(source)
+    pos_vec_array = np.array(pos_vec, dtype=np.int64).reshape(-1, len(band_ID))
+    bright, faint, source_array = Filter_Bright_Faint(pos_vec_array)
     f_end   = time.time()
     print("Filter out bright and faint sources took {:.3f} secs\n".format(f_end-f_start))
 
-    # Sort Input Galaxy Position/Probability array
+    # Sort and cascade Input Galaxy Position array by packed keys
     u_start = time.time()
-    position_t = np.transpose(source_array)
-    sort_ind = np.lexsort(tuple(position_t))
-    sort_position = np.array(source_array[sort_ind], dtype=int)
-    uni_pos, uni_num = cascade_array_pos(sort_position)
-    uni_pos_array = np.array(uni_pos)
-    uni_num_array = np.array(uni_num)
+    radix = get_pos_vec_radix(axlim_list, cube)
+    uni_pos_array, uni_num_array = cascade_pos_vec(source_array, np.ones(len(source_array), dtype=int), radix)
     u_end   = time.time()
     print("Sort sources took {:.3f} secs\n".format(u_end-u_start))
 
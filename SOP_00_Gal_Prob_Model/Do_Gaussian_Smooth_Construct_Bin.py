@@ -1,18 +1,38 @@
 #!/usr/bin/env python
+'''
+Construct gaussian beams (6D to 3D) for smoothing
+
+Example: [program] [sigma] [bond] [ref-D] [cache_dir]
+
+# Note:
+    Beams are built by make_gaussian_beam (any dimension), with [cache_dir] they are cached on disk keyed by (dim, sigma, bond, ref-D),
+    so repeated model builds and parameter sweeps load cached beams instead of building them again (no cache by default)
+'''
+
+from __future__ import print_function
 import numpy as np
 from sys import argv, exit
 from os import system, chdir, path
+from Useful_Functions import *
+import SOP_Program_Path as spp
 
-if len(argv) != 4:
+if len(argv) not in [4, 5]:
     exit('\n\tError: Wrong Arguments\
-    \n\tExample: [program] [sigma] [bond] [ref-D]\
+    \n\tExample: [program] [sigma] [bond] [ref-D] [cache_dir]\
     \n\t[sigma]: standard deviation for gaussian dist. in magnitude\
     \n\t[bond]: boundary of gaussian beam unit in cell\
-    \n\t[ref-D]: reference dimension which to modulus other dimension to\n')
-
-sigma = int(argv[1]) # 2 # STD for Gaussian Smooth
-bond  = int(argv[2]) # 7 # Max Smooth Radius
-ref   = int(argv[3]) # 6 # Reference Beam Dimension
+    \n\t[ref-D]: reference dimension which to modulus other dimension to\
+    \n\t[cache_dir]: (optional) beam cache directory ("none": no cache (default), "shared": Beam_Cache_path in SOP_Program_Path)\n')
+
+sigma     = int(argv[1]) # 2 # STD for Gaussian Smooth
+bond      = int(argv[2]) # 7 # Max Smooth Radius
+ref       = int(argv[3]) # 6 # Reference Beam Dimension
+cache_dir = str(argv[4]) if len(argv) == 5 else 'none'
+dim_list  = [6, 5, 4, 3]
+if cache_dir == 'shared':
+    cache_dir = spp.Beam_Cache_path
+elif cache_dir == 'none':
+    cache_dir = None
 
 # Directory Check
 # Save Gaussian Beam
@@ -22,121 +42,18 @@ if path.isdir('GPV_smooth_sigma{:d}_bond{:d}_refD{:d}'.format(sigma, bond, ref))
 else:
     system('mkdir ' + 'GPV_smooth_sigma{:d}_bond{:d}_refD{:d}'.format(sigma, bond, ref))
 
-# 6band Gaussian Beam for Smooth
-six_band_beam = []
-for i in range(-bond, 1+bond):
-    for j in range(-bond, 1+bond):
-        for k in range(-bond, 1+bond):
-            for l in range(-bond, 1+bond):
-                for m in range(-bond, 1+bond):
-                    for n in range(-bond, 1+bond):
-
-                        # Dimension Effect Correction Factor
-                        if float(ref) >= 6.0:
-                            Mfactor = (6.0/ref)**0.5
-                        else:
-                            Mfactor = 1/((6.0/ref)**0.5)
-
-                        # Gaussian Factor
-                        r_sqa = float(i**2 + j**2 + k**2 + l**2 + m**2 + n**2)
-                        G = np.exp(-(r_sqa/(2*(sigma * Mfactor)**2)))
-                        if r_sqa <= bond**2:
-                            vec = [i, j, k, l, m, n, G]
-                            six_band_beam.append(vec)
-
-# 5band Gaussian Beam for Smooth
-five_band_beam = []
-for i in range(-bond, 1+bond):
-   for j in range(-bond, 1+bond):
-      for k in range(-bond, 1+bond):
-         for l in range(-bond, 1+bond):
-            for m in range(-bond, 1+bond):
-
-                # Dimension Effect Correction Factor
-                if float(ref) >= 5.0:
-                    Mfactor = (5.0/ref)**0.5
-                else:
-                    Mfactor = 1/((5.0/ref)**0.5)
-
-                # Gaussian Factor
-                r_sqa = float(i**2 + j**2 + k**2 + l**2 + m**2)
-                G = np.exp(-(r_sqa/(2*(sigma * Mfactor)**2)))
-                if r_sqa <= bond**2:
-                    vec = [i, j, k, l, m, G]
-                    five_band_beam.append(vec)
-
-# 4band Gaussian Beam for Smooth
-four_band_beam = []
-for i in range(-bond, 1+bond):
-   for j in range(-bond, 1+bond):
-      for k in range(-bond, 1+bond):
-         for l in range(-bond, 1+bond):
-
-            # Dimension Effect Correction Factor
-            if float(ref) >= 4.0:
-                Mfactor = (4.0/ref)**0.5
-            else:
-                Mfactor = 1/((4.0/ref)**0.5)
-
-            # Gaussian Factor
-            r_sqa = float(i**2 + j**2 + k**2 + l**2)
-            G = np.exp(-(r_sqa/(2*(sigma * Mfactor)**2)))
-            if r_sqa <= bond**2:
-                vec = [i, j, k, l, G]
-                four_band_beam.append(vec)
-
-# 3band Gaussian Beam for Smooth
-three_band_beam = []
-for i in range(-bond, 1+bond):
-   for j in range(-bond, 1+bond):
-      for k in range(-bond, 1+bond):
-
-        # Dimension Effect Correction Factor
-        if float(ref) >= 3.0:
-            Mfactor = (3.0/ref)**0.5
-        else:
-            Mfactor = 1/((3.0/ref)**0.5)
-
-        # Gaussian Factor
-        r_sqa = float(i**2 + j**2 + k**2)
-        G = np.exp(-(r_sqa/(2*(sigma * Mfactor)**2)))
-        if r_sqa <= bond**2:
-            vec = [i, j, k, G]
-            three_band_beam.append(vec)
+# N-band Gaussian Beam for Smooth
+beam_list = [load_gaussian_beam(dim, sigma, bond, ref, cache_dir) for dim in dim_list]
 
 # Save Gaussian Beam
 chdir('GPV_smooth_sigma{:d}_bond{:d}_refD{:d}'.format(sigma, bond, ref))
-np.save('6d_beam_sigma' + str(sigma), six_band_beam)
-np.save('5d_beam_sigma' + str(sigma), five_band_beam)
-np.save('4d_beam_sigma' + str(sigma), four_band_beam)
-np.save('3d_beam_sigma' + str(sigma), three_band_beam)
-
-# Plot Figures
-fig0 = []
-for i in range(len(six_band_beam)):
-    if six_band_beam[i][0] == 0 and six_band_beam[i][1] == 0 and six_band_beam[i][2] == 0 and six_band_beam[i][3] == 0 and six_band_beam[i][4] == 0:
-        fig0.append(six_band_beam[i][6])
-fig1 = []
-for i in range(len(five_band_beam)):
-    if five_band_beam[i][0] == 0 and five_band_beam[i][1] == 0 and five_band_beam[i][2] == 0 and five_band_beam[i][3] == 0:
-        fig1.append(five_band_beam[i][5])
-fig2 = []
-for i in range(len(four_band_beam)):
-    if four_band_beam[i][0] == 0 and four_band_beam[i][1] == 0 and four_band_beam[i][2] == 0:
-        fig2.append(four_band_beam[i][4])
-fig3 = []
-for i in range(len(three_band_beam)):
-    if three_band_beam[i][0] == 0 and three_band_beam[i][1] == 0:
-        fig3.append(three_band_beam[i][3])
-XX = []
-for i in range(-bond, 1+bond):
-    XX.append(float(i+0.5))
+for dim, beam in zip(dim_list, beam_list):
+    np.save('{:d}d_beam_sigma{:d}'.format(dim, sigma), beam)
 
+# Plot Figures (beam profile along last axis)
 # import matplotlib.pyplot as plt
-# plt.plot(XX, fig0, ls='steps')
-# plt.plot(XX, fig1, ls='steps')
-# plt.plot(XX, fig2, ls='steps')
-# plt.plot(XX, fig3, ls='steps')
+# for fig in fig_list:
+#     plt.plot(XX, fig, ls='steps')
 # plt.xlabel("cube: cube_size mag")
 # plt.ylabel("counts")
 # system('mkdir ND_Beam_sigma' + str(sigma) + '_refD' + str(ref))
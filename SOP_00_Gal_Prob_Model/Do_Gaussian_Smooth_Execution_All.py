@@ -1,40 +1,116 @@
 #!/usr/bin/env python
 '''
-# Sort_Source_Lack999_Slice.py (SLICE)
-# [program] [dim] [cube size] [sl_num]
+Gaussian smooth of all band combinations (lack 0 to dim-3) in one process pool
 
-# Do_Gaussian_Smooth_Slice_Index.py (INDEX)
-# [program] [dim] [cube size] [sigma] [bond] [ref-D] [lack] [band_inp] [slice_num] [slice_ind]
+Example: [program] [dim] [cube size] [sigma] [bond] [ref-D] [slice_num] [one_by_one] [n_proc] [backend] [mem_limit]
 
-# Do_Gaussian_Smooth_Slice_Cascade.py (CASCADE)
-# [program] [dim] [cube size] [sigma] [bond] [ref-D] [lack] [band_inp] [band_ind_1] [band_ind_2]
+# Note:
+    Input pos/num (Band_pos_num/Lack_*_pos/num.npy) and beams are memory-mapped and shared read-only by processes,
+    every band combination is cut into [slice_num] slices (same cuts as Do_Gaussian_Smooth_Slice.py)
+    and smoothed slices are returned in memory (no Slice_*/After_Smooth_* files any more)
+    Each smoothed slice is already sorted by packed position key and cascaded,
+    slices of band combination are joined by one k-way merge (summing same positions),
+    Every smoothed slice is saved to Runs_* in output directory as checkpoint,
+    [one_by_one] "yes" merges saved slices out of core, "no" merges slices kept in memory
+    Progress manifest (progress.json in output directory) records finished band combinations and slices,
+    a restarted run skips those whose inputs (size/mtime) and parameters match (remove it to smooth from scratch)
+    Output all_cas pos/num are sorted by packed position key
+    [slice_num] "auto" takes the smallest slice number estimated to fit in [mem_limit] (see Do_Gaussian_Smooth_Slice_Adviser.py)
+    Do_Gaussian_Smooth_Slice_Index.py/Do_Gaussian_Smooth_Slice_Cascade.py still work on sliced files by hand
 '''
 
 from __future__ import print_function
 import time
 import numpy as np
 from sys import argv, exit
-from os import system, path, chdir
-from numba import jit
+from os import system, path, stat, rename
+import json
 from itertools import combinations
+from joblib import Parallel, delayed, cpu_count
 from Useful_Functions import *
 
+# Functions
+#================================================
+def Get_Slice_Cuts(length, slice_num):
+    '''
+    This is to get cuts of slices (same as Do_Gaussian_Smooth_Slice.py)
+    '''
+    end_cuts = [int(length*(float(k)/slice_num)) for k in range(slice_num+1)]
+    end_cuts[-1] += 1
+    return end_cuts
+
+def Spill_Run(run_dir, run_id, keys, num):
+    '''
+    This is to save sorted run (packed keys/numbers) of one slice (write then rename) and reload it memory-mapped
+    '''
+    for name, array in [('key', keys), ('num', num)]:
+        np.save(run_dir + 'run_{:d}_{}.tmp.npy'.format(run_id, name), array)
+        rename(run_dir + 'run_{:d}_{}.tmp.npy'.format(run_id, name), run_dir + 'run_{:d}_{}.npy'.format(run_id, name))
+    return Load_Run(run_dir, run_id)
+
+def Load_Run(run_dir, run_id):
+    '''
+    This is to load saved run of one slice memory-mapped (None if it is not saved)
+    '''
+    key_name = run_dir + 'run_{:d}_key.npy'.format(run_id)
+    num_name = run_dir + 'run_{:d}_num.npy'.format(run_id)
+    if not (path.isfile(key_name) and path.isfile(num_name)):
+        return None
+    return np.load(key_name, mmap_mode='r'), np.load(num_name, mmap_mode='r')
+
+def Merge_Band_Runs(run_list, radix, out_prefix):
+    '''
+    This is to merge all slice runs of band combination in one pass and save all_cas pos/num
+    '''
+    keys, num = merge_sorted_runs(run_list)
+    np.save(out_prefix + '_pos', unpack_pos_vec(keys, radix))
+    np.save(out_prefix + '_num', num)
+
+def Get_File_Signature(file_list):
+    '''
+    This is to get signature (name, size, mtime) of input files to check if checkpoint matches inputs
+    '''
+    return [[path.basename(file_name), stat(file_name).st_size, stat(file_name).st_mtime] for file_name in file_list]
+
+def Load_Manifest(manifest_name, params):
+    '''
+    This is to load progress manifest, a new manifest is started if there is none or parameters changed
+    '''
+    if path.isfile(manifest_name):
+        with open(manifest_name, 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get('params') == params:
+            return manifest
+        print('Parameters differ from progress manifest, smooth from scratch')
+    return {'params': params, 'bands': {}}
+
+def Save_Manifest(manifest_name, manifest):
+    '''
+    This is to save progress manifest (write then rename, never left half-written)
+    '''
+    with open(manifest_name + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    rename(manifest_name + '.tmp', manifest_name)
+
 # Main Programs
 #================================================
 if __name__ == '__main__':
     m_start = time.time()
 
     # Check Inputs
-    if len(argv) != 8:
+    if len(argv) not in [8, 9, 10, 11]:
         exit('\n\tError: Wrong Arguments\
-        \n\tExample: [program] [dim] [cube size] [sigma] [bond] [ref-D] [slice_num] [one_by_one]\
+        \n\tExample: [program] [dim] [cube size] [sigma] [bond] [ref-D] [slice_num] [one_by_one] [n_proc] [backend] [mem_limit]\
         \n\t[dim]: dimension for smooth (for now only "6")\
         \n\t[cube size]: length of multi-d cube in magnitude unit\
         \n\t[sigma]: standard deviation for gaussian dist. in magnitude\
         \n\t[bond]: boundary radius of gaussian beam unit in cell\
         \n\t[ref-D]: reference dimension which to modulus other dimension to\
-        \n\t[slice_num]: number of slices of the input catalog\
-        \n\t[one_by_one]: smooth then cascade one by one or not ("yes"/"no") \n')
+        \n\t[slice_num]: number of slices of the input catalog (or "auto")\
+        \n\t[one_by_one]: merge saved slices out of core or slices kept in memory ("yes"/"no")\
+        \n\t[n_proc]: (optional) number of processes (default: -1, all cores)\
+        \n\t[backend]: (optional) "sparse", "dense" or "auto" (default) smoothing backend\
+        \n\t[mem_limit]: (optional) RAM budget in GB for "auto" slice_num (default: 8)\n')
 
     # Input Variables
     dim         = int(argv[1])       # Dimension of position vector
@@ -42,112 +118,119 @@ if __name__ == '__main__':
     sigma       = int(argv[3])       # STD for Gaussian Smooth
     bond        = int(argv[4])
     refD        = int(argv[5])       # Reference Beam Dimension
-    slice_num   = int(argv[6])
-    one_by_one  = str(argv[7])       # Smooth then cascade one by one or not
+    slice_num   = str(argv[6])
+    one_by_one  = str(argv[7])       # Merge slices out of core or not
+    n_proc      = int(argv[8]) if len(argv) >= 9 else -1
+    backend     = str(argv[9]) if len(argv) >= 10 else 'auto'
+    mem_limit   = float(argv[10]) * 1024**3 if len(argv) == 11 else 8. * 1024**3
     lack_lim    = dim - 3 + 1
-    slice_ind_list = [i for i in range(slice_num)]
+    if one_by_one not in ['yes', 'no']:
+        exit('Wrong one_by_one: {}'.format(one_by_one))
+    if backend not in ['auto', 'dense', 'sparse']:
+        exit('Wrong backend: {}'.format(backend))
 
     # Directory
     posv_dir = 'GPV_{:d}Dposvec_bin{:.1f}/'.format(dim, cube)
     band_dir = posv_dir + 'Band_pos_num/'
     out_dir  = 'GPV_after_smooth_{:d}D_bin{:.1f}_sigma{:d}_bond{:d}_refD{:d}/'.format(dim, cube, sigma, bond, refD)
+    beam_dir = 'GPV_smooth_sigma{:d}_bond{:d}_refD{:d}/'.format(sigma, bond, refD)
+    shape    = np.load(posv_dir + 'Shape.npy')
+    radix    = shape.astype(np.uint64) + 1
 
-    # Band directory list
+    # Band combination list
     lack_inp_list = []
     band_inp_list = []
-    temp_dir_list = []
-    slic_dir_list = []
     for i in range(lack_lim):
         for comb in combinations(np.arange(dim), dim-i):
-            band_list = list(comb)
-            band_index = ''
-            for band in band_list:
-                band_index += str(int(band))
-            temp_dir = out_dir  + 'After_Smooth_{}/'.format(band_index)
-            slic_dir = band_dir + 'Slice_{}_{:0>3d}/'.format(band_index, slice_num)
             lack_inp_list.append(i)
-            band_inp_list.append(band_index)
-            temp_dir_list.append(temp_dir)
-            slic_dir_list.append(slic_dir)
+            band_inp_list.append(''.join([str(int(band)) for band in comb]))
 
     # Check storage directory
     if not path.isdir(out_dir):
         system('mkdir ' + out_dir)
-    for i in range(len(temp_dir)):
-        if not path.isdir(temp_dir):
-            system('mkdir ' + temp_dir)
-
-    # Start calculation
-    for i in range(len(band_inp_list)):
-        # Slice input galaxy pos/num array
-        if not path.isdir(slic_dir_list[i]):
-            s_start = time.time()
-            system('\nDo_Gaussian_Smooth_Slice.py {:d} {:.1f} {:d}'.format(dim, cube, slice_num))
-            s_end   = time.time()
-            print('\nSlice {} took {:.3f} sec'.format(band_inp_list[i], s_end-s_start))
-        else:
-            print('\n{} already been sliced, use existed one'.format(band_inp_list[i]))
-        # One by one smooth then cascade
-        b_start = time.time()
-        if one_by_one == 'yes': # smooth -> cascade -> smooth -> cascade ...
-            system('Do_Gaussian_Smooth_Slice_Index.py {:d} {:.1f} {:d} {:d} {:d} {:d} {} {:d} {:d}'.format(\
-                    dim, cube, sigma, bond, refD, lack_inp_list[i], band_inp_list[i], slice_num, 0))
-            pos = np.load(temp_dir_list[i] + "after_smooth_{}_{:0>3d}_pos.npy".format(band_inp_list[i],\
-                                                                                        slice_ind_list[0]))
-            num = np.load(temp_dir_list[i] + "after_smooth_{}_{:0>3d}_num.npy".format(band_inp_list[i],\
-                                                                                        slice_ind_list[0]))
-            for j in range(1, slice_num):
-                system('Do_Gaussian_Smooth_Slice_Index.py {:d} {:.1f} {:d} {:d} {:d} {:d} {} {:d} {:d}'.format(\
-                                    dim, cube, sigma, bond, refD, lack_inp_list[i], band_inp_list[i], slice_num, j))
-                new_pos  = np.load(temp_dir_list[i] + "after_smooth_{}_{:0>3d}_pos.npy".format(\
-                                                                                band_inp_list[i], slice_ind_list[j]))
-                new_num  = np.load(temp_dir_list[i] + "after_smooth_{}_{:0>3d}_num.npy".format(\
-                                                                                band_inp_list[i], slice_ind_list[j]))
-                join_pos = np.concatenate((pos, new_pos), axis=0)
-                join_num = np.concatenate((num, new_num), axis=0)
-                # Sort and then cascade
-                sort_ind = np.lexsort(tuple(np.transpose(join_pos)))
-                sort_pos = np.array(join_pos[sort_ind], dtype=int)
-                sort_num = np.array(join_num[sort_ind], dtype=float)
-                cas_pos, cas_num = cascade_array(sort_pos, sort_num)
-                # Start again with cascade pos/num
-                pos, num = np.array(cas_pos), np.array(cas_num)
-                drawProgressBar(float(j+1)/slice_num)
-
-        # Cascade all in one time
-        elif one_by_one == 'no':
-            for j in range(slice_num):
-                system('Do_Gaussian_Smooth_Slice_Index.py {:d} {:.1f} {:d} {:d} {:d} {:d} {} {:d} {:d}'.format(\
-                                    dim, cube, sigma, bond, refD, lack_inp_list[i], band_inp_list[i], slice_num, j))
-            pos = np.load(temp_dir_list[i] + "after_smooth_{}_{:0>3d}_pos.npy".format(band_inp_list[i], slice_ind_list[0]))
-            num = np.load(temp_dir_list[i] + "after_smooth_{}_{:0>3d}_num.npy".format(band_inp_list[i], slice_ind_list[0]))
-            print('\nConcatenate input sliced pos/num')
-            for j in range(1, slice_num):
-                system('Do_Gaussian_Smooth_Slice_Index.py {:d} {:.1f} {:d} {:d} {:d} {:d} {} {:d} {:d}'.format(\
-                                            dim, cube, sigma, bond, refD, lack_inp_list[i], band_inp_list[i], slice_num, j))
-                new_pos  = np.load(temp_dir_list[i] + "after_smooth_{}_{:0>3d}_pos.npy".format(\
-                                                                                        band_inp_list[i], slice_ind_list[j]))
-                new_num  = np.load(temp_dir_list[i] + "after_smooth_{}_{:0>3d}_num.npy".format(\
-                                                                                        band_inp_list[i], slice_ind_list[j]))
-                pos      = np.concatenate((pos, new_pos), axis=0)
-                num      = np.concatenate((num, new_num), axis=0)
-                drawProgressBar(float(j+1)/slice_num)
-
-            # If no slice needed
-            if slice_num <= 1:
-                join_pos, join_num = pos, num
-            # Sort explictly
-            sort_ind = np.lexsort(tuple(np.transpose(join_pos)))
-            sort_pos = np.array(join_pos[sort_ind], dtype=int)
-            sort_num = np.array(join_num[sort_ind], dtype=float)
-            pos, num = cascade_array(sort_pos, sort_num)
-
-        # Save all band result
-        chdir(out_dir)
-        np.save("after_smooth_lack_{:d}_{}_all_cas_pos".format(lack_inp_list[i], band_inp_list[i]), pos)
-        np.save("after_smooth_lack_{:d}_{}_all_cas_num".format(lack_inp_list[i], band_inp_list[i]), num)
-        chdir('../')
+
+    # Load inputs (memory-mapped, shared read-only by processes) and make smooth tasks
+    beam_list = [np.load(beam_dir + '{:d}d_beam_sigma{:d}.npy'.format(int(dim-lack), sigma), mmap_mode='r') \
+                 for lack in range(lack_lim)]
+    input_pos_list = [np.load(band_dir + 'Lack_{:d}_{}_pos.npy'.format(lack_inp_list[i], band_inp_list[i]), mmap_mode='r') \
+                      for i in range(len(band_inp_list))]
+    input_num_list = [np.load(band_dir + 'Lack_{:d}_{}_num.npy'.format(lack_inp_list[i], band_inp_list[i]), mmap_mode='r') \
+                      for i in range(len(band_inp_list))]
+    if slice_num == 'auto':
+        slice_num = advise_slice_num(input_pos_list, [beam_list[lack] for lack in lack_inp_list], shape, mem_limit, \
+                                     cpu_count() if n_proc < 0 else n_proc, one_by_one == 'yes', backend)
+        print('Advised slice_num: {:d}'.format(slice_num))
+    slice_num = int(slice_num)
+
+    # Resume from progress manifest: skip finished band combinations and slices with saved runs
+    manifest_name = out_dir + 'progress.json'
+    params   = {'dim': dim, 'cube': cube, 'sigma': sigma, 'bond': bond, 'refD': refD, 'slice_num': slice_num, 'backend': backend}
+    manifest = Load_Manifest(manifest_name, params)
+    band_key_list   = ['{:d}_{}'.format(lack_inp_list[i], band_inp_list[i]) for i in range(len(band_inp_list))]
+    run_dir_list    = [out_dir + 'Runs_{}/'.format(band_inp_list[i]) for i in range(len(band_inp_list))]
+    out_prefix_list = [out_dir + 'after_smooth_lack_{:d}_{}_all_cas'.format(lack_inp_list[i], band_inp_list[i]) \
+                       for i in range(len(band_inp_list))]
+    run_lists = [[None] * slice_num for i in range(len(band_inp_list))]
+    task_list, merge_list = [], []
+    for i, (input_pos, input_num) in enumerate(zip(input_pos_list, input_num_list)):
+        signature = Get_File_Signature([band_dir + 'Lack_{:d}_{}_pos.npy'.format(lack_inp_list[i], band_inp_list[i]), \
+                                        band_dir + 'Lack_{:d}_{}_num.npy'.format(lack_inp_list[i], band_inp_list[i]), \
+                                        beam_dir + '{:d}d_beam_sigma{:d}.npy'.format(int(dim-lack_inp_list[i]), sigma)])
+        state = manifest['bands'].get(band_key_list[i])
+        if state is None or state['input'] != signature:
+            state = {'input': signature, 'slices': [], 'done': False}
+            manifest['bands'][band_key_list[i]] = state
+        if state['done'] and path.isfile(out_prefix_list[i] + '_pos.npy') and path.isfile(out_prefix_list[i] + '_num.npy'):
+            continue
+        state['done'] = False
+        if not path.isdir(run_dir_list[i]):
+            system('mkdir ' + run_dir_list[i])
+        end_cuts  = Get_Slice_Cuts(len(input_pos), slice_num)
+        for j in range(slice_num):
+            if j in state['slices']:
+                run_lists[i][j] = Load_Run(run_dir_list[i], j)
+            if run_lists[i][j] is None:
+                task_list.append((i, j, input_pos[end_cuts[j]:end_cuts[j+1]], input_num[end_cuts[j]:end_cuts[j+1]]))
+        state['slices'] = [j for j in range(slice_num) if run_lists[i][j] is not None]
+        if len(state['slices']) == slice_num:
+            merge_list.append(i)
+    Save_Manifest(manifest_name, manifest)
+    band_todo = sorted(set([task[0] for task in task_list] + merge_list))
+    print('Resume: {:d} of {:d} band combinations done, {:d} slices to smooth'.format(\
+          len(band_inp_list) - len(band_todo), len(band_inp_list), len(task_list)))
+
+    # Start calculation (results come back in task order, band by band)
+    print('Smooth {:d} band combinations in {:d} slices with n_proc = {:d}'.format(len(band_inp_list), slice_num, n_proc))
+    # No process pool if all slices are already done (resumed run)
+    results = iter([])
+    if len(task_list) > 0:
+        results = Parallel(n_jobs=n_proc, return_as='generator')(\
+                  delayed(smooth_beam)(input_pos, input_num, beam_list[lack_inp_list[i]], shape, backend) \
+                  for i, j, input_pos, input_num in task_list)
+        results = zip(task_list, results)
+    b_start = time.time()
+    for i in band_todo:
+        state = manifest['bands'][band_key_list[i]]
+        used_backend = 'resumed'
+        while len(state['slices']) < slice_num:
+            (_, j, _, _), (pos, num, used_backend) = next(results)
+            # Smoothed slice is a sorted run of packed keys, saved as checkpoint
+            keys = pack_pos_vec(pos, radix) if len(pos) > 0 else np.zeros(0, dtype=np.uint64)
+            run_lists[i][j] = Spill_Run(run_dir_list[i], j, keys, num)
+            if one_by_one == 'no':
+                run_lists[i][j] = (keys, num)
+            state['slices'].append(j)
+            Save_Manifest(manifest_name, manifest)
+            drawProgressBar(float(len(state['slices']))/slice_num)
+
+        # Merge all slices of band combination in one pass, then mark done and remove runs
+        Merge_Band_Runs(run_lists[i], radix, out_prefix_list[i])
+        run_lists[i] = None
+        state['done'], state['slices'] = True, []
+        Save_Manifest(manifest_name, manifest)
+        system('rm -fr ' + run_dir_list[i])
         b_end   = time.time()
-        print('\n{} took {:.3f} sec'.format(band_inp_list[i], b_end-b_start))
+        print('\n{} ({}) took {:.3f} sec'.format(band_inp_list[i], used_backend, b_end-b_start))
+        b_start = time.time()
     m_end   = time.time()
     print('\nAll band gaussian smooth took {:.3f} sec'.format(m_end-m_start))
@@ -1,53 +1,141 @@
 #!/usr/bin/env python
+'''
+Estimate peak memory and wall time of gaussian smooth for each band combination
+and advise [slice_num] of Do_Gaussian_Smooth_Execution_All.py within RAM budget
+
+Example: [program] [dim] [cube size] [sigma] [bond] [ref-D] [mem_limit] [n_proc] [one_by_one] [calib_num]
+
+# Note:
+    Memory is estimated from position number, beam size and dtype (int64/float64) of smooth_beam backends,
+    time is scaled from a short calibration run on the largest {dim-3}-band combination
+    (largest non-empty combination of any lack level if they are all empty)
+'''
+
 from __future__ import print_function
+import time
 import numpy as np
 from sys import argv, exit
-from os import chdir, path, system
 from itertools import combinations
+from joblib import cpu_count
+from Useful_Functions import *
+
+# Functions
+#================================================
+def Calibrate_Smooth_Rate(input_pos, input_num, beam, shape, calib_num):
+    '''
+    This is to measure seconds per work unit of sparse/dense backends on first calib_num points
+    Return None if there is no point to calibrate on
+    '''
+    if len(input_pos) == 0:
+        return None
+    sample_pos = np.array(input_pos[:calib_num], dtype=np.int64)
+    sample_num = np.array(input_num[:calib_num], dtype=float)
+    no_lack_ind = np.where(sample_pos[0] != -999)[0]
+    rate = {}
+    for backend in ['sparse', 'dense']:
+        # First call compiles numba functions
+        smooth_beam(sample_pos[:1], sample_num[:1], beam, shape, backend)
+        _, _, work, _ = estimate_smooth_slice(len(sample_pos), no_lack_ind, beam, shape, 1, backend)
+        t_start = time.time()
+        smooth_beam(sample_pos, sample_num, beam, shape, backend)
+        rate[backend] = (time.time() - t_start) / work
+    return rate
+
+def Readable_Size(num_byte):
+    '''
+    This is to print bytes in readable unit
+    '''
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if num_byte < 1024.:
+            return '{:.1f} {}'.format(num_byte, unit)
+        num_byte /= 1024.
+    return '{:.1f} TB'.format(num_byte)
+
+# Main Programs
+#================================================
+if __name__ == '__main__':
+    m_start = time.time()
+
+    # Check Inputs
+    if len(argv) not in [6, 7, 8, 9, 10]:
+        exit('\n\tError: Wrong Arguments\
+        \n\tExample: [program] [dim] [cube size] [sigma] [bond] [ref-D] [mem_limit] [n_proc] [one_by_one] [calib_num]\
+        \n\t[dim]: dimension for smooth (for now only "6")\
+        \n\t[cube size]: length of multi-d cube in magnitude unit\
+        \n\t[sigma]: standard deviation for gaussian dist. in magnitude\
+        \n\t[bond]: boundary radius of gaussian beam unit in cell\
+        \n\t[ref-D]: reference dimension which to modulus other dimension to\
+        \n\t[mem_limit]: (optional) RAM budget in GB (default: 8)\
+        \n\t[n_proc]: (optional) number of processes (default: -1, all cores)\
+        \n\t[one_by_one]: (optional) "yes"/"no" as in Do_Gaussian_Smooth_Execution_All.py (default: "no")\
+        \n\t[calib_num]: (optional) number of points in calibration run (default: 2000)\n')
+
+    # Input Variables
+    dim        = int(argv[1])       # Dimension of position vector
+    cube       = float(argv[2])     # Beamsize for each cube
+    sigma      = int(argv[3])       # STD for Gaussian Smooth
+    bond       = int(argv[4])
+    refD       = int(argv[5])       # Reference Beam Dimension
+    mem_limit  = float(argv[6]) * 1024**3 if len(argv) >= 7 else 8. * 1024**3
+    n_proc     = int(argv[7]) if len(argv) >= 8 else -1
+    one_by_one = str(argv[8]) if len(argv) >= 9 else 'no'
+    calib_num  = int(argv[9]) if len(argv) == 10 else 2000
+    lack_lim   = dim - 3 + 1
+    n_worker   = cpu_count() if n_proc < 0 else n_proc
+
+    # Directory
+    posv_dir = 'GPV_{:d}Dposvec_bin{:.1f}/'.format(dim, cube)
+    band_dir = posv_dir + 'Band_pos_num/'
+    beam_dir = 'GPV_smooth_sigma{:d}_bond{:d}_refD{:d}/'.format(sigma, bond, refD)
+    shape    = np.load(posv_dir + 'Shape.npy')
+
+    # Load inputs of band combinations (memory-mapped)
+    band_inp_list, input_list, num_list, beam_list = [], [], [], []
+    for i in range(lack_lim):
+        beam = np.load(beam_dir + '{:d}d_beam_sigma{:d}.npy'.format(dim-i, sigma))
+        for comb in combinations(np.arange(dim), dim-i):
+            band_index = ''.join([str(int(band)) for band in comb])
+            band_inp_list.append(band_index)
+            input_list.append(np.load(band_dir + 'Lack_{:d}_{}_pos.npy'.format(i, band_index), mmap_mode='r'))
+            num_list.append(np.load(band_dir + 'Lack_{:d}_{}_num.npy'.format(i, band_index), mmap_mode='r'))
+            beam_list.append(beam)
+
+    # Advise slice number and calibrate time on the largest {dim-3}-band combination
+    # (or the largest non-empty combination of any lack level if all 3-band combinations are empty)
+    slice_num  = advise_slice_num(input_list, beam_list, shape, mem_limit, n_worker, one_by_one == 'yes')
+    calib_list = [j for j in range(len(input_list)) if len(band_inp_list[j]) == 3 and len(input_list[j]) > 0]
+    if len(calib_list) == 0:
+        calib_list = [j for j in range(len(input_list)) if len(input_list[j]) > 0]
+    rate = None
+    if len(calib_list) > 0:
+        calib_ind = max(calib_list, key=lambda j: len(input_list[j]))
+        rate = Calibrate_Smooth_Rate(input_list[calib_ind], num_list[calib_ind], beam_list[calib_ind], shape, calib_num)
+        print('Calibration on {}: sparse {:.3e} sec/insertion, dense {:.3e} sec/cell step'.format(\
+              band_inp_list[calib_ind], rate['sparse'], rate['dense']))
+    else:
+        print('No position vector in any band combination, skip time calibration')
+
+    # Estimate each band combination
+    print('\n{:>8} {:>10} {:>6} {:>14} {:>8} {:>12} {:>12}'.format('band', 'pos', 'beam', 'pos*beam', 'backend', 'peak mem', 'time (sec)'))
+    max_mem, all_time = 0., 0.
+    for band_index, input_pos, beam in zip(band_inp_list, input_list, beam_list):
+        if len(input_pos) == 0:
+            print('{:>8} {:>10d} {:>6d}'.format(band_index, 0, len(beam)))
+            continue
+        no_lack_ind = np.where(np.asarray(input_pos[0]) != -999)[0]
+        backend, _, work, _ = estimate_smooth_slice(len(input_pos), no_lack_ind, beam, shape, slice_num)
+        peak_mem  = estimate_smooth_memory(len(input_pos), no_lack_ind, beam, shape, slice_num, n_worker, one_by_one == 'yes')
+        band_time = slice_num * work * rate[backend] / min(n_worker, slice_num)
+        max_mem   = max(max_mem, peak_mem)
+        all_time += band_time
+        print('{:>8} {:>10d} {:>6d} {:>14d} {:>8} {:>12} {:>12.1f}'.format(\
+              band_index, len(input_pos), len(beam), len(input_pos)*len(beam), backend, Readable_Size(peak_mem), band_time))
 
-#=========================================================================================
-# Input variables
-if len(argv) != 6:
-    exit('\n\tError: Wrong Arguments\
-    \n\tExample: [program] [dim] [cube size] [sigma] [bond] [ref-D]\
-    \n\t[dim]: dimension for smooth (for now only "6")\
-    \n\t[cube size]: length of multi-d cube in magnitude unit\
-    \n\t[sigma]: standard deviation for gaussian dist. in magnitude\
-    \n\t[bond]: boundary radius of gaussian beam unit in cell\
-    \n\t[ref-D]: reference dimension which to modulus other dimension to\n')
-
-dim      = int(argv[1])       # Dimension of position vector
-cube     = float(argv[2])     # Beamsize for each cube
-sigma    = int(argv[3])       # STD for Gaussian Smooth
-bond     = int(argv[4])
-refD     = int(argv[5])       # Reference Beam Dimension
-lack_lim = dim - 3 + 1
-
-posv_dir = 'GPV_{:d}Dposvec_bin{:.1f}/'.format(dim, cube)
-band_dir = posv_dir + 'Band_pos_num/'
-beam_dir = 'GPV_smooth_sigma{:d}_bond{:d}_refD{:d}/'.format(sigma, bond, refD)
-shape    = list(np.load(posv_dir + "Shape.npy"))
-
-max_list = []
-for i in range(lack_lim):
-    max_lack = 0
-    beam = np.load(beam_dir + '{:d}d_beam_sigma{:d}.npy'.format(dim-i, sigma))
-    beam_loop = len(beam)
-    print('\n# {:d}d_beam: {:d}'.format(dim-i, beam_loop))
-    for comb in combinations(np.arange(dim), dim-i):
-        band_list = list(comb)
-        band_index = ''
-        for band in band_list:
-            band_index += str(int(band))
-        posv_list = np.load(band_dir + 'Lack_{:d}_{}_pos.npy'.format(i, band_index))
-        posv_loop = len(posv_list)
-        print('# {}: {:d} | # {} * Beam = {:d}'.format(band_index, posv_loop, band_index, posv_loop*beam_loop))
-        if posv_loop*beam_loop > max_lack:
-            max_lack = posv_loop*beam_loop
-    max_list.append(max_lack)
-
-print('\n# Max Loop: ')
-for i in range(len(max_list)):
-    print('# Lack{:d} Max Loop = {:d}'.format(i, max_list[i]))
-
-#TODO Add estimate storage size, and time that may need
+    print('\nRAM budget: {} with {:d} process(es)'.format(Readable_Size(mem_limit), n_worker))
+    print('Advised slice_num: {:d} (peak memory {}, total time {:.1f} sec)'.format(slice_num, Readable_Size(max_mem), all_time))
+    if max_mem > mem_limit:
+        print('Warning: estimated peak memory is over RAM budget even with {:d} slices'.format(slice_num))
+    print('Do_Gaussian_Smooth_Execution_All.py {:d} {:.1f} {:d} {:d} {:d} {:d} {} {:d}'.format(\
+          dim, cube, sigma, bond, refD, slice_num, one_by_one, n_proc))
+    m_end = time.time()
+    print('\nAdviser took {:.3f} sec'.format(m_end-m_start))
@@ -5,7 +5,7 @@ import time
 import numpy as np
 from sys import argv, exit
 from os import chdir, path, system
-from numba import jit
+from Useful_Functions import *
 
 #=========================================================================================
 # Input variables
@@ -44,41 +44,7 @@ band_dir = posv_dir + 'Band_pos_num/'
 slic_dir = band_dir + 'Slice_{}_{:0>3d}/'.format(band_inp, slice_num)
 out_dir  = 'GPV_after_smooth_{:d}D_bin{:.1f}_sigma{:d}_bond{:d}_refD{:d}/'.format(dim, cube, sigma, bond, refD)
 temp_dir = out_dir  + 'After_Smooth_{}/'.format(band_inp)
-
-#================================================
-# Main Functions
-@jit(nopython=True)
-def cascade_array(sort_position, sort_value):
-    '''
-    Use this to find out sources locate in same position and cascade them
-    Note: No tuple() support in numba, No format() support in numba
-    '''
-    #================================================
-    # Input
-    after_cascade_pos = []
-    after_cascade_value = []
-    start = 0
-    end   = 0
-    for i in range(len(sort_value)-1):
-        #================================================
-        # Indicator
-        #if i % 1000 == 0 and i>999:
-        #    print(float(i+1)/len(sort_value))
-        #================================================
-        # Get reference and target
-        tar, ref = sort_position[i], sort_position[i+1]
-        end += 1
-        #================================================
-        # Determine repeated or not
-        if not np.all(np.equal(tar, ref)):
-            after_cascade_pos.append(sort_position[start])
-            after_cascade_value.append(np.sum(sort_value[start:end]))
-            start = end
-    #================================================
-    # Include the last term
-    after_cascade_pos.append(sort_position[start])
-    after_cascade_value.append(np.sum(sort_value[start:]))
-    return after_cascade_pos, after_cascade_value
+radix    = np.load(posv_dir + 'Shape.npy').astype(np.uint64) + 1
 
 #=========================================================================================
 # Load Position/Probability array
@@ -87,22 +53,14 @@ pos_list, num_list = [], []
 for i in range(len(slice_ind_list)):
     pos = np.load(temp_dir + "after_smooth_{}_{:0>3d}_pos.npy".format(band_inp, slice_ind_list[i]))
     num = np.load(temp_dir + "after_smooth_{}_{:0>3d}_num.npy".format(band_inp, slice_ind_list[i]))
-    pos_list.extend(pos)
-    num_list.extend(num)
+    pos_list.append(np.asarray(pos, dtype=np.int64).reshape(-1, dim))
+    num_list.append(np.asarray(num, dtype=float).reshape(-1))
 
-pos_array = np.array(pos_list)
-num_array = np.array(num_list)
-position_t = np.transpose(pos_array)
-#================================================
-# Sort Input Galaxy Position/Probability array
-sort_ind = np.lexsort(tuple(position_t))
-sort_pos = np.array(pos_array[sort_ind], dtype=int)
-sort_num = np.array(num_array[sort_ind], dtype=float)
+pos_array = np.concatenate(pos_list)
+num_array = np.concatenate(num_list)
 #================================================
-# Cascade Repeated Position
-after_cascade_pos, after_cascade_num = cascade_array(sort_pos, sort_num)
-after_cascade_pos_array = np.array(after_cascade_pos)
-after_cascade_num_array = np.array(after_cascade_num)
+# Sort and cascade repeated position by packed keys
+after_cascade_pos_array, after_cascade_num_array = cascade_pos_vec(pos_array, num_array, radix)
 #================================================
 # Save result
 chdir(temp_dir)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 '''
 ------------------------------------------------------------------------------------------------------------
-Example: [program] [dim] [cube size] [sigma] [bond] [ref-D] [band_inp] [fixed_band_id] [lower_bd] [upper_bd] [n_thread]
+Example: [program] [dim] [cube size] [sigma] [bond] [ref-D] [band_inp] [-n_proc] [-method] [-chunk] [-probe_vec] [-posv_dir] [-out_dir]
     Input Variables:
     [dim]:           dimension for smooth (for now only "6")
     [cube size]:     length of multi-d cube in magnitude unit
@@ -9,12 +9,15 @@ Example: [program] [dim] [cube size] [sigma] [bond] [ref-D] [band_inp] [fixed_ba
     [bond]:          boundary radius of gaussian beam unit in cell
     [ref-D]:         reference dimension which to modulus other dimension to
     [band_inp]:      band used to do smooth in string e.g. 012345
-    [fixed_band_id]: index of band that fixed when calculating with different origins
-    [lower_bd]:      bound of input bands except fixed one (unit:cell) e.g. "0,0,0,0,0" or "default"
-    [upper_bd]:      bound of input bands except fixed one (unit:cell) e.g. "9,9,9,9,9" or "default"
-    [n_thread]:      number of thread for parallel computation
+    Options:
+    -n_proc:         number of processes for "probe" method (default: 10, -1: all cores, alias: -n_th)
+    -method:         "group" (default): sort cells by lines and take first/last crossing, "probe": walk probe lines from origins
+    -chunk:          number of origins whose probe lines are looked up in one batch (default: 10000)
+    -probe_vec:      rational probe direction of input bands, e.g. "1,0.5,1,1,1,1" ("probe" method only, default: diagonal)
+    -posv_dir:       directory that stores galaxy position vector and multi-D space shape
+    -out_dir:        directory that stores smoothed galaxy positions and output boundaries
 ------------------------------------------------------------------------------------------------------------
-Latest Updated: 2020.09.19 Jordan Wu'''
+Latest Updated: 2026.10.18 Jordan Wu'''
 
 # Import Modules
 #==========================================================
@@ -22,7 +25,7 @@ from __future__ import print_function
 from sys import argv, exit
 from os import chdir
 from argparse import ArgumentParser
-from joblib import Parallel, delayed
+from joblib import Parallel, delayed, cpu_count
 import numpy as np
 import time
 from All_Variables import *
@@ -53,50 +56,17 @@ def generate_origins_on_plane(shape, band_inp, sc_fixed_bd, sc_lower_bd, sc_uppe
         origin_list.append(np.array(new_origin))
     return origin_list
 
-def generate_probe_line(origin, probe_vec, band_upper_bd):
+def get_gp_along_line(lack_ind_list, probe_line, store_keys, store_nums, radix):
     '''
-    This is used to generate line array along probe vector direction
-    Here assuming probe vector components are "all positive" or "all negative"
-    Here input origin should start on "0" of the fixed band
+    This is used to get galaxy probability along probe line(s)
+    All points are looked up in sorted packed keys of galaxy positions in one batch (0 if not found)
     '''
-    # Initialize probe vector direction
-    probe_vec = np.array(probe_vec)
-    if np.all(np.less_equal(probe_vec, np.zeros(len(band_upper_bd)))):
-        probe_vec = -1 * probe_vec
-    # Prevent infinite loops
-    if np.any(np.less(probe_vec, np.zeros(len(band_upper_bd)))):
-        exit('Wrong probe vector ...')
-    # Larger than origin
-    probe_line, pos, i = [], origin, 1
-    while np.all(np.less(pos, band_upper_bd-0.5)):
-        probe_line.append(pos)
-        pos = origin + (i * probe_vec)
-        i += 1
-    # Round and store in array
-    probe_round = np.rint(probe_line)
-    probe_line  = np.array(probe_round, dtype=int)
-    return probe_line
-
-def get_gp_along_line(lack_ind_list, probe_line, gal_pos, gal_num):
-    '''
-    This is used to get galaxy probability along probe line
-    '''
-    gp_along_line = []
-    for i in range(len(probe_line)):
-        # Assign -999 to lack band
-        probe_pos = list(probe_line[i])
-        for lack_ind in lack_ind_list:
-            probe_pos.insert(lack_ind, -999)
-        probe_pos = np.array(probe_pos)
-        loc_id = find_pos_id_in_gal_pos(gal_pos, probe_pos)
-        if (len(loc_id) == 1):
-            num = float(gal_num[loc_id])
-        elif (len(loc_id) == 0):
-            num = 0.
-        else:
-            exit('Wrong loc_id ...')
-        gp_along_line.append(num)
-    gp_along_line = np.array(gp_along_line)
+    # Assign -999 to lack band
+    inp_ind_list = [i for i in range(len(radix)) if i not in lack_ind_list]
+    probe_pos = np.full((len(probe_line), len(radix)), -999, dtype=np.int64)
+    probe_pos[:, inp_ind_list] = probe_line
+    gp_along_line, found = search_gp_store(store_keys, store_nums, probe_pos, radix)
+    gp_along_line[~found] = 0.
     return gp_along_line
 
 # def get_gp_along_line_and_delete_pos(probe_line, gal_pos, gal_num):
@@ -121,39 +91,81 @@ def get_gp_along_line(lack_ind_list, probe_line, gal_pos, gal_num):
     # gp_along_line = np.array(gp_along_line)
     # return gp_along_line
 
-def find_gp_boundary(probe_line, gp_along_line):
+def find_bd_of_diff_origins(index, len_origin, origin_array, probe_vec, \
+                            lack_ind_list, band_upper_bd, store_keys, \
+                            store_nums, radix):
     '''
-    This is used to find two boundary end in one probe cut set
+    This is to combine all above functions for a chunk of origins (for parallel computation)
+    Probe lines of the chunk are walked on lattice (integer step probe_vec) and looked up in one batch, bounds are returned in contiguous arrays
     '''
-    ids = np.array([i for i in range(len(gp_along_line))], dtype=int)
-    loc_GE1_id = ids[gp_along_line >= 1.0]
-    if (len(loc_GE1_id) != 0) and (len(loc_GE1_id) != len(gp_along_line)):
-        lower_gp_bound = probe_line[loc_GE1_id[0]]
-        upper_gp_bound = probe_line[loc_GE1_id[-1]]
-    elif (len(loc_GE1_id) == len(gp_along_line)):
-        lower_gp_bound = probe_line[0]
-        upper_gp_bound = probe_line[-1]
-    else:
-        lower_gp_bound = [np.nan] * len(probe_line[0])
-        upper_gp_bound = [np.nan] * len(probe_line[0])
-    return lower_gp_bound, upper_gp_bound
+    # Main calculation
+    probe_all, line_id = walk_lattice_lines(origin_array, probe_vec, band_upper_bd)
+    gp_along_all = get_gp_along_line(lack_ind_list, probe_all, store_keys, store_nums, radix)
+    # First/last point (gp >= 1) of each line are bounds, lines without such point are skipped
+    GE1_id       = np.flatnonzero(gp_along_all >= 1.0)
+    GE1_line     = line_id[GE1_id]
+    is_first     = np.concatenate(([True], GE1_line[1:] != GE1_line[:-1])) if len(GE1_id) > 0 else np.zeros(0, dtype=bool)
+    is_last      = np.concatenate((GE1_line[1:] != GE1_line[:-1], [True])) if len(GE1_id) > 0 else np.zeros(0, dtype=bool)
+    gp_lower_bds = probe_all[GE1_id[is_first]]
+    gp_upper_bds = probe_all[GE1_id[is_last]]
+    # Indicator
+    print('{} / {}'.format(index + len(origin_array), len_origin))
+    return gp_lower_bds, gp_upper_bds
 
-def find_bd_of_diff_origins(index, len_origin, origin, probe_vec, \
-                            lack_ind_list, band_upper_bd, gal_pos, \
-                            gal_num, gp_lower_bd_list, gp_upper_bd_list):
+def find_bd_by_probe(origin_array, probe_vec, lack_ind_list, band_upper_bd, \
+                     store_keys, store_nums, radix, n_proc, chunk_size):
     '''
-    This is to combine all above functions (for parallel computation)
+    This is to find boundaries of all origins in worker processes
+    Sorted keys/numbers are shared with workers as read-only memory maps (joblib), results of chunks are joined in origin order
     '''
-    # Main calculation
-    probe_line    = generate_probe_line(origin, probe_vec, band_upper_bd)
-    gp_along_line = get_gp_along_line(lack_ind_list, probe_line, gal_pos, gal_num)
-    gp_lower_bd, gp_upper_bd = find_gp_boundary(probe_line, gp_along_line)
-    if np.nan not in gp_lower_bd:
-        gp_lower_bd_list.append(gp_lower_bd)
-        gp_upper_bd_list.append(gp_upper_bd)
-    # Indicator
-    if (index >= 100) and (index % 100 == 0):
-        print('{} / {}'.format(index, len_origin))
+    len_origin = len(origin_array)
+    n_worker   = cpu_count() if n_proc < 0 else n_proc
+    chunk_size = max(1, min(chunk_size, -(-len_origin // max(1, n_worker))))
+    results    = Parallel(n_jobs=n_proc, max_nbytes='1M', mmap_mode='r')\
+                 (delayed(find_bd_of_diff_origins)\
+                 (i, len_origin, origin_array[i:i+chunk_size], probe_vec, lack_ind_list, \
+                 band_upper_bd, store_keys, store_nums, radix)\
+                 for i in range(0, len_origin, chunk_size))
+    if len(results) == 0:
+        return np.array([]), np.array([])
+    gp_lower_bounds = np.concatenate([lower_bds for lower_bds, upper_bds in results])
+    gp_upper_bounds = np.concatenate([upper_bds for lower_bds, upper_bds in results])
+    if len(gp_lower_bounds) == 0:
+        return np.array([]), np.array([])
+    return gp_lower_bounds, gp_upper_bounds
+
+def find_bd_by_diag_group(gal_pos, inp_ind_list):
+    '''
+    This is to find boundaries along diagonal (1, 1, ..., 1) of all lines at once without probe lines
+    Cells (num >= 1) keyed by start of their diagonal (pos - min(pos)), sorted by (start, offset min(pos)), first/last cell of each diagonal are bounds
+    Bounds are ordered as origins on planes of each input band (one line per zero component of its start, same as probe lines)
+    '''
+    # Keep cells of input lack pattern only (same as probe lines)
+    lack_bits = sum([1 << i for i in range(gal_pos.shape[1]) if i not in inp_ind_list])
+    sub_pos   = np.array(gal_pos[get_lack_bits(gal_pos) == lack_bits][:, inp_ind_list], dtype=int) \
+                if len(gal_pos) > 0 else np.zeros((0, len(inp_ind_list)), dtype=int)
+    offset    = np.min(sub_pos, axis=1) if len(sub_pos) > 0 else np.zeros(0, dtype=int)
+    start     = sub_pos - offset[:, None]
+    sort_ind  = np.lexsort(tuple([offset] + [start[:, i] for i in range(len(inp_ind_list))[::-1]]))
+    sort_pos  = sub_pos[sort_ind]
+    start     = start[sort_ind]
+    if len(sort_pos) == 0:
+        return np.array([]), np.array([])
+    # First/last cell of each diagonal (same start)
+    new_line  = np.concatenate(([True], np.any(start[1:] != start[:-1], axis=1)))
+    first_ind = np.flatnonzero(new_line)
+    last_ind  = np.concatenate((first_ind[1:], [len(sort_pos)])) - 1
+    line_start = start[first_ind]
+    # Lines through origins on plane of each band (meshgrid order: 2nd off-axis band is the slowest)
+    line_ind_list = []
+    for fixed_ID in range(len(inp_ind_list)):
+        off_ID    = [i for i in range(len(inp_ind_list)) if i != fixed_ID]
+        order_ID  = [off_ID[1], off_ID[0]] + off_ID[2:]
+        plane_ind = np.flatnonzero(line_start[:, fixed_ID] == 0)
+        plane_ind = plane_ind[np.lexsort(tuple([line_start[plane_ind, i] for i in order_ID[::-1]]))]
+        line_ind_list.append(plane_ind)
+    line_ind = np.concatenate(line_ind_list)
+    return sort_pos[first_ind[line_ind]], sort_pos[last_ind[line_ind]]
 
 # Main Program
 #==========================================================
@@ -170,8 +182,14 @@ if __name__ == '__main__':
     parser.add_argument('refD', type=int, help='Reference dimension for gaussian smooth')
     parser.add_argument('band_inp', type=str, help='Indice of bands to use (e.g 12345)')
     # parser.add_argument('sc_fixed_band', type=int, help='Index of band fixed to generate plane to find boundary')
-    parser.add_argument('-n_th', '--Number_of_Thread', type=int, dest='n_thread', default=10, \
-                        help='Number of thread for parallel computation')
+    parser.add_argument('-n_proc', '-n_th', '--Number_of_Process', type=int, dest='n_proc', default=10, \
+                        help='Number of processes for parallel computation (-1: all cores)')
+    parser.add_argument('-method', '--Boundary_Method', type=str, dest='method', default='group', choices=['group', 'probe'], \
+                        help='"group": sort cells by diagonals and take first/last crossing, "probe": walk probe lines from origins')
+    parser.add_argument('-probe_vec', '--Probe_Vector', type=str, dest='probe_vec', default=None, \
+                        help='Rational probe direction of input bands (e.g. "1,0.5,1,1,1,1", "probe" method only), default: diagonal')
+    parser.add_argument('-chunk', '--Chunk_Size', type=int, dest='chunk_size', default=10000, \
+                        help='Number of origins whose probe lines are looked up in one batch')
     parser.add_argument('-posv_dir', '--Position_Vector_Directory', type=str, dest='posv_dir', \
                         help='Directory that stores galaxy position vector and mutl-D space shape')
     parser.add_argument('-out_dir', '--Output_Directory', dest='out_dir', \
@@ -186,7 +204,10 @@ if __name__ == '__main__':
     refD        = args.refD
     band_inp    = args.band_inp
     # sc_fixed_bd = args.sc_fixed_band
-    n_thread    = args.n_thread
+    n_proc      = args.n_proc
+    chunk_size  = args.chunk_size
+    method      = args.method
+    probe_vec   = args.probe_vec
     posv_dir    = args.posv_dir
     out_dir     = args.out_dir
     if posv_dir is None:
@@ -199,19 +220,22 @@ if __name__ == '__main__':
 
     # Load arrays for calculations
     # probe_vec0    = [0] * (len(band_inp)-1); probe_vec0.insert(sc_fixed_bd, 1)
-    probe_vec0    = [1] * dim
+    probe_vec0    = [1] * len(band_inp) if probe_vec is None else get_lattice_step([float(comp) for comp in probe_vec.split(',')])
+    if len(probe_vec0) != len(band_inp):
+        exit('Wrong probe vector: {} components for {} bands'.format(len(probe_vec0), len(band_inp)))
+    if np.all(np.less_equal(probe_vec0, 0)):
+        probe_vec0 = -1 * np.array(probe_vec0)
+    # Prevent lines starting on planes of "0" walking out of space
+    if np.any(np.less(probe_vec0, 0)):
+        exit('Wrong probe vector ...')
+    is_diag       = np.all(np.equal(probe_vec0, 1))
+    if (method == 'group') and not is_diag:
+        exit('Only diagonal probe vector for "group" method, use "-method probe"')
+    bd_suffix     = 'AlDiag' if is_diag else 'AlVec' + '_'.join([str(int(comp)) for comp in probe_vec0])
     shape         = np.load(posv_dir + '/Shape.npy')
     band_upper_bd = np.array([int(shape[int(ind)]) for ind in band_inp])
     band_lower_bd = np.array([0 for ind in band_inp])
 
-    sc_lower_bd_list, sc_upper_bd_list = [], []
-    for i in range(dim):
-        sc_fixed_bd = i
-        sc_lower_bd = [0 for i in range(len(band_inp)-1)]
-        sc_upper_bd = [shape[int(i)] for i in band_inp if int(i) != sc_fixed_bd]
-        sc_lower_bd_list.append(sc_lower_bd)
-        sc_upper_bd_list.append(sc_upper_bd)
-
     # Generate lack band index list
     all_ind_list  = [i for i in range(dim)]
     inp_ind_list  = [int(band_inp[i]) for i in range(len(band_inp))]
@@ -220,6 +244,16 @@ if __name__ == '__main__':
         if ind not in inp_ind_list:
             lack_ind_list.append(ind)
 
+    # Origins on planes of bands that probe lines move along
+    plane_bd_list = [inp_ind_list[i] for i in range(len(band_inp)) if probe_vec0[i] > 0]
+    sc_lower_bd_list, sc_upper_bd_list = [], []
+    for sc_fixed_bd in plane_bd_list:
+        sc_lower_bd = [0 for i in range(len(band_inp)-1)]
+        sc_upper_bd = [shape[int(i)] for i in band_inp if int(i) != sc_fixed_bd]
+        sc_lower_bd_list.append(sc_lower_bd)
+        sc_upper_bd_list.append(sc_upper_bd)
+    tot_len_origin = int(sum([np.prod(sc_upper_bd) for sc_upper_bd in sc_upper_bd_list]))
+
     # Galaxy position vector and number (Remove pos with num < 1.0 to increase efficiency)
     print('\nLoad galaxy position vectors and correspoding values ...')
     gal_pos = np.load(out_dir + '/after_smooth_lack_{}_{}_all_cas_pos.npy'.format(dim-len(band_inp), band_inp))
@@ -227,45 +261,49 @@ if __name__ == '__main__':
     gal_pos = gal_pos[gal_num >= 1.0]
     gal_num = gal_num[gal_num >= 1.0]
 
+    # Group-by boundary extraction (no origins/probe lines)
+    if method == 'group':
+        s_start = time.time()
+        print('\nFind boundaries of {:d} diagonal lines by grouping cells ...'.format(tot_len_origin))
+        gp_lower_bounds, gp_upper_bounds = find_bd_by_diag_group(gal_pos, inp_ind_list)
+
     # Use different origins to find boundaries
-    print('\nGenerate origins on multi-D magnitude space ...')
-    origin_lists = []
-    tot_len_origin = 0
-    for i in range(dim):
-        sc_fixed_bd = i
-        origin_list = generate_origins_on_plane(shape, band_inp, sc_fixed_bd, sc_lower_bd_list[i], sc_upper_bd_list[i])
-        len_origin  = len(origin_list)
-        print('\nFixed band id: {}\nOrigins lower bound: {}\nOrigins upper bound: {}\n# of origins: {:d}'.format(\
-                sc_fixed_bd, sc_lower_bd, sc_upper_bd, len_origin))
-        origin_lists += origin_list
-        tot_len_origin += len_origin
-    print('\nTotal {:d} direction:\nOrigins lower bound: {}\nOrigins upper bound: {}\n# of origins: {:d}'.format(\
-            dim, sc_lower_bd, sc_upper_bd, tot_len_origin))
-    p_end   = time.time()
-    print('\nGenerate mult-d origins took {:.3f} secs'.format(p_end-p_start))
+    else:
+        # Sorted packed keys of galaxy positions for batch lookup
+        radix      = shape.astype(np.uint64) + 1
+        gal_keys   = pack_pos_vec(gal_pos, radix) if len(gal_pos) > 0 else np.zeros(0, dtype=np.uint64)
+        sort_ind   = np.argsort(gal_keys)
+        store_keys = gal_keys[sort_ind]
+        store_nums = gal_num[sort_ind]
+
+        print('\nGenerate origins on multi-D magnitude space ...')
+        origin_lists = []
+        for i, sc_fixed_bd in enumerate(plane_bd_list):
+            origin_list = generate_origins_on_plane(shape, band_inp, sc_fixed_bd, sc_lower_bd_list[i], sc_upper_bd_list[i])
+            len_origin  = len(origin_list)
+            print('\nFixed band id: {}\nOrigins lower bound: {}\nOrigins upper bound: {}\n# of origins: {:d}'.format(\
+                    sc_fixed_bd, sc_lower_bd_list[i], sc_upper_bd_list[i], len_origin))
+            origin_lists += origin_list
+        print('\nTotal {:d} planes (probe vector {}):\n# of origins: {:d}'.format(len(plane_bd_list), list(probe_vec0), tot_len_origin))
+        p_end   = time.time()
+        print('\nGenerate mult-d origins took {:.3f} secs'.format(p_end-p_start))
 
-    # Parallel Computing (Note: require='sharedmen' is essential for list parallel)
-    s_start = time.time()
-    print('\nStart finding boundary ...\n')
-    gp_lower_bd_list, gp_upper_bd_list = [], []
-    Parallel(n_jobs=n_thread, require='sharedmem')\
-            (delayed(find_bd_of_diff_origins)\
-            (i, tot_len_origin, origin_lists[i], probe_vec0, lack_ind_list, \
-            band_upper_bd, gal_pos, gal_num, gp_lower_bd_list, gp_upper_bd_list)\
-            for i in range(tot_len_origin))
+        # Parallel Computing over chunks of origins in worker processes (results are joined in origin order)
+        s_start = time.time()
+        print('\nStart finding boundary ...\n')
+        gp_lower_bounds, gp_upper_bounds = find_bd_by_probe(np.array(origin_lists, dtype=int).reshape(-1, len(band_inp)), \
+                                           probe_vec0, lack_ind_list, band_upper_bd, store_keys, store_nums, radix, n_proc, chunk_size)
 
     # Store boundaries
-    gp_lower_bounds = np.array(gp_lower_bd_list)
-    gp_upper_bounds = np.array(gp_upper_bd_list)
     chdir(out_dir)
-    np.save('after_smooth_lack_{:d}_{}_{:d}D_lower_bounds_AlDiag'.format(\
-            dim-len(band_inp), band_inp, dim, sc_fixed_bd), gp_lower_bounds)
-    np.save('after_smooth_lack_{:d}_{}_{:d}D_upper_bounds_AlDiag'.format(\
-            dim-len(band_inp), band_inp, dim, sc_fixed_bd), gp_upper_bounds)
+    np.save('after_smooth_lack_{:d}_{}_{:d}D_lower_bounds_{}'.format(\
+            dim-len(band_inp), band_inp, dim, bd_suffix), gp_lower_bounds)
+    np.save('after_smooth_lack_{:d}_{}_{:d}D_upper_bounds_{}'.format(\
+            dim-len(band_inp), band_inp, dim, bd_suffix), gp_upper_bounds)
     chdir('../')
 
     # Print out result ...
     s_end   = time.time()
     print('\nWhole Finding {:d}D boundary took {:.3f} secs\
            \nAverage time for each probe: {:.3f} secs\n'.format(\
-           dim, s_end-p_start, (s_end-s_start)/len(origin_list)))
+           dim, s_end-p_start, (s_end-s_start)/tot_len_origin))
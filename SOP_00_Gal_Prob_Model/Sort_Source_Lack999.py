@@ -1,11 +1,10 @@
 #!/usr/bin/env python
 from __future__ import print_function
 import time
-import sys
 import numpy as np
-from numba import jit
 from os import system, chdir, path
 from sys import argv, exit
+from Useful_Functions import *
 
 if len(argv) != 3:
     exit('\n\tError: Wrong Arguments\
@@ -29,43 +28,30 @@ if path.isdir(lack_dir):
 else:
     system('mkdir ' + lack_dir)
 
-#=======================================================
-# Functions
-def drawProgressBar(percent, barLen = 50):
-    # percent float from 0 to 1.
-    sys.stdout.write("\r")
-    sys.stdout.write("[{:<{}}] {:.3f}%".format("=" * int(barLen * percent), barLen, (percent * 100)))
-    sys.stdout.flush()
-
 #=======================================================
 # Loading ...
 print("\nLoading ...")
 l_start = time.time()
-gal_pos = np.load(posv_dir + "Gal_Position_vectors.npy")
+gal_pos = np.load(posv_dir + "Gal_Position_vectors.npy").reshape(-1, dim)
 gal_num = np.load(posv_dir + "Gal_Position_numbers.npy")
 l_end   = time.time()
 print("Loading galaxy position vector/num took {:.3f} sec\n".format(l_end-l_start))
 
-# Sort
+# Sort (group all sources by lack number in one pass, every lack level is a view of sorted array)
 w_start = time.time()
+sort_ind, level_slice, _ = group_pos_vec_by_lack(gal_pos)
+sort_pos = gal_pos[sort_ind]
+sort_num = gal_num[sort_ind]
 for i in range(lack_lim):
-    lack_pos = []
-    lack_num = []
-    total_pos = len(gal_pos)
     s_start = time.time()
     print('Filter out lack {:d} band'.format(i))
-    for j in range(total_pos):
-        drawProgressBar(float(j+1) / total_pos)
-        if len(np.where(gal_pos[j] == -999)[0]) == i:
-            lack_pos.append(gal_pos[j])
-            lack_num.append(gal_num[j])
-    lack_pos_array = np.array(lack_pos)
-    lack_num_array = np.array(lack_num)
+    lack_pos_array = sort_pos[level_slice.get(i, slice(0, 0))]
+    lack_num_array = sort_num[level_slice.get(i, slice(0, 0))]
     chdir(lack_dir)
     np.save('Lack_{:d}{:d}_pos'.format(i, i), lack_pos_array)
     np.save('Lack_{:d}{:d}_num'.format(i, i), lack_num_array)
     chdir('../../')
     s_end     = time.time()
-    print('\nFilter out lack {:d} band took {:.3f} sec\n'.format(i, s_end-s_start))
+    print('Filter out lack {:d} band took {:.3f} sec\n'.format(i, s_end-s_start))
 w_end   = time.time()
 print('Whole sorting process took {:.3f} sec\n'.format(w_end-w_start))
@@ -3,10 +3,10 @@ from __future__ import print_function
 import sys
 import time
 import numpy as np
-from numba import jit
 from os import system, chdir, path
 from sys import argv, exit
 from itertools import combinations
+from Useful_Functions import *
 
 if len(argv) != 3:
     exit('\n\tError: Wrong Arguments\
@@ -22,6 +22,7 @@ cube     = float(argv[2])     # Beamsize for each cube
 posv_dir = 'GPV_' + str(dim) + 'Dposvec_bin' + str(cube) + '/'
 lack_dir = posv_dir + 'Lack_pos_num/'
 band_dir = posv_dir + 'Band_pos_num/'
+radix    = np.load(posv_dir + 'Shape.npy').astype(np.uint64) + 1
 
 # Check storage directory
 if path.isdir(band_dir):
@@ -41,48 +42,6 @@ def drawProgressBar(percent, barLen = 50):
     sys.stdout.write("[{:<{}}] {:.3f}%".format("=" * int(barLen * percent), barLen, (percent * 100)))
     sys.stdout.flush()
 
-@jit(nopython=True)
-def sort_band_wo_lack(sort_pos, sort_num):
-    comb_pos = []
-    comb_num = []
-    for j in range(len(sort_pos)):
-        sort_pos_j = sort_pos[j]
-        comb_pos.append(sort_pos[j])
-        comb_num.append(sort_num[j])
-    return comb_pos, comb_num
-
-@jit(nopython=True)
-def sort_band_wi_lack(sort_pos, sort_num, band_ind):
-    '''
-    Note: numba not support dtype=int, all is default float
-    '''
-    # Create no band index list
-    no_band_ind = []
-    for l in range(dim):
-        inlist = 0
-        for m in range(len(band_ind)):
-            if band_ind[m] == l:
-                inlist += 1
-        if inlist == 0:
-            no_band_ind.append(l)
-    # Create reference array (lack is -999.)
-    ref = -999 * np.ones(dim)
-    for ind in band_ind:
-        ref[band_ind] = 0.
-    # Start sort by band
-    comb_pos = []
-    comb_num = []
-    for j in range(len(sort_pos)):
-        sort_pos_j = sort_pos[j]
-        tar = -999 * np.ones(dim)
-        for k, bd in enumerate(sort_pos_j):
-            if bd != -999:
-                tar[k] = 0.
-        if np.array_equal(tar, ref):
-            comb_pos.append(sort_pos[j])
-            comb_num.append(sort_num[j])
-    return comb_pos, comb_num
-
 #=======================================================
 # Main Program
 p_start = time.time()
@@ -93,10 +52,12 @@ for i in range(lack_lim):
     l_start  = time.time()
     lack_pos = np.load(lack_dir + 'Lack_{:d}{:d}{:d}_pos.npy'.format(i, i, i))
     lack_num = np.load(lack_dir + 'Lack_{:d}{:d}{:d}_num.npy'.format(i, i, i))
-    lack_pos_t = np.transpose(lack_pos)
-    sort_ind = np.lexsort(tuple(lack_pos_t))
-    sort_pos = np.array(lack_pos[sort_ind])
-    sort_num = np.array(lack_num[sort_ind])
+    lack_pos = np.asarray(lack_pos, dtype=np.int64).reshape(-1, dim)
+    sort_ind = np.argsort(pack_pos_vec(lack_pos, radix), kind='stable')
+    # Group by lack pattern in one stable sort (packed key order kept in every band combination)
+    group_ind, _, bits_slice = group_pos_vec_by_lack(lack_pos[sort_ind])
+    sort_pos = np.array(lack_pos[sort_ind][group_ind])
+    sort_num = np.array(lack_num[sort_ind][group_ind])
     l_end    = time.time()
     print('\nLoading and sorting LACK{:d} took {:.3f} sec'.format(i, l_end-l_start))
 
@@ -104,14 +65,10 @@ for i in range(lack_lim):
     for comb in combinations(np.arange(dim), dim-i):
         band_ind = np.array(comb)
         c_start  = time.time()
-        # No Lack case
-        if i == 0:
-            comb_pos, comb_num = sort_band_wo_lack(sort_pos, sort_num)
-        # Lack N case
-        else:
-            comb_pos, comb_num = sort_band_wi_lack(sort_pos, sort_num, band_ind)
-        comb_pos_array = np.array(comb_pos)
-        comb_num_array = np.array(comb_num)
+        # Sources lacking exactly bands not in combination (view of grouped array)
+        comb_bits = sum([1 << l for l in range(dim) if l not in comb])
+        comb_pos_array = sort_pos[bits_slice.get(comb_bits, slice(0, 0))]
+        comb_num_array = sort_num[bits_slice.get(comb_bits, slice(0, 0))]
 
         # Saving with band indice
         band_out = ''
@@ -9,10 +9,10 @@ Example: [program] [dim] [cube size] [sigma] [bond] [ref-D]
     [bond]:      boundary radius of gaussian beam unit in cell\
     [ref-D]:     reference dimension which to modulus other dimension to\n')
 
-Caution: This program must be run under PYTHON 2
-         Otherwise, numpy dictionary array loading will go wrong ...
+Note: Output is GP store (GP_Store_[dim]d_key/num/radix.npy) instead of pickled dictionaries
+      Keys are packed position vectors (sorted), num are galaxy counts of each key
 ------------------------------------------------------------------------------------------------------------
-Latest Updated: 2020.07.14 Jordan Wu'''
+Latest Updated: 2026.10.18 Jordan Wu'''
 
 # Import Modules
 #==========================================================
@@ -51,42 +51,35 @@ if __name__ == '__main__':
     refD        = int(argv[5])       # Reference Beam Dimension
     out_prefix  = 'GPV_after_smooth_{:d}D_bin{:.1f}_sigma{:d}_bond{:d}_refD{:d}'.format(dim, cube, sigma, bond, refD)
     out_dir     = '{}/'.format(out_prefix)
+    posv_dir    = 'GPV_{:d}Dposvec_bin{:.1f}/'.format(dim, cube)
+    radix       = np.array(np.load(posv_dir + 'Shape.npy'), dtype=np.uint64) + 1
 
-    # Update dictionary for different lack band number
+    # Update store for different lack band number
+    all_pos_arr_ls, all_num_arr_ls = [], []
     for lack in range(dim-3+1):
         print('\nCombining Lack {:d} sources pos/num...'.format(lack))
 
         # Generate different lack list
         lack_pos_ls = sorted(glob.glob('{}/after_smooth_lack_{:d}_*_all_cas_pos.npy'.format(out_prefix, lack)))
         lack_num_ls = sorted(glob.glob('{}/after_smooth_lack_{:d}_*_all_cas_num.npy'.format(out_prefix, lack)))
-        lack_pos_arr_ls = [np.load(lack_pos) for lack_pos in lack_pos_ls]
-        lack_num_arr_ls = [np.load(lack_num) for lack_num in lack_num_ls]
         print('\n'.join(lack_pos_ls))
         print('\n'.join(lack_num_ls))
 
         # Combined different lack list into one
-        comb_num, tot_num = 0, sum([len(lack_num_arr) for lack_num_arr in lack_num_arr_ls])
-        lack_pos_list, lack_num_list = [], []
-        for i in range(len(lack_num_arr_ls)):
-            lack_pos_arr = lack_pos_arr_ls[i]
-            lack_num_arr = lack_num_arr_ls[i]
-            for j in range(len(lack_num_arr)):
-                lack_pos = lack_pos_arr[j]
-                lack_num = lack_num_arr[j]
-                lack_pos_list.append(lack_pos)
-                lack_num_list.append(lack_num)
-                comb_num += 1
-                drawProgressBar(float(comb_num) / tot_num)
+        for i in range(len(lack_num_ls)):
+            lack_pos_arr = np.array(np.load(lack_pos_ls[i]), dtype=np.int64).reshape(-1, dim)
+            lack_num_arr = np.array(np.load(lack_num_ls[i]), dtype=float).reshape(-1)
+            all_pos_arr_ls.append(lack_pos_arr)
+            all_num_arr_ls.append(lack_num_arr)
+            drawProgressBar(float(i+1) / len(lack_num_ls))
 
-        # Save output dictionary (key in tuple)
-        print('\n\nSaving Lack {:d} sources dictionary'.format(lack))
-        out_dict = dict()
-        for i in range(len(lack_num_list)):
-            out = {tuple(lack_pos_list[i]): float(lack_num_list[i])}
-            out_dict.update(out)
-        np.save('{}all_detect_grid_Full_{:d}d.npy'.format(out_dir, dim-lack), out_dict)
-        print('{}all_detect_grid_Full_{:d}d.npy'.format(out_dir, dim-lack))
+    # Save output store (sorted packed keys)
+    print('\n\nSaving all lack sources store')
+    all_pos_arr = np.concatenate(all_pos_arr_ls) if len(all_pos_arr_ls) > 0 else np.zeros((0, dim), dtype=np.int64)
+    all_num_arr = np.concatenate(all_num_arr_ls) if len(all_num_arr_ls) > 0 else np.zeros(0)
+    store_keys, _ = save_gp_store('{}GP_Store_{:d}d'.format(out_dir, dim), all_pos_arr, all_num_arr, radix)
+    print('{}GP_Store_{:d}d_key/num/radix.npy ({:d} keys)'.format(out_dir, dim, len(store_keys)))
 
     # Print out result ...
     s_end   = time.time()
-    print('\nUpdate Galaxy Probability Dictionary For all Lack Bands took {:.3f} secs\n'.format(s_end-s_start))
+    print('\nUpdate Galaxy Probability Store For all Lack Bands took {:.3f} secs\n'.format(s_end-s_start))
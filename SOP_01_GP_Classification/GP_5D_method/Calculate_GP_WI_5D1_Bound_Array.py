@@ -13,8 +13,10 @@ Input Variables:
     [sigma]: standard deviation for gaussian dist. in magnitude
     [bond]: boundary radius of gaussian beam unit in cell
     [ref-D]: reference dimension which to modulus other dimension to
+    [n_proc]: (optional) number of processes to classify catalog shards (default: 1, -1: all cores)
+    [block_size]: (optional) number of rows read, classified and written at a time (default: 100000)
 ----------------------------------------------------------------
-Latest update: 2020/05/26 Jordan Wu'''
+Latest update: 2026/10/18 Jordan Wu'''
 
 # Import Modules
 #======================================================================================
@@ -22,7 +24,6 @@ from __future__ import print_function
 from sys import argv, exit
 import numpy as np
 import time
-import copy
 from All_Variables import *
 from Hsieh_Functions import *
 from Useful_Functions import *
@@ -52,21 +53,6 @@ MP1_qua_ID = qua_ID_Spitzer[4]
 
 # Functions
 #======================================================================================
-def Remove_AGB(mag_list, IR2_mag_ID=IR2_mag_ID, IR3_mag_ID=IR3_mag_ID, MP1_mag_ID=MP1_mag_ID):
-    '''
-    This is to check if object in input catalog is AGB
-    Input datatype: magnitude, int, int, int
-    '''
-    # Remove AGB
-    AGB_flag = 'Not_AGB'
-    if (IR2_mag_ID is not np.nan) and (IR3_mag_ID is not np.nan) and (MP1_mag_ID is not np.nan):
-        if (mag_list[IR2_mag_ID] != 'no') and (mag_list[IR3_mag_ID] != 'no') and (mag_list[MP1_mag_ID] != 'no'):
-            X23 = mag_list[IR2_mag_ID] - mag_list[IR3_mag_ID]
-            Y35 = mag_list[IR3_mag_ID] - mag_list[MP1_mag_ID]
-            if index_AGB(X23, Y35, [0, 0, 2, 5], [-1, 0, 2, 2]) < 0:
-                AGB_flag = 'AGB'
-    return AGB_flag
-
 def Find_MP1_Saturate(row_list, MP1_qua_ID=MP1_qua_ID):
     '''
     This is to check if object in input catalog is saturate in MP1 band
@@ -81,37 +67,53 @@ def Generate_Galaxy_Populated_Region(GP_Lower_Bound, GP_Upper_Bound, fixed_ax):
     This is to generate galaxy populated region by filled all points \
     between two upper/lower boundaries.
     '''
-    galaxy_populated_region = []
-    same_galaxy_num = 0
-    for lower, upper in zip(GP_Lower_Bound, GP_Upper_Bound):
-        if not np.all(lower == upper):
-            WO_fixed_ax = list(lower[:fixed_ax]) + list(lower[fixed_ax+1:])
-            for fixed_ax_pos in range(lower[fixed_ax], upper[fixed_ax]+1):
-                WI_fixed_ax = copy.deepcopy(WO_fixed_ax)
-                WI_fixed_ax.insert(fixed_ax, fixed_ax_pos)
-                galaxy_populated_region.append(np.array(WI_fixed_ax))
-        else:
-            galaxy_populated_region.append(lower)
-            same_galaxy_num += 1
+    GP_Lower_Bound = np.asarray(GP_Lower_Bound, dtype=np.int64)
+    GP_Upper_Bound = np.asarray(GP_Upper_Bound, dtype=np.int64)
+    same_galaxy = np.all(GP_Lower_Bound == GP_Upper_Bound, axis=1)
+    same_galaxy_num = int(np.sum(same_galaxy))
+    # Number of filled points on each probing line (lower == upper -> itself)
+    fill_num = np.maximum(GP_Upper_Bound[:, fixed_ax] - GP_Lower_Bound[:, fixed_ax] + 1, 0)
+    fill_num[same_galaxy] = 1
+    line_ind = np.repeat(np.arange(len(GP_Lower_Bound)), fill_num)
+    fill_start = np.cumsum(fill_num) - fill_num
+    galaxy_populated_region = GP_Lower_Bound[line_ind]
+    galaxy_populated_region[:, fixed_ax] += np.arange(len(line_ind)) - fill_start[line_ind]
     return galaxy_populated_region, same_galaxy_num
 
-def Check_Within_GP_Bound(POS_vector, Galaxy_Populated_Region):
+def Update_GP_Region_Index(GP_Region_Index, Galaxy_Populated_Region, lack_bits, radix):
+    '''
+    This is to add galaxy populated region to index \
+    (one sorted array of unique packed position keys per lack pattern, looked up by np.isin)
+    Note: lack bands of input source are ignored when comparing to region
+    '''
+    for lack_bit in np.unique(lack_bits):
+        if lack_bit in GP_Region_Index:
+            continue
+        lack_ind = [i for i in range(Galaxy_Populated_Region.shape[1]) if (lack_bit >> i) & 1]
+        project_region = np.array(Galaxy_Populated_Region, dtype=np.int64)
+        project_region[:, lack_ind] = -999
+        GP_Region_Index[lack_bit] = np.unique(pack_pos_vec(project_region, radix))
+    return GP_Region_Index
+
+def Check_Within_GP_Bound(POS_array, GP_Region_Index, radix):
     '''
-    This is to check if input is within galaxy populated region \
-    (galaxy boundary)
+    This is to check if inputs are within galaxy populated region \
+    (galaxy boundary) in one batch
     '''
-    no_lack_POSv = POS_vector[POS_vector != -999]
-    GP_Within_Bound_flag = False
-    for bound in Galaxy_Populated_Region:
-        no_lack_bound = bound[POS_vector != -999]
-        if np.all(no_lack_POSv == no_lack_bound):
-            GP_Within_Bound_flag = True
-            break
+    GP_Within_Bound_flag = np.zeros(len(POS_array), dtype=bool)
+    if len(POS_array) == 0:
+        return GP_Within_Bound_flag
+    POS_keys  = pack_pos_vec(POS_array, radix)
+    lack_bits = get_lack_bits(POS_array)
+    for lack_bit in np.unique(lack_bits):
+        same_lack = (lack_bits == lack_bit)
+        GP_Within_Bound_flag[same_lack] = np.isin(POS_keys[same_lack], GP_Region_Index[lack_bit])
     return GP_Within_Bound_flag
 
-def Cal_Position_Vector(row_list, data_type, Qua=True, Psf=False):
+def Cal_Position_Vector_Array(row_lists, data_type, Qua=True):
     '''
-    This is to calculate position vector and object types
+    This is to calculate position vectors and object types of all inputs for both GP and GPP
+    Columns are parsed and transformed to magnitude once, GPP only adds PSF mask on them
     Count:
         "no_count"  : LESS3BD
         "no_count"  : AGB
@@ -122,38 +124,51 @@ def Cal_Position_Vector(row_list, data_type, Qua=True, Psf=False):
         1e3         : Galaxy
     '''
     # Transform input to magnitude
+    qua_array = get_column_array(row_lists, qua_ID_5D1) if Qua else None
     if data_type == 'flux':
-        mag_list = mJy_to_mag(row_list, flux_ID=flux_ID_5D1, f0_list=f0_list_5D1, qua_ID=qua_ID_5D1, Qua=Qua, psf_ID=psf_ID_5D1, Psf=Psf)
+        flux_array = get_column_array(row_lists, flux_ID_5D1, dtype=float)
+        mag_array, GP_valid = mJy_to_mag_array(flux_array, f0_list=f0_list_5D1, qua_array=qua_array, Qua=Qua)
     elif data_type == 'mag':
         # Command below is for UKIDSS-SWIRE type catalog
-        mag_list = mag_to_mag(row_list, mag_ID=mag_ID_5D1, qua_ID=qua_ID_5D1, Qua=Qua, psf_ID=psf_ID_5D1, Psf=Psf)
-
-    SEQ_vec      = [sort_up_lack999(mag_list[i], axlim_list[i], cube) for i in range(len(mag_list))]
-    AGB_flag     = Remove_AGB(mag_list)
-    MP1_Sat_flag = Find_MP1_Saturate(row_list)
-    OBS_num      = len(axlim_list) - SEQ_vec.count(-999)
-    OBJ_type     = str(OBS_num) + 'bands_'
-    Count        = 'init'
-    POS_vector   = np.array(SEQ_vec)
-
-    if OBS_num < 3:
-        Count = 'no_count'; OBJ_type += 'LESS3BD'
+        mag_array = get_column_array(row_lists, mag_ID_5D1, dtype=float)
+        mag_array, GP_valid = mag_to_mag_array(mag_array, qua_array=qua_array, Qua=Qua)
+    # PSF check only works with Qua label (same as mJy_to_mag/mag_to_mag)
+    if Qua:
+        GPP_valid = select_qua_psf_array(GP_valid, qua_array, get_column_array(row_lists, psf_ID_5D1), Psf=True)
     else:
-        if (AGB_flag == 'AGB'):
-            Count = 'no_count'; OBJ_type += 'AGB'
-        elif (AGB_flag == 'Not_AGB'):
-            if (MP1_Sat_flag == 'MP1_Sat'):
+        GPP_valid = GP_valid
+    MP1_Sat_flag = np.array([Find_MP1_Saturate(row_list) == 'MP1_Sat' for row_list in row_lists], dtype=bool)
+
+    POS_OBJ_Count_list = []
+    for valid in [GP_valid, GPP_valid]:
+        POS_array = sort_up_lack999_array(mag_array, valid, axlim_list, cube)
+        AGB_flag  = AGB_mask_array(mag_array, valid, IR2_mag_ID, IR3_mag_ID, MP1_mag_ID)
+        OBS_num   = len(axlim_list) - np.sum(POS_array == -999, axis=1)
+        Bright    = np.any(POS_array == -9999, axis=1)
+        Faint     = np.any(POS_array == 9999, axis=1)
+        OBJ_types, Counts = [], []
+        for i in range(len(POS_array)):
+            OBJ_type = str(OBS_num[i]) + 'bands_'
+            Count    = 'init'
+            if OBS_num[i] < 3:
+                Count = 'no_count'; OBJ_type += 'LESS3BD'
+            elif AGB_flag[i]:
+                Count = 'no_count'; OBJ_type += 'AGB'
+            elif MP1_Sat_flag[i]:
                 Count = 1e-5; OBJ_type += 'MP1_Sat'
-            elif (SEQ_vec.count(-9999) > 0):
+            elif Bright[i]:
                 Count = 1e-4; OBJ_type += 'Bright'
-            elif (SEQ_vec.count(9999) > 0):
+            elif Faint[i]:
                 Count = 1e4;  OBJ_type += 'Faint'
-    return POS_vector, OBJ_type, Count
+            OBJ_types.append(OBJ_type)
+            Counts.append(Count)
+        POS_OBJ_Count_list.append((POS_array, OBJ_types, Counts))
+    return POS_OBJ_Count_list
 
-def Classification_Pipeline(Galaxy_Populated_Region, row_list, data_type='mag', Qua=True, GP_PSF=False):
+def Classification_Pipeline(Galaxy_Populated_Region, GP_Region_Index, row_lists, radix, data_type='mag', Qua=True):
     '''
-    This is to classify input object and return object type and galaxy probability
-    GP_PSF: Galaxy Probability PSF (Considering PSF for c2d catalog)
+    This is to classify input objects and return object types and galaxy probabilities of GP and GPP in one pass
+    GPP: Galaxy Probability PSF (Considering PSF for c2d catalog)
     Count:
         "not_count" : LESS3BD
         "not_count" : AGB
@@ -163,14 +178,38 @@ def Classification_Pipeline(Galaxy_Populated_Region, row_list, data_type='mag',
         1e4         : Faint
         1e3         : Galaxy
     '''
-    POS_vector, OBJ_type, Count = Cal_Position_Vector(row_list, data_type=data_type, Qua=Qua, Psf=GP_PSF)
-    if Count == 'init':
-        GP_Within_Bound_flag = Check_Within_GP_Bound(POS_vector, Galaxy_Populated_Region)
-        if GP_Within_Bound_flag:
-            Count = 1e3;  OBJ_type += 'Galaxyc'
-        else:
-            Count = 1e-3; OBJ_type += 'YSOc'
-    return OBJ_type, Count, POS_vector
+    POS_OBJ_Count_list = Cal_Position_Vector_Array(row_lists, data_type=data_type, Qua=Qua)
+    # Check all GP/GPP sources not classified yet in one batch (same position checked once)
+    init_ind_list = [[i for i in range(len(Counts)) if Counts[i] == 'init'] for _, _, Counts in POS_OBJ_Count_list]
+    POS_uni, uni_ind_list = merge_unique_pos_vec([POS_array[init_ind] for (POS_array, _, _), init_ind in \
+                                                  zip(POS_OBJ_Count_list, init_ind_list)], len(axlim_list))
+    GP_Region_Index = Update_GP_Region_Index(GP_Region_Index, Galaxy_Populated_Region, get_lack_bits(POS_uni), radix)
+    GP_Within_Bound_uni = Check_Within_GP_Bound(POS_uni, GP_Region_Index, radix)
+    for (_, OBJ_types, Counts), init_ind, uni_ind in zip(POS_OBJ_Count_list, init_ind_list, uni_ind_list):
+        for i, flag in zip(init_ind, GP_Within_Bound_uni[uni_ind]):
+            if flag:
+                Counts[i] = 1e3;  OBJ_types[i] += 'Galaxyc'
+            else:
+                Counts[i] = 1e-3; OBJ_types[i] += 'YSOc'
+    (POS_vectors, GP_OBJ_types, GP_Counts), (_, GPP_OBJ_types, GPP_Counts) = POS_OBJ_Count_list
+    return GP_OBJ_types, GP_Counts, GPP_OBJ_types, GPP_Counts, POS_vectors
+
+def Classify_Catalog_Lines(catalog_lines, Galaxy_Populated_Region, GP_Region_Index, radix):
+    '''
+    This is to classify lines of input catalog and return output lines with GP/GPP results
+    '''
+    row_lists = [line.split() for line in catalog_lines]
+    GP_OBJ_types, GP_Counts, GPP_OBJ_types, GPP_Counts, Pos_vectors = Classification_Pipeline(\
+                                            Galaxy_Populated_Region, GP_Region_Index, row_lists, radix, \
+                                            data_type='mag', Qua=True)
+    GP_tot_out = []
+    for i in range(len(row_lists)):
+        row_list = fill_up_list_WI_z(row_lists[i], max_column_num=max_column_num)
+        row_list[GP_OBJ_ID], row_list[GP_ID] = str(GP_OBJ_types[i]), str(GP_Counts[i])
+        row_list[GPP_OBJ_ID], row_list[GPP_ID] = str(GPP_OBJ_types[i]), str(GPP_Counts[i])
+        row_list[POS_VEC_ID] = (','.join([str(PV) for PV in Pos_vectors[i]]))
+        GP_tot_out.append('\t'.join(row_list))
+    return GP_tot_out
 
 # Main Programs
 #======================================================================================
@@ -178,10 +217,10 @@ if __name__ == '__main__':
     t_start = time.time()
 
     # Check inputs
-    if len(argv) != 12:
+    if len(argv) not in [12, 13, 14]:
         exit('\n\tError: Wrong Usage!\
             \n\tExample: [program] [catalog] [cloud\'s name] [inp_data_type] \\\
-            \n\t\t [galaxy lower bd] [galaxy upper bd] [dim] [band_inp] [cube size] [sigma] [bond] [refD]\
+            \n\t\t [galaxy lower bd] [galaxy upper bd] [dim] [band_inp] [cube size] [sigma] [bond] [refD] [n_proc] [block_size]\
             \n\t[catalog]: input catalog for classification\
             \n\t[cloud\'s name]: name of molecular cloud e.g. CHA_II\
             \n\t[inp_data_type]: flux or mag [Note: flux unit "mJy"]\
@@ -192,7 +231,9 @@ if __name__ == '__main__':
             \n\t[cube size]: length of multi-d cube in magnitude unit\
             \n\t[sigma]: standard deviation for gaussian dist. in magnitude\
             \n\t[bond]: boundary radius of gaussian beam unit in cell\
-            \n\t[ref-D]: reference dimension which to modulus other dimension to\n')
+            \n\t[ref-D]: reference dimension which to modulus other dimension to\
+            \n\t[n_proc]: (optional) number of processes to classify catalog shards (default: 1, -1: all cores)\
+            \n\t[block_size]: (optional) number of rows read, classified and written at a time (default: 100000)\n')
     else:
         print('\nStart calculating GP with 5D1 bound array ...')
 
@@ -209,6 +250,8 @@ if __name__ == '__main__':
     sigma        = int(argv[9])
     bond         = int(argv[10])
     refD         = int(argv[11])
+    n_proc       = resolve_n_proc(argv[12]) if len(argv) >= 13 else 1
+    block_size   = int(argv[13]) if len(argv) == 14 else 100000
     bound_path   = spp.Selfmade_5D1_GP_BD_path
 
     # Lower bound array
@@ -229,46 +272,36 @@ if __name__ == '__main__':
     else:
         upper_bound_array = galaxy_upper
 
-    # Load catalog and bounds ...
+    # Load bounds ...
     l_start = time.time()
-    print('\nLoading input catalogs ...')
-    with open(catalog_name, 'r') as table:
-        catalog = table.readlines()
-    print('Gernating galaxy populated regions ...')
+    print('\nGernating galaxy populated regions ...')
     GP_Lower_Bound = np.load(lower_bound_array)
     GP_Upper_Bound = np.load(upper_bound_array)
     Galaxy_Populated_Region, _ = Generate_Galaxy_Populated_Region(GP_Lower_Bound, GP_Upper_Bound, bd_band_ax)
+    radix = get_pos_vec_radix(axlim_list, cube)
+    GP_Region_Index = {}
+    if n_proc > 1:
+        # Build index of all lack patterns once, processes only read it
+        GP_Region_Index = Update_GP_Region_Index(GP_Region_Index, Galaxy_Populated_Region, \
+                                                 get_all_lack_bits(len(axlim_list), len(axlim_list)-3), radix)
     l_end   = time.time()
-    print("Loading catalog & Generate galaxy region took {:.3f} secs".format(l_end - l_start))
+    print("Generate galaxy region took {:.3f} secs".format(l_end - l_start))
 
     # Start calculating 5D1 galaxy probability and 5D1 galaxy probability PSF
     t_start = time.time()
-    print('\nStart Calculating 5D1 GP/GPP...')
-    GP_tot_out = []
-    for i in range(len(catalog)):
-        row_list = catalog[i].split()
-        GP_OBJ_type, GP_Count, Pos_vector = Classification_Pipeline(\
-                                            Galaxy_Populated_Region, row_list, \
-                                            data_type='mag', Qua=True, GP_PSF=False)
-        GPP_OBJ_type, GPP_Count, _ = Classification_Pipeline(\
-                                            Galaxy_Populated_Region, row_list, \
-                                            data_type='mag', Qua=True, GP_PSF=True)
-        row_list = fill_up_list_WI_z(row_list, max_column_num=max_column_num)
-        row_list[GP_OBJ_ID], row_list[GP_ID] = str(GP_OBJ_type), str(GP_Count)
-        row_list[GPP_OBJ_ID], row_list[GPP_ID] = str(GPP_OBJ_type), str(GPP_Count)
-        row_list[POS_VEC_ID] = (','.join([str(PV) for PV in Pos_vector]))
-        GP_tot_out.append('\t'.join(row_list))
-        drawProgressBar(float(i+1)/len(catalog))
+    print('\nStart Calculating 5D1 GP/GPP with {:d} process(es)...'.format(n_proc))
+    # Read, classify and save galaxy probability results block by block
+    row_num = 0
+    with open('{}_5D1_BD_GP_out_catalog.tbl'.format(cloud_name), 'w') as GP_tot_out_catalog:
+        for catalog_block in read_catalog_blocks(catalog_name, block_size):
+            GP_tot_out = run_catalog_shards(catalog_block, Classify_Catalog_Lines, \
+                                            (Galaxy_Populated_Region, GP_Region_Index, radix), n_proc=n_proc)
+            GP_tot_out_catalog.write('\n'.join(GP_tot_out) + '\n')
+            row_num += len(catalog_block)
+            print('{:d} rows done'.format(row_num))
     t_end   = time.time()
     print('\nCalculating 5D1_Gal_Prob took {:.3f} secs'.format(t_end - t_start))
 
-    # Save galaxy probability results ...
-    s_start = time.time()
-    with open('{}_5D1_BD_GP_out_catalog.tbl'.format(cloud_name), 'w') as GP_tot_out_catalog:
-        GP_tot_out_catalog.write('\n'.join(GP_tot_out) + '\n')
-    s_end   = time.time()
-    print('Saving result took {:.3f} secs'.format(s_end - s_start))
-
     # Conclude all program time consumption
     t_end   = time.time()
     print('\nWhole {} process took {:.3f} secs\n'.format(str(argv[0]), t_end - t_start))
@@ -13,8 +13,10 @@ Input Variables:
     [sigma]: standard deviation for gaussian dist. in magnitude
     [bond]: boundary radius of gaussian beam unit in cell
     [ref-D]: reference dimension which to modulus other dimension to
+    [n_proc]: (optional) number of processes to classify catalog shards (default: 1, -1: all cores)
+    [block_size]: (optional) number of rows read, classified and written at a time (default: 100000)
 ----------------------------------------------------------------
-Latest update: 2020/12/24 Jordan Wu'''
+Latest update: 2026/10/18 Jordan Wu'''
 
 # Import Modules
 #======================================================================================
@@ -49,21 +51,6 @@ MP1_qua_ID = qua_ID_Spitzer[4]
 
 # Functions
 #======================================================================================
-def Remove_AGB(mag_list, IR2_mag_ID=IR2_mag_ID, IR3_mag_ID=IR3_mag_ID, MP1_mag_ID=MP1_mag_ID):
-    '''
-    This is to check if object in input catalog is AGB
-    Input datatype: magnitude, int, int, int
-    '''
-    # Remove AGB
-    AGB_flag = 'Not_AGB'
-    if (IR2_mag_ID is not np.nan) and (IR3_mag_ID is not np.nan) and (MP1_mag_ID is not np.nan):
-        if (mag_list[IR2_mag_ID] != 'no') and (mag_list[IR3_mag_ID] != 'no') and (mag_list[MP1_mag_ID] != 'no'):
-            X23 = mag_list[IR2_mag_ID] - mag_list[IR3_mag_ID]
-            Y35 = mag_list[IR3_mag_ID] - mag_list[MP1_mag_ID]
-            if index_AGB(X23, Y35, [0, 0, 2, 5], [-1, 0, 2, 2]) < 0:
-                AGB_flag = 'AGB'
-    return AGB_flag
-
 def Find_MP1_Saturate(row_list, MP1_qua_ID=MP1_qua_ID):
     '''
     This is to check if object in input catalog is saturate in MP1 band
@@ -73,9 +60,10 @@ def Find_MP1_Saturate(row_list, MP1_qua_ID=MP1_qua_ID):
         MP1_Sat_flag = 'MP1_Sat'
     return MP1_Sat_flag
 
-def Cal_Position_Vector(row_list, data_type, Qua=True, Psf=False):
+def Cal_Position_Vector_Array(row_lists, data_type, Qua=True):
     '''
-    This is to calculate position vector and object types
+    This is to calculate position vectors and object types of all inputs for both GP and GPP
+    Columns are parsed and transformed to magnitude once, GPP only adds PSF mask on them
     Count:
         "no_count"  : LESS3BD
         "no_count"  : AGB
@@ -86,83 +74,109 @@ def Cal_Position_Vector(row_list, data_type, Qua=True, Psf=False):
         1e3         : Galaxy
     '''
     # Transform input to magnitude
+    qua_array = get_column_array(row_lists, qua_ID_5D1) if Qua else None
     if data_type == 'flux':
-        mag_list = mJy_to_mag(row_list, flux_ID=flux_ID_5D1, f0_list=f0_list_5D1, qua_ID=qua_ID_5D1, Qua=Qua, psf_ID=psf_ID_5D1, Psf=Psf)
+        flux_array = get_column_array(row_lists, flux_ID_5D1, dtype=float)
+        mag_array, GP_valid = mJy_to_mag_array(flux_array, f0_list=f0_list_5D1, qua_array=qua_array, Qua=Qua)
     elif data_type == 'mag':
         # Command below is for UKIDSS-SWIRE type catalog
-        mag_list = mag_to_mag(row_list, mag_ID=mag_ID_5D1, qua_ID=qua_ID_5D1, Qua=Qua, psf_ID=psf_ID_5D1, Psf=Psf)
-
-    # Set flags and other indicator
-    SEQ_vec      = [sort_up_lack999(mag_list[i], axlim_list[i], cube) for i in range(len(mag_list))]
-    AGB_flag     = Remove_AGB(mag_list)
-    MP1_Sat_flag = Find_MP1_Saturate(row_list)
-    OBS_num      = len(axlim_list) - SEQ_vec.count(-999)
-    OBJ_type     = str(OBS_num) + 'bands_'
-    Count        = 'init'
-    POS_vector   = np.array(SEQ_vec)
-
-    # Assign objecttype and count
-    if OBS_num < 3:
-        Count = 'no_count'; OBJ_type += 'LESS3BD'
+        mag_array = get_column_array(row_lists, mag_ID_5D1, dtype=float)
+        mag_array, GP_valid = mag_to_mag_array(mag_array, qua_array=qua_array, Qua=Qua)
+    # PSF check only works with Qua label (same as mJy_to_mag/mag_to_mag)
+    if Qua:
+        GPP_valid = select_qua_psf_array(GP_valid, qua_array, get_column_array(row_lists, psf_ID_5D1), Psf=True)
     else:
-        if (AGB_flag == 'AGB'):
-            Count = 'no_count'; OBJ_type += 'AGB'
-        elif (AGB_flag == 'Not_AGB'):
-            if (MP1_Sat_flag == 'MP1_Sat'):
+        GPP_valid = GP_valid
+    MP1_Sat_flag = np.array([Find_MP1_Saturate(row_list) == 'MP1_Sat' for row_list in row_lists], dtype=bool)
+
+    POS_OBJ_Count_list = []
+    for valid in [GP_valid, GPP_valid]:
+        POS_array = sort_up_lack999_array(mag_array, valid, axlim_list, cube)
+        AGB_flag  = AGB_mask_array(mag_array, valid, IR2_mag_ID, IR3_mag_ID, MP1_mag_ID)
+        OBS_num   = len(axlim_list) - np.sum(POS_array == -999, axis=1)
+        Bright    = np.any(POS_array == -9999, axis=1)
+        Faint     = np.any(POS_array == 9999, axis=1)
+        OBJ_types, Counts = [], []
+        for i in range(len(POS_array)):
+            OBJ_type = str(OBS_num[i]) + 'bands_'
+            Count    = 'init'
+            if OBS_num[i] < 3:
+                Count = 'no_count'; OBJ_type += 'LESS3BD'
+            elif AGB_flag[i]:
+                Count = 'no_count'; OBJ_type += 'AGB'
+            elif MP1_Sat_flag[i]:
                 Count = 1e-5; OBJ_type += 'MP1_Sat'
-            elif (SEQ_vec.count(-9999) > 0):
+            elif Bright[i]:
                 Count = 1e-4; OBJ_type += 'Bright'
-            elif (SEQ_vec.count(9999) > 0):
+            elif Faint[i]:
                 Count = 1e4;  OBJ_type += 'Faint'
-    return POS_vector, OBJ_type, Count
+            OBJ_types.append(OBJ_type)
+            Counts.append(Count)
+        POS_OBJ_Count_list.append((POS_array, OBJ_types, Counts))
+    return POS_OBJ_Count_list
 
-def Check_On_Same_Diag(reference, target):
+def Cal_Diag_Key(pos_array, radix):
     '''
-    This is to check if reference and target are on the same diagonal line
+    This is to calculate canonical diagonal key of position vectors
+    (pack position minus its minimum non-lack component)
+    Note: points on the same diagonal line share the same key
     '''
-    Same_flag = False
-    if np.all(reference == target):
-        Same_flag = True
-    elif np.all(reference >= target) or np.all(reference <= target):
-        diff = reference - target
-        frac = diff // np.array([1]*len(reference))
-        if np.all(frac == frac[0]):
-            Same_flag = True
-    else:
-        pass
-    return Same_flag
+    pos_array = np.asarray(pos_array, dtype=np.int64)
+    lack = (pos_array == -999)
+    pos_min = np.min(np.where(lack, np.iinfo(np.int64).max, pos_array), axis=1)
+    diag_rep = np.where(lack, -999, pos_array - pos_min[:, None])
+    return pack_pos_vec(diag_rep, radix)
 
-def Check_Boundary_Position_Along_Diag(POS_vector, GP_Lower_Bound, GP_Upper_Bound):
+def Build_Along_Diag_Index(GP_Lower_Bound, GP_Upper_Bound, lack_bits, radix, Along_Diag_Index=None):
     '''
-    This is to find the location of boundary on probing axis
-    fixed_ax: first non -999 component
+    This is to build diagonal index of boundaries (one table per lack pattern)
+    Bounds are keyed by canonical diagonal key, and only the first bound pair \
+    (sorted near to far respect to origin) on each diagonal is kept
     '''
-    # Initialize (Remove -999 band)
-    no_lack_ind = np.where(POS_vector!=-999)[0]
-    POS_vector_no_lack = POS_vector[no_lack_ind]
-    GP_Lower_Bound_no_lack = GP_Lower_Bound[:, no_lack_ind]
-    GP_Upper_Bound_no_lack = GP_Upper_Bound[:, no_lack_ind]
-
-    # Sortup boundary array based on lower boundary (to prevent projection effect), near to far (respect to origin)
-    GP_Lower_Bound_no_lack_sort_ID, GP_Lower_Bound_no_lack = sort_up_array_element(GP_Lower_Bound_no_lack)
-    GP_Upper_Bound_no_lack = GP_Upper_Bound_no_lack[GP_Lower_Bound_no_lack_sort_ID]
-
-    # Find boundary point on probing axis
-    POS_bd, POS_bd_no_lack, indicator = [], [], 0
-    for i, (Lbd, Ubd) in enumerate(zip(GP_Lower_Bound_no_lack, GP_Upper_Bound_no_lack)):
-        L_Diag_Flag = Check_On_Same_Diag(POS_vector_no_lack, Lbd)
-        U_Diag_Flag = Check_On_Same_Diag(POS_vector_no_lack, Ubd)
-        # Find corresponding points in galaxy populated region -> TBD
-        if L_Diag_Flag and U_Diag_Flag:
-            POS_bd_no_lack.append(GP_Lower_Bound_no_lack[i])
-            POS_bd_no_lack.append(GP_Upper_Bound_no_lack[i])
-            break
-        indicator += 1
+    if Along_Diag_Index is None:
+        Along_Diag_Index = {}
+    GP_Lower_Bound = np.asarray(GP_Lower_Bound, dtype=np.int64)
+    GP_Upper_Bound = np.asarray(GP_Upper_Bound, dtype=np.int64)
+    for lack_bit in np.unique(lack_bits):
+        if lack_bit in Along_Diag_Index:
+            continue
+        no_lack_ind = [i for i in range(GP_Lower_Bound.shape[1]) if not (lack_bit >> i) & 1]
+        # Sortup boundary array based on lower boundary (to prevent projection effect), near to far (respect to origin)
+        sort_ind, _ = sort_up_array_element(GP_Lower_Bound[:, no_lack_ind])
+        Lbd, Ubd = GP_Lower_Bound[sort_ind], GP_Upper_Bound[sort_ind]
+        lack_ind = [i for i in range(GP_Lower_Bound.shape[1]) if (lack_bit >> i) & 1]
+        Lbd[:, lack_ind], Ubd[:, lack_ind] = -999, -999
+        # Keep bound pairs whose lower/upper bounds are on the same diagonal
+        L_diag_key, U_diag_key = Cal_Diag_Key(Lbd, radix), Cal_Diag_Key(Ubd, radix)
+        same_diag = np.where(L_diag_key == U_diag_key)[0]
+        diag_keys, first_ind = np.unique(L_diag_key[same_diag], return_index=True)
+        bd_ind = same_diag[first_ind]
+        Along_Diag_Index[lack_bit] = (diag_keys, Lbd[bd_ind][:, no_lack_ind], Ubd[bd_ind][:, no_lack_ind])
+    return Along_Diag_Index
 
-    # If no corresponding boundary point
-    if (indicator == len(GP_Lower_Bound)):
-        POS_bd_no_lack = [np.nan, np.nan]
-    return POS_vector_no_lack, POS_bd_no_lack
+def Check_Boundary_Position_Along_Diag(POS_array, Along_Diag_Index, radix):
+    '''
+    This is to find the location of boundary on diagonal line of each input (in one batch)
+    Return position vectors and boundaries without lack bands ([np.nan, np.nan] if no boundary)
+    '''
+    POS_array = np.asarray(POS_array, dtype=np.int64).reshape(len(POS_array), -1)
+    POS_vector_no_lack_list = [POS_vector[POS_vector != -999] for POS_vector in POS_array]
+    POS_bd_no_lack_list = [[np.nan, np.nan] for i in range(len(POS_array))]
+    if len(POS_array) == 0:
+        return POS_vector_no_lack_list, POS_bd_no_lack_list
+    POS_diag_keys = Cal_Diag_Key(POS_array, radix)
+    lack_bits = get_lack_bits(POS_array)
+    for lack_bit in np.unique(lack_bits):
+        diag_keys, lower_bd, upper_bd = Along_Diag_Index[lack_bit]
+        if len(diag_keys) == 0:
+            continue
+        same_lack  = np.where(lack_bits == lack_bit)[0]
+        query_keys = POS_diag_keys[same_lack]
+        loc   = np.minimum(np.searchsorted(diag_keys, query_keys), len(diag_keys)-1)
+        found = (diag_keys[loc] == query_keys)
+        for i, j in zip(same_lack[found], loc[found]):
+            POS_bd_no_lack_list[i] = [lower_bd[j], upper_bd[j]]
+    return POS_vector_no_lack_list, POS_bd_no_lack_list
 
 def Assign_GP_num_and_objtype(POS_vector_no_lack, POS_bd_no_lack):
     '''
@@ -206,10 +220,10 @@ def Assign_GP_num_and_objtype(POS_vector_no_lack, POS_bd_no_lack):
         label = np.nan
     return label, count
 
-def Classification_Pipeline(GP_Lower_Bound, GP_Upper_Bound, row_list, data_type='mag', Qua=True, GP_PSF=False):
+def Classification_Pipeline(GP_Lower_Bound, GP_Upper_Bound, Along_Diag_Index, row_lists, radix, data_type='mag', Qua=True):
     '''
-    IThis is to classify input object and return object type and galaxy probability
-    GP_PSF: Galaxy Probability PSF (Considering PSF for c2d catalog)
+    This is to classify input objects and return object types and galaxy probabilities of GP and GPP in one pass
+    GPP: Galaxy Probability PSF (Considering PSF for c2d catalog)
     Count:
         "not_count" : LESS3BD
         "not_count" : AGB
@@ -220,12 +234,36 @@ def Classification_Pipeline(GP_Lower_Bound, GP_Upper_Bound, row_list, data_type=
         1e3         : Galaxy
         1e6         : FYSO
     '''
-    POS_vector, OBJ_type, Count = Cal_Position_Vector(row_list, data_type=data_type, Qua=Qua, Psf=GP_PSF)
-    if Count == 'init':
-        POS_vector_no_lack, POS_bd_no_lack = Check_Boundary_Position_Along_Diag(POS_vector, GP_Lower_Bound, GP_Upper_Bound)
-        AOBJ_type, Count = Assign_GP_num_and_objtype(POS_vector_no_lack, POS_bd_no_lack)
-        OBJ_type += AOBJ_type
-    return OBJ_type, Count, POS_vector
+    POS_OBJ_Count_list = Cal_Position_Vector_Array(row_lists, data_type=data_type, Qua=Qua)
+    # Look up diagonal boundary of all GP/GPP sources not classified yet in one batch (same position looked up once)
+    init_ind_list = [[i for i in range(len(Counts)) if Counts[i] == 'init'] for _, _, Counts in POS_OBJ_Count_list]
+    POS_uni, uni_ind_list = merge_unique_pos_vec([POS_array[init_ind] for (POS_array, _, _), init_ind in \
+                                                  zip(POS_OBJ_Count_list, init_ind_list)], len(axlim_list))
+    Along_Diag_Index = Build_Along_Diag_Index(GP_Lower_Bound, GP_Upper_Bound, get_lack_bits(POS_uni), radix, Along_Diag_Index)
+    POS_vector_no_lack_uni, POS_bd_no_lack_uni = Check_Boundary_Position_Along_Diag(POS_uni, Along_Diag_Index, radix)
+    for (_, OBJ_types, Counts), init_ind, uni_ind in zip(POS_OBJ_Count_list, init_ind_list, uni_ind_list):
+        for i, j in zip(init_ind, uni_ind):
+            AOBJ_type, Counts[i] = Assign_GP_num_and_objtype(POS_vector_no_lack_uni[j], POS_bd_no_lack_uni[j])
+            OBJ_types[i] += AOBJ_type
+    (POS_vectors, GP_OBJ_types, GP_Counts), (_, GPP_OBJ_types, GPP_Counts) = POS_OBJ_Count_list
+    return GP_OBJ_types, GP_Counts, GPP_OBJ_types, GPP_Counts, POS_vectors
+
+def Classify_Catalog_Lines(catalog_lines, GP_Lower_Bound, GP_Upper_Bound, Along_Diag_Index, radix):
+    '''
+    This is to classify lines of input catalog and return output lines with GP/GPP results
+    '''
+    row_lists = [fill_up_list_WI_z(line.split(), max_column_num=max_column_num) for line in catalog_lines]
+    GP_OBJ_types, GP_Counts, GPP_OBJ_types, GPP_Counts, Pos_vectors = Classification_Pipeline(\
+                                            GP_Lower_Bound, GP_Upper_Bound, Along_Diag_Index,\
+                                            row_lists, radix, data_type='mag', Qua=True)
+    GP_tot_out = []
+    for i in range(len(row_lists)):
+        row_list = row_lists[i]
+        row_list[GP_OBJ_ID], row_list[GP_ID] = str(GP_OBJ_types[i]), str(GP_Counts[i])
+        row_list[GPP_OBJ_ID], row_list[GPP_ID] = str(GPP_OBJ_types[i]), str(GPP_Counts[i])
+        row_list[POS_VEC_ID] = (','.join([str(PV) for PV in Pos_vectors[i]]))
+        GP_tot_out.append('\t'.join(row_list))
+    return GP_tot_out
 
 # Main Programs
 #======================================================================================
@@ -233,10 +271,10 @@ if __name__ == '__main__':
     t_start = time.time()
 
     # Check inputs
-    if len(argv) != 10:
+    if len(argv) not in [10, 11, 12]:
         exit('\n\tError: Wrong Usage!\
             \n\tExample: [program] [catalog] [cloud\'s name] [inp_data_type] \
-            \n\t\t [bound_path] [dim] [cube size] [sigma] [bond] [refD]\
+            \n\t\t [bound_path] [dim] [cube size] [sigma] [bond] [refD] [n_proc] [block_size]\
             \n\t[catalog]: input catalog for classification\
             \n\t[cloud\'s name]: name of molecular cloud e.g. CHA_II\
             \n\t[inp_data_type]: flux or mag [Note: flux unit "mJy"]\
@@ -245,7 +283,9 @@ if __name__ == '__main__':
             \n\t[cube size]: length of multi-d cube in magnitude unit\
             \n\t[sigma]: standard deviation for gaussian dist. in magnitude\
             \n\t[bond]: boundary radius of gaussian beam unit in cell\
-            \n\t[ref-D]: reference dimension which to modulus other dimension to\n')
+            \n\t[ref-D]: reference dimension which to modulus other dimension to\
+            \n\t[n_proc]: (optional) number of processes to classify catalog shards (default: 1, -1: all cores)\
+            \n\t[block_size]: (optional) number of rows read, classified and written at a time (default: 100000)\n')
     else:
         print('\nStart calculating GP with 5D1 bound array ...')
 
@@ -259,12 +299,12 @@ if __name__ == '__main__':
     sigma        = int(argv[7])
     bond         = int(argv[8])
     refD         = int(argv[9])
+    n_proc       = resolve_n_proc(argv[10]) if len(argv) >= 11 else 1
+    block_size   = int(argv[11]) if len(argv) == 12 else 100000
 
-    # Load catalog and bounds ...
+    # Load bounds ...
     l_start = time.time()
-    print('\nLoading input catalogs ...')
-    with open(catalog_name, 'r') as table:
-        catalog = table.readlines()
+    print('\nLoading galaxy boundary ...')
 
     # Load all boundaries
     bd_band_ax = 'Diag'
@@ -283,37 +323,29 @@ if __name__ == '__main__':
     GP_Lower_Bound = np.load(lower_bound_array)
     GP_Upper_Bound = np.load(upper_bound_array)
     l_end   = time.time()
-    print("Loading catalog and galaxy boundary took {:.3f} secs".format(l_end - l_start))
+    print("Loading galaxy boundary took {:.3f} secs".format(l_end - l_start))
 
     # Start calculating 5D1 galaxy probability and 5D1 galaxy probability PSF
     c_start = time.time()
-    print('\nStart Calculating 5D1 GP/GPP...')
+    print('\nStart Calculating 5D1 GP/GPP with {:d} process(es)...'.format(n_proc))
     print('Band Index: ' + str(band_ID))
-    GP_tot_out = []
-    for i in range(len(catalog)):
-        row_list = catalog[i].split()
-        row_list = fill_up_list_WI_z(row_list, max_column_num=max_column_num)
-        GP_OBJ_type, GP_Count, Pos_vector = Classification_Pipeline(\
-                                            GP_Lower_Bound, GP_Upper_Bound,\
-                                            row_list, data_type='mag', Qua=True, GP_PSF=False)
-        GPP_OBJ_type, GPP_Count, _ = Classification_Pipeline(\
-                                            GP_Lower_Bound, GP_Upper_Bound,\
-                                            row_list, data_type='mag', Qua=True, GP_PSF=True)
-        row_list[GP_OBJ_ID], row_list[GP_ID] = str(GP_OBJ_type), str(GP_Count)
-        row_list[GPP_OBJ_ID], row_list[GPP_ID] = str(GPP_OBJ_type), str(GPP_Count)
-        row_list[POS_VEC_ID] = (','.join([str(PV) for PV in Pos_vector]))
-        GP_tot_out.append('\t'.join(row_list))
-        drawProgressBar(float(i+1)/len(catalog))
+    radix = get_pos_vec_radix(axlim_list, cube)
+    Along_Diag_Index = {}
+    if n_proc > 1:
+        # Build index of all lack patterns once, processes only read it
+        Along_Diag_Index = Build_Along_Diag_Index(GP_Lower_Bound, GP_Upper_Bound, get_all_lack_bits(dim, dim-3), radix)
+    # Read, classify and save galaxy probability results block by block
+    row_num = 0
+    with open('{}_5D1_diag_BD_GP_all_out_catalog.tbl'.format(cloud_name), 'w') as GP_tot_out_catalog:
+        for catalog_block in read_catalog_blocks(catalog_name, block_size):
+            GP_tot_out = run_catalog_shards(catalog_block, Classify_Catalog_Lines, (GP_Lower_Bound, GP_Upper_Bound,\
+                                            Along_Diag_Index, radix), n_proc=n_proc)
+            GP_tot_out_catalog.write('\n'.join(GP_tot_out) + '\n')
+            row_num += len(catalog_block)
+            print('{:d} rows done'.format(row_num))
     c_end   = time.time()
     print('\nCalculating 5D1_Gal_Prob took {:.3f} secs'.format(c_end - c_start))
 
-    # Save galaxy probability results ...
-    s_start = time.time()
-    with open('{}_5D1_diag_BD_GP_all_out_catalog.tbl'.format(cloud_name), 'w') as GP_tot_out_catalog:
-        GP_tot_out_catalog.write('\n'.join(GP_tot_out) + '\n')
-    s_end   = time.time()
-    print('Saving result took {:.3f} secs'.format(s_end - s_start))
-
     # Conclude all program time consumption
     t_end   = time.time()
     print('\nWhole {} process took {:.3f} secs\n'.format(str(argv[0]), t_end - t_start))
@@ -2,7 +2,7 @@
 '''-----------------------------------------------------------------------------------
 This program is for calculating 5D1 galaxy probability (P) by GP Dict
 
-Example: [program] [dimension] [cube size] [GP_dict] [input catalog] [cloud name] [datatype] [qua]
+Example: [program] [dimension] [cube size] [GP_dict] [input catalog] [cloud name] [datatype] [qua] [n_proc] [block_size]
 
 Input Variables:
     [dimension]:     dim of magnitude space (for now only "6")
@@ -12,26 +12,30 @@ Input Variables:
     [cloud name]:    cloud name of input catalog
     [datatype]:      "mag" or "flux" input data in magnitude or flux (mJy)
     [qua]:           if qua label is taken into calculation (True/False)
+    [n_proc]:        (optional) number of processes to classify catalog shards (default: 1, -1: all cores)
+    [block_size]:    (optional) number of rows read, classified and written at a time (default: 100000)
 
 # Note:
     For Assignment of GP value and objecttype, check README.md
+    GP_Store_5d_key/num/radix.npy (from Update_GP_Dict_Key_Tuple.py) is used if it is in [GP_dict],
+    otherwise all_detect_grid_Full_*d.npy dictionaries are converted on the fly
 
 --------------------------------------------------------------------------------------
 This code is modified from 6-Dimensional method
 By entering :1,$s/6D/5D1/g
-latest update: 2020/10/14 Jordan Wu'''
+latest update: 2026/10/18 Jordan Wu'''
 
 # Import Modules
 #==============================================================================
 from __future__ import print_function
 from sys import argv, exit
 import numpy as np
+import os
 import time
 from All_Variables import *
 from Hsieh_Functions import *
 from Useful_Functions import *
 import SOP_Program_Path as spp
-from Calculate_GP_WI_5D1_Bound_Array import Remove_AGB
 
 # Global Variables
 #==============================================================================
@@ -58,51 +62,126 @@ MP1_qua_ID = qua_ID_Spitzer[4]
 
 # Functions
 #==============================================================================
-def GP_Dict_Pipeline(line, name_list, mag_list, PSF_list, cube, axlim_list=axlim_list):
+def Load_GP_Store(path, dim, radix):
     '''
-    This is to generate objecttype and count by input magnitude list
+    This is to load galaxy probability store (sorted packed keys/values)
+    GP_Dict (key in tuple) is converted on the fly if there is no store in path
     '''
-    # Extract information from catalogs and set default values to output
-    SEQ_vector = [sort_up_lack999(mag_list[i], axlim_list[i], cube) for i in range(len(axlim_list))]
-    AGB_flag   = Remove_AGB(mag_list)
-    Num        = dim - SEQ_vector.count(-999)
-    Ob_type    = '{:d}bands_'.format(Num)
-    Count      = 'no_count'
-    KEY        = 'NO_KEY'
-    # Remove AGB
-    if AGB_flag == 'AGB':
-        Count = 'no_count'
-        Ob_type += 'AGB'
+    store_prefix = '{}GP_Store_{:d}d'.format(path, dim)
+    if os.path.isfile('{}_key.npy'.format(store_prefix)):
+        print('GP_Store: {}'.format(store_prefix))
+        store_keys, store_nums, store_radix = load_gp_store(store_prefix)
+        if not np.array_equal(store_radix, radix):
+            exit('GP_Store radix {} does not match cube size/axis limits {}'.format(str(store_radix), str(radix)))
     else:
-        # More than 3 band detection
-        if Num >= 3:
-            KEY, Key_array = tuple(SEQ_vector), np.array(SEQ_vector)
-            ind_array = np.argwhere(Key_array==-999)
-            # Faint sources
-            if 9999 in SEQ_vector:
-                Count    = 1e4
-                Ob_type += 'Faint'
-            # Bright sources
-            elif -9999 in SEQ_vector:
-                Count    = 1e-4
-                Ob_type += 'Bright'
-            # Use GP Dict
+        # Note for allow_pickle, encoding option is for python3 and numpy version higher than 1.16
+        print('No GP_Store in path, converting GP_Dict ...')
+        GP_Dict_list = [np.load(path + 'all_detect_grid_Full_{:d}d.npy'.format(dim-lack), allow_pickle=True, encoding='bytes').item() \
+                        for lack in range(dim-3+1)]
+        store_keys, store_nums = gp_dict_to_store(GP_Dict_list, radix)
+    return store_keys, store_nums
+
+def GP_Dict_Pipeline(row_lists, mag_array, valid_list, GP_Store, radix, name_list=name_list, axlim_list=axlim_list):
+    '''
+    This is to generate objecttypes and counts by input magnitude array
+    One result for each valid mask (GP/GPP), position vectors of all results are looked up in GP store at once
+    '''
+    store_keys, store_nums = GP_Store
+    SEQ_array_list, Ob_types_list, Counts_list, KEYs_list, init_ind_list = [], [], [], [], []
+    for valid in valid_list:
+        # Extract information from catalogs and set default values to output
+        SEQ_array = sort_up_lack999_array(mag_array, valid, axlim_list, cube)
+        AGB_flag  = AGB_mask_array(mag_array, valid, IR2_mag_ID, IR3_mag_ID, MP1_mag_ID)
+        Num_array = len(axlim_list) - np.sum(SEQ_array == -999, axis=1)
+        Ob_types, Counts, KEYs, init_ind = [], [], [], []
+        for i in range(len(SEQ_array)):
+            SEQ_vector = SEQ_array[i].tolist()
+            Num        = int(Num_array[i])
+            Ob_type    = '{:d}bands_'.format(Num)
+            Count      = 'no_count'
+            KEY        = 'NO_KEY'
+            # Remove AGB
+            if AGB_flag[i]:
+                Count = 'no_count'
+                Ob_type += 'AGB'
+            # More than 3 band detection
+            elif Num >= 3:
+                KEY = tuple(SEQ_vector)
+                # Faint sources
+                if 9999 in SEQ_vector:
+                    Count    = 1e4
+                    Ob_type += 'Faint'
+                # Bright sources
+                elif -9999 in SEQ_vector:
+                    Count    = 1e-4
+                    Ob_type += 'Bright'
+                # Use GP Store (below)
+                else:
+                    init_ind.append(i)
+            Ob_types.append(Ob_type)
+            Counts.append(Count)
+            KEYs.append(KEY)
+        SEQ_array_list.append(SEQ_array)
+        Ob_types_list.append(Ob_types)
+        Counts_list.append(Counts)
+        KEYs_list.append(KEYs)
+        init_ind_list.append(init_ind)
+    # Look up all sources not counted yet in one batch (same position looked up once)
+    POS_uni, uni_ind_list = merge_unique_pos_vec([SEQ_array[init_ind] for SEQ_array, init_ind in \
+                                                  zip(SEQ_array_list, init_ind_list)], len(axlim_list))
+    Store_values, Store_found = search_gp_store(store_keys, store_nums, POS_uni, radix)
+    PSF_fill_num = np.sum(get_column_array(row_lists, psf_ID[:len(axlim_list)], dtype=int) == -2, axis=1)
+    for SEQ_array, Ob_types, Counts, init_ind, uni_ind in zip(SEQ_array_list, Ob_types_list, Counts_list, init_ind_list, uni_ind_list):
+        for i, j in zip(init_ind, uni_ind):
+            lack_ind = [k for k in range(len(axlim_list)) if SEQ_array[i, k] == -999]
+            if Store_found[j]:
+                Counts[i]    = float(Store_values[j])
+                Ob_types[i] += 'Lack_{}'.format(''.join([name_list[k] for k in lack_ind]))
             else:
-                try:
-                    Count    = eval('L{}_Dict'.format(dim-Num))[KEY]
-                    Ob_type += 'Lack_{}'.format(''.join([name_list[int(ind)] for ind in ind_array]))
-                except KeyError:
-                    Count    = 1e-3
-                    Ob_type += '{:d}D_NOGALAXY_'.format(Num)
-    # Avoid log(0)
-    if Count == 0.0:
-        Count = 1e-9
-    # Find saturate candidates
-    if lines[MP1_qua_ID] == "S":
-        Count = 1e-4
-    # Record bandfill band number
-    Ob_type += "bandfill=" + str(PSF_list.count(-2))
-    return Ob_type, Count, KEY
+                Counts[i]    = 1e-3
+                Ob_types[i] += '{:d}D_NOGALAXY_'.format(len(axlim_list) - len(lack_ind))
+        for i in range(len(row_lists)):
+            # Avoid log(0)
+            if Counts[i] == 0.0:
+                Counts[i] = 1e-9
+            # Find saturate candidates
+            if row_lists[i][MP1_qua_ID] == "S":
+                Counts[i] = 1e-4
+            # Record bandfill band number
+            Ob_types[i] += "bandfill=" + str(PSF_fill_num[i])
+    return Ob_types_list, Counts_list, KEYs_list
+
+def Classify_Catalog_Lines(catalog_lines, GP_Store, radix, datatype, qualabel):
+    '''
+    This is to classify lines of input catalog and return output lines with GP/GPP results
+    Note: GP/GPP share the same magnitudes, GPP only adds PSF mask
+    '''
+    row_lists = [line.split() for line in catalog_lines]
+    qua_array = get_column_array(row_lists, qua_ID_5D1) if qualabel else None
+    if datatype == 'flux':
+        mag_array, GP_valid = mJy_to_mag_array(get_column_array(row_lists, flux_ID_5D1, dtype=float), \
+                                               f0_list=f0_list_5D1, qua_array=qua_array, Qua=qualabel)
+        psf_array = get_column_array(row_lists, psf_ID_5D1)
+    elif datatype == 'mag':
+        mag_array, GP_valid = mag_to_mag_array(get_column_array(row_lists, mag_ID_5D1, dtype=float), \
+                                               qua_array=qua_array, Qua=qualabel)
+        psf_array = get_column_array(row_lists, psf_ID[:len(mag_ID_5D1)])
+    GPP_valid = select_qua_psf_array(GP_valid, qua_array, psf_array, Psf=True) if qualabel else GP_valid
+
+    # Generate GP/GPP from pipeline procedure
+    (GP_Ob_types, GPP_Ob_types), (GP_Counts, GPP_Counts), (KEYs, _) = GP_Dict_Pipeline(\
+                                                                     row_lists, mag_array, [GP_valid, GPP_valid], GP_Store, radix)
+    out_line = []
+    for i in range(len(row_lists)):
+        # Create some empty columns and Write GP/GPP type/value
+        lines = fill_up_list_WI_z(row_lists[i], max_column_num=max_column_num)
+        lines[GP_OBJ_ID]  = str(GP_Ob_types[i])
+        lines[GP_ID]      = str(GP_Counts[i])
+        lines[GPP_OBJ_ID] = str(GPP_Ob_types[i])
+        lines[GPP_ID]     = str(GPP_Counts[i])
+        lines[POS_VEC_ID] = str(','.join([str(ele) for ele in KEYs[i]]))
+        out_line.append('\t'.join(lines))
+    return out_line
 
 # Main Program
 #======================================================
@@ -110,16 +189,18 @@ if __name__ == '__main__':
     t_start = time.time()
 
     # Check Input Variables
-    if len(argv) != 8:
+    if len(argv) not in [8, 9, 10]:
         exit('\n\tWrong Usage!\
-              \n\tExample: [program] [dimension] [cube size] [GP_dict] [input catalog] [cloud name] [datatype] [qua]\
+              \n\tExample: [program] [dimension] [cube size] [GP_dict] [input catalog] [cloud name] [datatype] [qua] [n_proc] [block_size]\
               \n\t[dimension]: dim of magnitude space (for now only "6")\
               \n\t[cube size]: length of cube (unit: mag)\
               \n\t[GP_dict]: Galaxy probability dictionary (specific file or "default")\
               \n\t[input catalog]: must include magnitudes if datatype is "mag"\
               \n\t[cloud name]: cloud name of input catalog\
               \n\t[datatype]: "mag" or "flux" input data in magnitude or flux (mJy)\
-              \n\t[qua]: if qua label is taken into calculation (True/False)\n')
+              \n\t[qua]: if qua label is taken into calculation (True/False)\
+              \n\t[n_proc]: (optional) number of processes to classify catalog shards (default: 1, -1: all cores)\
+              \n\t[block_size]: (optional) number of rows read, classified and written at a time (default: 100000)\n')
 
     # Input Variables
     dim          = int(argv[1])
@@ -129,59 +210,32 @@ if __name__ == '__main__':
     Cloud_name   = str(argv[5])
     datatype     = str(argv[6])
     qualabel     = bool(argv[7] == 'True')
+    n_proc       = resolve_n_proc(argv[8]) if len(argv) >= 9 else 1
+    block_size   = int(argv[9]) if len(argv) == 10 else 100000
 
-    # Load GP dict
-    print('\nLoading GP_Dict ...')
+    # Load GP store
+    print('\nLoading GP_Store ...')
     # Setup Galaxy Probability Dictionary Path
     if GP_Dict_Path == 'default':
         path = spp.Selfmade_5D1_GP_Dict_path
     else:
         path = GP_Dict_Path
     print('GP_Dict: {}'.format(path))
-
-    # Note for allow_pickle, encoding option is for python3 and numpy version higher than 1.16
-    L0_Dict = np.load(path + 'all_detect_grid_Full_{:d}d.npy'.format(dim-0), allow_pickle=True, encoding='bytes').item()
-    L1_Dict = np.load(path + 'all_detect_grid_Full_{:d}d.npy'.format(dim-1), allow_pickle=True, encoding='bytes').item()
-    L2_Dict = np.load(path + 'all_detect_grid_Full_{:d}d.npy'.format(dim-2), allow_pickle=True, encoding='bytes').item()
-
-    # Load Cloud Catalog
-    print('Loading input catalog ...')
-    with open(inp_catalog, 'r') as inp:
-        catalog = inp.readlines()
+    radix    = get_pos_vec_radix(axlim_list, cube)
+    GP_Store = Load_GP_Store(path, dim, radix)
 
     # Start calculating 5D1 Galaxy probabilty / Galaxy probability P
-    print('Calculating 5D1 Galaxy Probability..')
-    out_line = []
-    for i in range(len(catalog)):
-        drawProgressBar(float(i+1)/len(catalog))
-
-        # Unit transformation
-        lines = catalog[i].split()
-        if datatype == 'flux':
-            GP_mag_list  = mJy_to_mag(lines, flux_ID=flux_ID_5D1, f0_list=f0_list_5D1, qua_ID=qua_ID_5D1, Qua=qualabel)
-            GPP_mag_list = mJy_to_mag(lines, flux_ID=flux_ID_5D1, f0_list=f0_list_5D1, qua_ID=qua_ID_5D1, psf_ID=psf_ID_5D1, Qua=qualabel, Psf=True)
-        elif datatype == 'mag':
-            GP_mag_list  = mag_to_mag(lines, mag_ID=mag_ID_5D1, qua_ID=qua_ID_5D1, Qua=qualabel)
-            GPP_mag_list = mag_to_mag(lines, mag_ID=mag_ID_5D1, qua_ID=qua_ID_5D1, Qua=qualabel, psf_ID=psf_ID, Psf=True)
-        else:
-            exit('Input type error')
-
-        # Generate GP/GPP from pipeline procedure
-        PSF_list = [int(lines[psf_ID[i]]) for i in range(len(GP_mag_list))]
-        GP_Ob_type,  GP_Count, KEY = GP_Dict_Pipeline(lines, name_list, GP_mag_list, PSF_list, cube)
-        GPP_Ob_type, GPP_Count, _  = GP_Dict_Pipeline(lines, name_list, GPP_mag_list, PSF_list, cube)
-        # Create some empty columns and Write GP/GPP type/value
-        lines = fill_up_list_WI_z(lines, max_column_num=max_column_num)
-        lines[GP_OBJ_ID]  = str(GP_Ob_type)
-        lines[GP_ID]      = str(GP_Count)
-        lines[GPP_OBJ_ID] = str(GPP_Ob_type)
-        lines[GPP_ID]     = str(GPP_Count)
-        lines[POS_VEC_ID] = str(','.join([str(ele) for ele in KEY]))
-        out_line.append('\t'.join(lines))
-
-    # Save to output catalog
+    print('Calculating 5D1 Galaxy Probability with {:d} process(es)..'.format(n_proc))
+    if datatype not in ['flux', 'mag']:
+        exit('Input type error')
+    # Read cloud catalog, calculate and save to output catalog block by block
+    row_num = 0
     with open('{}_5D1_GP_all_out_catalog.tbl'.format(Cloud_name), 'w') as out_catalog:
-        out_lines = '\n'.join(out_line) + '\n'
-        out_catalog.write(out_lines)
+        for catalog_block in read_catalog_blocks(inp_catalog, block_size):
+            out_line = run_catalog_shards(catalog_block, Classify_Catalog_Lines, (GP_Store, radix, datatype, qualabel), n_proc=n_proc)
+            out_lines = '\n'.join(out_line) + '\n'
+            out_catalog.write(out_lines)
+            row_num += len(catalog_block)
+            print('{:d} rows done'.format(row_num))
     t_end   = time.time()
     print('\n{} took {:.3f} secs\n'.format(str(argv[0]), t_end - t_start))
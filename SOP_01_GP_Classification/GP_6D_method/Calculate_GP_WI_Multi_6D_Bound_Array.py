@@ -13,8 +13,10 @@ Input Variables:
     [sigma]: standard deviation for gaussian dist. in magnitude
     [bond]: boundary radius of gaussian beam unit in cell
     [ref-D]: reference dimension which to modulus other dimension to
+    [n_proc]: (optional) number of processes to classify catalog shards (default: 1, -1: all cores)
+    [block_size]: (optional) number of rows read, classified and written at a time (default: 100000)
 ----------------------------------------------------------------
-Latest update: 2020/11/11 Jordan Wu'''
+Latest update: 2026/10/18 Jordan Wu'''
 
 # Import Modules
 #======================================================================================
@@ -52,21 +54,6 @@ MP1_qua_ID = qua_ID_Spitzer[4]
 
 # Functions
 #======================================================================================
-def Remove_AGB(mag_list, IR2_mag_ID=IR2_mag_ID, IR3_mag_ID=IR3_mag_ID, MP1_mag_ID=MP1_mag_ID):
-    '''
-    This is to check if object in input catalog is AGB
-    Input datatype: magnitude, int, int, int
-    '''
-    # Remove AGB
-    AGB_flag = 'Not_AGB'
-    if (IR2_mag_ID is not np.nan) and (IR3_mag_ID is not np.nan) and (MP1_mag_ID is not np.nan):
-        if (mag_list[IR2_mag_ID] != 'no') and (mag_list[IR3_mag_ID] != 'no') and (mag_list[MP1_mag_ID] != 'no'):
-            X23 = mag_list[IR2_mag_ID] - mag_list[IR3_mag_ID]
-            Y35 = mag_list[IR3_mag_ID] - mag_list[MP1_mag_ID]
-            if index_AGB(X23, Y35, [0, 0, 2, 5], [-1, 0, 2, 2]) < 0:
-                AGB_flag = 'AGB'
-    return AGB_flag
-
 def Find_MP1_Saturate(row_list, MP1_qua_ID=MP1_qua_ID):
     '''
     This is to check if object in input catalog is saturate in MP1 band
@@ -109,9 +96,10 @@ def Find_MP1_Saturate(row_list, MP1_qua_ID=MP1_qua_ID):
             # break
     # return GP_Within_Bound_flag
 
-def Cal_Position_Vector(row_list, data_type, Qua=True, Psf=False):
+def Cal_Position_Vector_Array(row_lists, data_type, Qua=True):
     '''
-    This is to calculate position vector and object types
+    This is to calculate position vectors and object types of all inputs for both GP and GPP
+    Columns are parsed and transformed to magnitude once, GPP only adds PSF mask on them
     Count:
         "no_count"  : LESS3BD
         "no_count"  : AGB
@@ -122,58 +110,95 @@ def Cal_Position_Vector(row_list, data_type, Qua=True, Psf=False):
         1e3         : Galaxy
     '''
     # Transform input to magnitude
+    qua_array = get_column_array(row_lists, qua_ID_6D) if Qua else None
     if data_type == 'flux':
-        mag_list = mJy_to_mag(row_list, flux_ID=flux_ID_6D, f0_list=f0_list_6D, qua_ID=qua_ID_6D, Qua=Qua, psf_ID=psf_ID_6D, Psf=Psf)
+        flux_array = get_column_array(row_lists, flux_ID_6D, dtype=float)
+        mag_array, GP_valid = mJy_to_mag_array(flux_array, f0_list=f0_list_6D, qua_array=qua_array, Qua=Qua)
     elif data_type == 'mag':
         # Command below is for UKIDSS-SWIRE type catalog
-        mag_list = mag_to_mag(row_list, mag_ID=mag_ID_6D, qua_ID=qua_ID_6D, Qua=Qua, psf_ID=psf_ID_6D, Psf=Psf)
-
-    SEQ_vec      = [sort_up_lack999(mag_list[i], axlim_list[i], cube) for i in range(len(mag_list))]
-    AGB_flag     = Remove_AGB(mag_list)
-    MP1_Sat_flag = Find_MP1_Saturate(row_list)
-    OBS_num      = len(axlim_list) - SEQ_vec.count(-999)
-    OBJ_type     = str(OBS_num) + 'bands_'
-    Count        = 'init'
-    POS_vector   = np.array(SEQ_vec)
-
-    if OBS_num < 3:
-        Count = 'no_count'; OBJ_type += 'LESS3BD'
+        mag_array = get_column_array(row_lists, mag_ID_6D, dtype=float)
+        mag_array, GP_valid = mag_to_mag_array(mag_array, qua_array=qua_array, Qua=Qua)
+    # PSF check only works with Qua label (same as mJy_to_mag/mag_to_mag)
+    if Qua:
+        GPP_valid = select_qua_psf_array(GP_valid, qua_array, get_column_array(row_lists, psf_ID_6D), Psf=True)
     else:
-        if (AGB_flag == 'AGB'):
-            Count = 'no_count'; OBJ_type += 'AGB'
-        elif (AGB_flag == 'Not_AGB'):
-            if (MP1_Sat_flag == 'MP1_Sat'):
+        GPP_valid = GP_valid
+    MP1_Sat_flag = np.array([Find_MP1_Saturate(row_list) == 'MP1_Sat' for row_list in row_lists], dtype=bool)
+
+    POS_OBJ_Count_list = []
+    for valid in [GP_valid, GPP_valid]:
+        POS_array = sort_up_lack999_array(mag_array, valid, axlim_list, cube)
+        AGB_flag  = AGB_mask_array(mag_array, valid, IR2_mag_ID, IR3_mag_ID, MP1_mag_ID)
+        OBS_num   = len(axlim_list) - np.sum(POS_array == -999, axis=1)
+        Bright    = np.any(POS_array == -9999, axis=1)
+        Faint     = np.any(POS_array == 9999, axis=1)
+        OBJ_types, Counts = [], []
+        for i in range(len(POS_array)):
+            OBJ_type = str(OBS_num[i]) + 'bands_'
+            Count    = 'init'
+            if OBS_num[i] < 3:
+                Count = 'no_count'; OBJ_type += 'LESS3BD'
+            elif AGB_flag[i]:
+                Count = 'no_count'; OBJ_type += 'AGB'
+            elif MP1_Sat_flag[i]:
                 Count = 1e-5; OBJ_type += 'MP1_Sat'
-            elif (SEQ_vec.count(-9999) > 0):
+            elif Bright[i]:
                 Count = 1e-4; OBJ_type += 'Bright'
-            elif (SEQ_vec.count(9999) > 0):
+            elif Faint[i]:
                 Count = 1e4;  OBJ_type += 'Faint'
-    return POS_vector, OBJ_type, Count
+            OBJ_types.append(OBJ_type)
+            Counts.append(Count)
+        POS_OBJ_Count_list.append((POS_array, OBJ_types, Counts))
+    return POS_OBJ_Count_list
 
-def Check_Boundary_Position_Along_Axis(POS_vector, GP_Lower_Bound, GP_Upper_Bound, fixed_ax):
+def Build_Along_Axis_Index(GP_Lower_Bound, GP_Upper_Bound, fixed_ax, lack_bits, radix, Along_Axis_Index=None):
+    '''
+    This is to build interval index of boundaries on probing axis
+    Bounds are grouped by off-axis position (packed key, one group per lack pattern)
+    Note: only first bound pair with same off-axis position is kept (same as linear scan)
     '''
-    This is to find the location of boundary on probing axis
+    if Along_Axis_Index is None:
+        Along_Axis_Index = {}
+    GP_Lower_Bound = np.asarray(GP_Lower_Bound, dtype=np.int64)
+    GP_Upper_Bound = np.asarray(GP_Upper_Bound, dtype=np.int64)
+    for lack_bit in np.unique(lack_bits | (1 << fixed_ax)):
+        if lack_bit in Along_Axis_Index:
+            continue
+        lack_ind = [i for i in range(GP_Lower_Bound.shape[1]) if (lack_bit >> i) & 1]
+        Lbd, Ubd = GP_Lower_Bound.copy(), GP_Upper_Bound.copy()
+        Lbd[:, lack_ind], Ubd[:, lack_ind] = -999, -999
+        same_line = np.where(np.all(Lbd == Ubd, axis=1))[0]
+        line_keys, first_ind = np.unique(pack_pos_vec(Lbd[same_line], radix), return_index=True)
+        bd_ind = same_line[first_ind]
+        Along_Axis_Index[lack_bit] = (line_keys, GP_Lower_Bound[bd_ind, fixed_ax], GP_Upper_Bound[bd_ind, fixed_ax])
+    return Along_Axis_Index
+
+def Check_Boundary_Position_Along_Axis(POS_array, Along_Axis_Index, fixed_ax, radix):
     '''
-    POS_vector_ax, POS_ax = np.delete(POS_vector, fixed_ax), POS_vector[fixed_ax]
-    GP_Lower_Bound_ax = np.delete(GP_Lower_Bound, fixed_ax, axis=1)
-    GP_Upper_Bound_ax = np.delete(GP_Upper_Bound, fixed_ax, axis=1)
-    # Find boundary point on probing axis
-    POS_bd_ax, indicator = [], 0
-    lack_ind = np.where(POS_vector_ax==-999)
-    for i in range(len(GP_Lower_Bound_ax)):
-        Lbd = GP_Lower_Bound_ax[i]
-        Ubd = GP_Upper_Bound_ax[i]
-        for ind in lack_ind:
-            Lbd[ind], Ubd[ind] = -999, -999
-        # Find corresponding points in galaxy populated region -> TBD
-        if np.all(POS_vector_ax == Lbd) and np.all(POS_vector_ax == Ubd):
-            POS_bd_ax.append(GP_Lower_Bound[i, fixed_ax])
-            POS_bd_ax.append(GP_Upper_Bound[i, fixed_ax])
-            break
-        indicator += 1
-    # If no corresponding boundary point
-    if (indicator == len(GP_Lower_Bound_ax)):
-        POS_bd_ax = np.nan
+    This is to find the location of boundary on probing axis (in one batch)
+    Return lower/upper bound on probing axis (NaN if no corresponding boundary)
+    '''
+    POS_array = np.asarray(POS_array, dtype=np.int64).reshape(len(POS_array), -1)
+    POS_ax = POS_array[:, fixed_ax]
+    POS_bd_ax = np.full((len(POS_array), 2), np.nan)
+    # Sources lack on probing axis are not searched
+    search_ind = np.where(POS_ax != -999)[0]
+    if len(search_ind) == 0:
+        return POS_bd_ax, POS_ax
+    POS_line = POS_array[search_ind]
+    POS_line[:, fixed_ax] = -999
+    POS_keys  = pack_pos_vec(POS_line, radix)
+    lack_bits = get_lack_bits(POS_line)
+    for lack_bit in np.unique(lack_bits):
+        line_keys, lower_ax, upper_ax = Along_Axis_Index[lack_bit]
+        if len(line_keys) == 0:
+            continue
+        same_lack  = search_ind[lack_bits == lack_bit]
+        query_keys = POS_keys[lack_bits == lack_bit]
+        loc   = np.minimum(np.searchsorted(line_keys, query_keys), len(line_keys)-1)
+        found = (line_keys[loc] == query_keys)
+        POS_bd_ax[same_lack[found], 0] = lower_ax[loc[found]]
+        POS_bd_ax[same_lack[found], 1] = upper_ax[loc[found]]
     return POS_bd_ax, POS_ax
 
 def Assign_GP_num_and_objtype(POS_bd_ax, POS_ax):
@@ -237,10 +262,11 @@ def Assign_GP_num_and_objtype(POS_bd_ax, POS_ax):
             # Count = 1e-3; OBJ_type += 'YSOc'
     # return OBJ_type, Count, POS_vector
 
-def Classification_Pipeline(GP_Lower_Bound, GP_Upper_Bound, row_list, fixed_ax=0, data_type='mag', Qua=True, GP_PSF=False):
+def Classification_Pipeline(GP_Lower_Bound_list, GP_Upper_Bound_list, Along_Axis_Index_list, row_lists, radix, data_type='mag', Qua=True):
     '''
-    This is to classify input object and return object type and galaxy probability
-    GP_PSF: Galaxy Probability PSF (Considering PSF for c2d catalog)
+    This is to classify input objects along all probing axes and return object types and galaxy probabilities
+    of GP and GPP in one pass
+    GPP: Galaxy Probability PSF (Considering PSF for c2d catalog)
     Count:
         "not_count" : LESS3BD
         "not_count" : AGB
@@ -250,12 +276,54 @@ def Classification_Pipeline(GP_Lower_Bound, GP_Upper_Bound, row_list, fixed_ax=0
         1e4         : Faint
         1e3         : Galaxy
     '''
-    POS_vector, OBJ_type, Count = Cal_Position_Vector(row_list, data_type=data_type, Qua=Qua, Psf=GP_PSF)
-    if Count == 'init':
-        POS_bd_ax, POS_ax = Check_Boundary_Position_Along_Axis(POS_vector, GP_Lower_Bound, GP_Upper_Bound, fixed_ax)
-        AOBJ_type, Count = Assign_GP_num_and_objtype(POS_bd_ax, POS_ax)
-        OBJ_type += AOBJ_type
-    return OBJ_type, Count, POS_vector
+    POS_OBJ_Count_list = Cal_Position_Vector_Array(row_lists, data_type=data_type, Qua=Qua)
+    # Look up boundary of all GP/GPP sources not classified yet on each probing axis (same position looked up once)
+    init_ind_list = [[i for i in range(len(Counts)) if Counts[i] == 'init'] for _, _, Counts in POS_OBJ_Count_list]
+    POS_uni, uni_ind_list = merge_unique_pos_vec([POS_array[init_ind] for (POS_array, _, _), init_ind in \
+                                                  zip(POS_OBJ_Count_list, init_ind_list)], len(axlim_list))
+    GP_OBJ_types_list, GP_Counts_list, GPP_OBJ_types_list, GPP_Counts_list = [], [], [], []
+    for fixed_ax in range(len(GP_Lower_Bound_list)):
+        Along_Axis_Index_list[fixed_ax] = Build_Along_Axis_Index(\
+                                          GP_Lower_Bound_list[fixed_ax], GP_Upper_Bound_list[fixed_ax], fixed_ax,\
+                                          get_lack_bits(POS_uni), radix, Along_Axis_Index_list[fixed_ax])
+        POS_bd_ax_uni, POS_ax_uni = Check_Boundary_Position_Along_Axis(POS_uni, Along_Axis_Index_list[fixed_ax], fixed_ax, radix)
+        OBJ_types_ax_list, Counts_ax_list = [], []
+        for (_, OBJ_types, Counts), init_ind, uni_ind in zip(POS_OBJ_Count_list, init_ind_list, uni_ind_list):
+            OBJ_types_ax, Counts_ax = list(OBJ_types), list(Counts)
+            for i, bd_ax, ax in zip(init_ind, POS_bd_ax_uni[uni_ind], POS_ax_uni[uni_ind]):
+                if np.isnan(bd_ax[0]):
+                    bd_ax = np.nan
+                AOBJ_type, Counts_ax[i] = Assign_GP_num_and_objtype(bd_ax, ax)
+                OBJ_types_ax[i] += AOBJ_type
+            OBJ_types_ax_list.append(OBJ_types_ax)
+            Counts_ax_list.append(Counts_ax)
+        GP_OBJ_types_list.append(OBJ_types_ax_list[0])
+        GP_Counts_list.append(Counts_ax_list[0])
+        GPP_OBJ_types_list.append(OBJ_types_ax_list[1])
+        GPP_Counts_list.append(Counts_ax_list[1])
+    # Note: position vectors of GPP are saved as before
+    POS_vectors = POS_OBJ_Count_list[1][0]
+    return GP_OBJ_types_list, GP_Counts_list, GPP_OBJ_types_list, GPP_Counts_list, POS_vectors
+
+def Classify_Catalog_Lines(catalog_lines, GP_Lower_Bound_list, GP_Upper_Bound_list, Along_Axis_Index_list, radix, Output_ID_lists):
+    '''
+    This is to classify lines of input catalog and return output lines with GP/GPP results of all probing axes
+    Output_ID_lists: column IDs of (GP_OBJ, GP, GPP_OBJ, GPP, POS_VEC) for each probing axis
+    '''
+    GP_OBJ_ID_list, GP_ID_list, GPP_OBJ_ID_list, GPP_ID_list, POS_VEC_ID_list = Output_ID_lists
+    row_lists = [fill_up_list_WI_z(line.split(), max_column_num=max_column_num) for line in catalog_lines]
+    GP_OBJ_types_list, GP_Counts_list, GPP_OBJ_types_list, GPP_Counts_list, Pos_vectors = Classification_Pipeline(\
+                                            GP_Lower_Bound_list, GP_Upper_Bound_list, list(Along_Axis_Index_list),\
+                                            row_lists, radix, data_type='mag', Qua=True)
+    GP_tot_out = []
+    for i in range(len(row_lists)):
+        row_list = row_lists[i]
+        for j in range(len(GP_Lower_Bound_list)):
+            row_list[GP_OBJ_ID_list[j]], row_list[GP_ID_list[j]] = str(GP_OBJ_types_list[j][i]), str(GP_Counts_list[j][i])
+            row_list[GPP_OBJ_ID_list[j]], row_list[GPP_ID_list[j]] = str(GPP_OBJ_types_list[j][i]), str(GPP_Counts_list[j][i])
+            row_list[POS_VEC_ID_list[j]] = (','.join([str(PV) for PV in Pos_vectors[i]]))
+        GP_tot_out.append('\t'.join(row_list))
+    return GP_tot_out
 
 # Main Programs
 #======================================================================================
@@ -263,10 +331,10 @@ if __name__ == '__main__':
     t_start = time.time()
 
     # Check inputs
-    if len(argv) != 10:
+    if len(argv) not in [10, 11, 12]:
         exit('\n\tError: Wrong Usage!\
             \n\tExample: [program] [catalog] [cloud\'s name] [inp_data_type] \
-            \n\t\t [bound_path] [dim] [cube size] [sigma] [bond] [refD]\
+            \n\t\t [bound_path] [dim] [cube size] [sigma] [bond] [refD] [n_proc] [block_size]\
             \n\t[catalog]: input catalog for classification\
             \n\t[cloud\'s name]: name of molecular cloud e.g. CHA_II\
             \n\t[inp_data_type]: flux or mag [Note: flux unit "mJy"]\
@@ -275,7 +343,9 @@ if __name__ == '__main__':
             \n\t[cube size]: length of multi-d cube in magnitude unit\
             \n\t[sigma]: standard deviation for gaussian dist. in magnitude\
             \n\t[bond]: boundary radius of gaussian beam unit in cell\
-            \n\t[ref-D]: reference dimension which to modulus other dimension to\n')
+            \n\t[ref-D]: reference dimension which to modulus other dimension to\
+            \n\t[n_proc]: (optional) number of processes to classify catalog shards (default: 1, -1: all cores)\
+            \n\t[block_size]: (optional) number of rows read, classified and written at a time (default: 100000)\n')
     else:
         print('\nStart calculating GP with 6D bound array ...')
 
@@ -289,12 +359,12 @@ if __name__ == '__main__':
     sigma        = int(argv[7])
     bond         = int(argv[8])
     refD         = int(argv[9])
+    n_proc       = resolve_n_proc(argv[10]) if len(argv) >= 11 else 1
+    block_size   = int(argv[11]) if len(argv) == 12 else 100000
 
-    # Load catalog and bounds ...
+    # Load bounds ...
     l_start = time.time()
-    print('\nLoading input catalogs ...')
-    with open(catalog_name, 'r') as table:
-        catalog = table.readlines()
+    print('\nLoading galaxy boundary ...')
 
     # Load all boundaries
     GP_Lower_Bound_list = []
@@ -327,39 +397,32 @@ if __name__ == '__main__':
         GPP_ID_list.append(GPP_ID)
         POS_VEC_ID_list.append(POS_VEC_ID)
     l_end   = time.time()
-    print("Loading catalog and galaxy boundary took {:.3f} secs".format(l_end - l_start))
+    print("Loading galaxy boundary took {:.3f} secs".format(l_end - l_start))
 
     # Start calculating 6D galaxy probability and 6D galaxy probability PSF
     c_start = time.time()
-    print('\nStart Calculating 6D GP/GPP...')
-    GP_tot_out = []
-    for i in range(len(catalog)):
-        row_list = catalog[i].split()
-        row_list = fill_up_list_WI_z(row_list, max_column_num=max_column_num)
-        for j in range(dim):
-            GP_OBJ_type, GP_Count, Pos_vector = Classification_Pipeline(\
-                                                GP_Lower_Bound_list[j], GP_Upper_Bound_list[j],\
-                                                row_list, data_type='mag', Qua=True, GP_PSF=False,\
-                                                fixed_ax=j)
-            GPP_OBJ_type, GPP_Count, Pos_vector = Classification_Pipeline(\
-                                                GP_Lower_Bound_list[j], GP_Upper_Bound_list[j],\
-                                                row_list, data_type='mag', Qua=True, GP_PSF=True,\
-                                                fixed_ax=j)
-            row_list[GP_OBJ_ID_list[j]], row_list[GP_ID_list[j]] = str(GP_OBJ_type), str(GP_Count)
-            row_list[GPP_OBJ_ID_list[j]], row_list[GPP_ID_list[j]] = str(GPP_OBJ_type), str(GPP_Count)
-            row_list[POS_VEC_ID_list[j]] = (','.join([str(PV) for PV in Pos_vector]))
-        GP_tot_out.append('\t'.join(row_list))
-        drawProgressBar(float(i+1)/len(catalog))
+    print('\nStart Calculating 6D GP/GPP with {:d} process(es)...'.format(n_proc))
+    radix = get_pos_vec_radix(axlim_list, cube)
+    Along_Axis_Index_list = [{} for fixed_ax in range(dim)]
+    if n_proc > 1:
+        # Build index of all lack patterns once, processes only read it
+        all_lack_bits = get_all_lack_bits(dim, dim-3)
+        for fixed_ax in range(dim):
+            Along_Axis_Index_list[fixed_ax] = Build_Along_Axis_Index(GP_Lower_Bound_list[fixed_ax], GP_Upper_Bound_list[fixed_ax],\
+                                                                     fixed_ax, all_lack_bits, radix)
+    Output_ID_lists = (GP_OBJ_ID_list, GP_ID_list, GPP_OBJ_ID_list, GPP_ID_list, POS_VEC_ID_list)
+    # Read, classify and save galaxy probability results block by block
+    row_num = 0
+    with open('{}_6D_multi_BD_GP_out_catalog.tbl'.format(cloud_name), 'w') as GP_tot_out_catalog:
+        for catalog_block in read_catalog_blocks(catalog_name, block_size):
+            GP_tot_out = run_catalog_shards(catalog_block, Classify_Catalog_Lines, (GP_Lower_Bound_list, GP_Upper_Bound_list,\
+                                            Along_Axis_Index_list, radix, Output_ID_lists), n_proc=n_proc)
+            GP_tot_out_catalog.write('\n'.join(GP_tot_out) + '\n')
+            row_num += len(catalog_block)
+            print('{:d} rows done'.format(row_num))
     c_end   = time.time()
     print('\nCalculating 6D_Gal_Prob took {:.3f} secs'.format(c_end - c_start))
 
-    # Save galaxy probability results ...
-    s_start = time.time()
-    with open('{}_6D_multi_BD_GP_out_catalog.tbl'.format(cloud_name), 'w') as GP_tot_out_catalog:
-        GP_tot_out_catalog.write('\n'.join(GP_tot_out) + '\n')
-    s_end   = time.time()
-    print('Saving result took {:.3f} secs'.format(s_end - s_start))
-
     # Conclude all program time consumption
     t_end   = time.time()
     print('\nWhole {} process took {:.3f} secs\n'.format(str(argv[0]), t_end - t_start))
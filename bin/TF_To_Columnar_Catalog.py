@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+'''
+-------------------------------------------------------
+Example: [program] [catalog] ... [-o cache_path]
+Input Variables:
+    [catalog]: input catalog(s) in whitespace format (.tbl)
+    [cache_path]: output directory of columnar cache (default: [catalog]_columns)
+
+Note:
+    (1) Each column is saved as one .npy file, described by schema.json
+    (2) Read columns back with open_catalog_cache/load_column_array in Catalog_Cache
+-------------------------------------------------------
+Latest update: 2026/10/18 Jordan Wu'''
+
+# Load Modules
+#======================================================
+from __future__ import print_function
+from argparse import ArgumentParser
+import time
+from Catalog_Cache import *
+
+# Main Program
+#======================================================
+if __name__ == '__main__':
+    t_start = time.time()
+
+    # Parser arguments
+    parser = ArgumentParser(description="Convert whitespace catalog into columnar cache",\
+                            epilog="Cache is rebuilt only if catalog is modified (unless --force)")
+    parser.add_argument("inp_cat", type=str, nargs='+', help="Input catalog(s) to convert")
+    parser.add_argument("-o", "--output", default=None, dest="cache_path", type=str, help="Output cache directory (only for one input)")
+    parser.add_argument("-f", "--force", action="store_true", dest="force", help="Convert even if cache is up to date")
+    args = parser.parse_args()
+    if (args.cache_path is not None) and (len(args.inp_cat) > 1):
+        parser.error('Output cache directory can only be assigned for one input catalog')
+
+    # Start converting
+    for inp_cat in args.inp_cat:
+        c_start = time.time()
+        schema = None if args.force else check_catalog_cache(inp_cat, cache_path=args.cache_path)
+        if schema is None:
+            schema = convert_catalog_to_columns(inp_cat, cache_path=args.cache_path)
+            status = 'converted'
+        else:
+            status = 'up to date'
+        c_end   = time.time()
+        print('{}: {} ({:d} rows x {:d} columns) -> {} took {:.3f} secs'.format(\
+               inp_cat, status, schema['n_rows'], schema['n_cols'], schema['path'], c_end-c_start))
+
+    # Print out input information
+    t_end   = time.time()
+    print("\n{} took {:.3f} secs\n".format(parser.prog, t_end-t_start))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+'''----------------------------------------------------------------
+Abstract:
+    This program is for packing all functions needed for columnar catalog cache
+
+*Note:
+    (1)Whitespace catalog (.tbl) is converted once into one .npy file per column
+    (2)Column types follow column IDs in All_Variables (flux/mag -> float, qua/psf -> string)
+    (3)Cache is rebuilt automatically if input catalog is modified
+-------------------------------------------------------------------
+Latest update: 2026/10/18 Jordan Wu'''
+
+# Import Modules
+#==============================================================================
+from __future__ import print_function
+from os import path, makedirs, stat, rename
+import json
+import numpy as np
+from All_Variables import *
+
+# Variables
+#==============================================================================
+schema_name = 'schema.json'
+
+# Functions
+#==============================================================================
+def get_column_schema():
+    '''
+    This is to map column IDs in All_Variables to column names and types
+    Type: "float" for numeric columns, "str" for labels
+    '''
+    column_schema = {}
+    for name, ID in zip(['RA', 'DEC'], coor_ID):
+        column_schema[ID] = (name, 'float')
+    for ID_list, prefix, kind in [(full_flux_ID, 'flux', 'float'), (full_flux_err_ID, 'flux_err', 'float'),\
+                                  (full_mag_ID, 'mag', 'float'), (full_mag_err_ID, 'mag_err', 'float'),\
+                                  (full_qua_ID, 'qua', 'str'), (full_psf_ID, 'psf', 'str')]:
+        for band, ID in zip(full_band_name, ID_list):
+            column_schema[ID] = ('{}_{}'.format(prefix, band), kind)
+    for ID in c2d_lab_ID:
+        column_schema[ID] = ('c2d_lab', 'str')
+    for ID in Av_ID:
+        column_schema[ID] = ('Av', 'float')
+    return column_schema
+
+def get_cache_path(catalog_name):
+    '''
+    This is to get default directory of columnar cache for input catalog
+    '''
+    return '{}_columns'.format(path.splitext(catalog_name)[0])
+
+def convert_catalog_to_columns(catalog_name, cache_path=None):
+    '''
+    This is to convert whitespace catalog into columnar cache (one .npy per column)
+    Missing entries of short rows are filled with NaN (float) or "" (str)
+    '''
+    if cache_path is None:
+        cache_path = get_cache_path(catalog_name)
+    if not path.isdir(cache_path):
+        makedirs(cache_path)
+    with open(catalog_name, 'r') as table:
+        row_lists = [line.split() for line in table if line.strip()]
+    n_rows = len(row_lists)
+    n_cols = max([len(row_list) for row_list in row_lists]) if n_rows > 0 else 0
+    column_schema = get_column_schema()
+    columns = {}
+    for ID in range(n_cols):
+        name, kind = column_schema.get(ID, ('col_{:03d}'.format(ID), None))
+        values = [row_list[ID] if ID < len(row_list) else '' for row_list in row_lists]
+        column = None
+        if kind != 'str':
+            try:
+                column = np.array([value if value != '' else 'nan' for value in values], dtype=float)
+            except ValueError:
+                if kind == 'float':
+                    raise ValueError('Column {:d} ({}) is not numeric'.format(ID, name))
+        if column is None:
+            column = np.array(values, dtype=str)
+        column_file = 'col_{:03d}.npy'.format(ID)
+        np.save(path.join(cache_path, column_file), column)
+        columns[str(ID)] = {'name': name, 'dtype': column.dtype.str, 'file': column_file}
+    # Write schema at last, so a broken conversion is never taken as valid cache
+    catalog_stat = stat(catalog_name)
+    schema = {'catalog': path.abspath(catalog_name), 'size': catalog_stat.st_size, 'mtime': catalog_stat.st_mtime,\
+              'n_rows': n_rows, 'n_cols': n_cols, 'columns': columns}
+    with open(path.join(cache_path, schema_name + '.tmp'), 'w') as schema_file:
+        json.dump(schema, schema_file, indent=1)
+    rename(path.join(cache_path, schema_name + '.tmp'), path.join(cache_path, schema_name))
+    schema['path'] = cache_path
+    return schema
+
+def check_catalog_cache(catalog_name, cache_path=None):
+    '''
+    This is to check if columnar cache exists and matches input catalog
+    Return schema if cache is valid, otherwise None
+    '''
+    if cache_path is None:
+        cache_path = get_cache_path(catalog_name)
+    schema_file_name = path.join(cache_path, schema_name)
+    if not path.isfile(schema_file_name):
+        return None
+    with open(schema_file_name, 'r') as schema_file:
+        schema = json.load(schema_file)
+    if path.isfile(catalog_name):
+        catalog_stat = stat(catalog_name)
+        if (schema['size'] != catalog_stat.st_size) or (schema['mtime'] != catalog_stat.st_mtime):
+            return None
+    schema['path'] = cache_path
+    return schema
+
+def open_catalog_cache(catalog_name, cache_path=None):
+    '''
+    This is to open columnar cache of input catalog (convert catalog first if cache is missing/outdated)
+    '''
+    schema = check_catalog_cache(catalog_name, cache_path=cache_path)
+    if schema is None:
+        print('Converting {} into columnar cache ...'.format(catalog_name))
+        schema = convert_catalog_to_columns(catalog_name, cache_path=cache_path)
+    return schema
+
+def load_column(schema, ID, mmap=True):
+    '''
+    This is to load one column from columnar cache (memory-mapped by default)
+    '''
+    column = schema['columns'].get(str(ID))
+    if column is None:
+        raise IndexError('Column {:d} not in catalog cache {}'.format(ID, schema['path']))
+    return np.load(path.join(schema['path'], column['file']), mmap_mode='r' if mmap else None)
+
+def load_column_array(schema, column_ID, dtype=None):
+    '''
+    This is to load columns from columnar cache into (N, len(column_ID)) array
+    (same layout as get_column_array in Useful_Functions)
+    '''
+    columns = [np.asarray(load_column(schema, ID)) for ID in column_ID]
+    if dtype is not None:
+        columns = [column.astype(dtype) for column in columns]
+    if len(columns) > 0:
+        column_array = np.stack(columns, axis=1)
+    else:
+        column_array = np.zeros((schema['n_rows'], 0), dtype=dtype)
+    return column_array
+
+# Main Programs
+#==============================================================================
+if __name__ == '__main__':
+
+    from inspect import isfunction
+
+    print('\nPrint All Functions')
+    print('#===================================\n')
+    for name in dir():
+        if isfunction(eval(name)):
+            print('{:30}:{:100}'.format(name, str(eval(name))))
+    print('\n#===================================\n')
@@ -10,8 +10,10 @@ Abstract:
 *New upload"
     (1)function that sets critierion on magnitude with flux_qua of different sources.
     (2)function that sets critierion on magnitude with imtype of different sources.
+    (3)array version of functions which convert flux/mag of all sources at once.
+    (4)array version of functions which bin magnitudes and find AGB of all sources at once.
 -------------------------------------------------------------------
-Latest update: 2020/06/04 Jordan Wu'''
+Latest update: 2026/10/18 Jordan Wu'''
 
 # Import Modules
 #==============================================================================
@@ -64,6 +66,43 @@ def mJy_to_mag(x, flux_ID=flux_ID, f0_list=f0_list, qua_ID=qua_ID, psf_ID=psf_ID
                 mag_list.append('no')
     return mag_list
 
+def mJy_to_mag_array(flux_array, f0_list=f0_list, qua_array=None, psf_array=None, Qua=True, Psf=False):
+    """
+    This function is the array version of mJy_to_mag
+    Input are flux/qua/psf columns of all sources in (N, band) arrays
+    Return magnitude array and valid mask (mask False -> 'no' in mJy_to_mag)
+    Note: magnitude is -100.0 for saturate candidate 'S' (same as mJy_to_mag)
+    """
+    flux_array = np.asarray(flux_array, dtype=float)
+    f0_array   = np.asarray(f0_list[:flux_array.shape[1]], dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mag_array = -2.5 * np.log10(flux_array / f0_array)
+    detect = (flux_array > 0.0)
+    if Qua:
+        qua_array = np.asarray(qua_array)
+        valid = np.isin(qua_array, ["A_fake", "U_fake", "A", "B", "C", "D", "K"]) & detect
+        valid = select_qua_psf_array(valid, qua_array, psf_array, Psf)
+    else:
+        valid = detect
+    mag_array = np.where(valid, mag_array, np.nan)
+    if Qua:
+        mag_array[valid & (qua_array == "S")] = -100.0
+    return mag_array, valid
+
+def select_qua_psf_array(valid, qua_array, psf_array, Psf=False):
+    """
+    This function is to apply flux_Qua/PSF criterions of mJy_to_mag/mag_to_mag on arrays
+    (1) Qua labeled as 'N' in any band -> all bands are 'no'
+    (2) PSF check activated, PSF != "1" and Qua != "S" -> 'no'
+    (3) Qua labeled as 'S' (saturate candidate) -> -100.0
+    """
+    saturate = (qua_array == "S")
+    valid = valid | saturate
+    if Psf:
+        valid = valid & ((np.asarray(psf_array) == "1") | saturate)
+    valid = valid & ~np.any(qua_array == "N", axis=1)[:, None]
+    return valid
+
 def mJy_to_mag_ONLY_Spitzer(x):
     '''
     This function is to change fluxes on the catalog to magnitudes
@@ -190,6 +229,50 @@ def JHK_flux_to_mag(J_flux, H_flux, K_flux, to_UKIDSS=True):
             mag_K = mag_K + 0.01  * (mag_J - mag_K)
     return mag_J, mag_H, mag_K
 
+def mag_to_mag_array(mag_array, qua_array=None, psf_array=None, Qua=True, Psf=False):
+    """
+    This function is the array version of mag_to_mag
+    Input are mag/qua/psf columns of all sources in (N, band) arrays
+    Return magnitude array and valid mask (mask False -> 'no' in mag_to_mag)
+    Note: magnitude is -100.0 for saturate candidate 'S' (same as mag_to_mag)
+    """
+    mag_array = np.asarray(mag_array, dtype=float)
+    detect = (mag_array > 0.0)
+    if Qua:
+        qua_array = np.asarray(qua_array)
+        valid = np.isin(qua_array, ["A_fake", "A", "B", "C", "D", "K"]) & detect
+        valid = select_qua_psf_array(valid, qua_array, psf_array, Psf)
+    else:
+        valid = detect
+    mag_array = np.where(valid, mag_array, np.nan)
+    if Qua:
+        mag_array[valid & (qua_array == "S")] = -100.0
+    return mag_array, valid
+
+def JHK_flux_to_mag_array(J_flux, H_flux, K_flux, to_UKIDSS=True):
+    '''
+    This function is the array version of JHK_flux_to_mag
+    Return magnitude arrays of J, H, K and valid mask (all J, H, K fluxes > 0)
+    Note: magnitudes of invalid sources are 0.0 (same as JHK_flux_to_mag)
+    '''
+    f0_list = f0_2MASS
+    J_flux = np.asarray(J_flux, dtype=float)
+    H_flux = np.asarray(H_flux, dtype=float)
+    K_flux = np.asarray(K_flux, dtype=float)
+    valid  = (J_flux > 0.0) & (H_flux > 0.0) & (K_flux > 0.0)
+    mag_J, mag_H, mag_K = np.zeros(len(valid)), np.zeros(len(valid)), np.zeros(len(valid))
+    mag_J[valid] = -2.5 * np.log10(J_flux[valid]/f0_list[0])
+    mag_H[valid] = -2.5 * np.log10(H_flux[valid]/f0_list[1])
+    mag_K[valid] = -2.5 * np.log10(K_flux[valid]/f0_list[2])
+
+    if to_UKIDSS:
+        JH = (mag_J > 0.0) & (mag_H > 0.0)
+        mag_J[JH] = mag_J[JH] - 0.065 * (mag_J[JH] - mag_H[JH])
+        mag_H[JH] = mag_H[JH] + 0.07  * (mag_J[JH] - mag_H[JH])
+        JK = (mag_J > 0.0) & (mag_K > 0.0)
+        mag_K[JK] = mag_K[JK] + 0.01  * (mag_J[JK] - mag_K[JK])
+    return mag_J, mag_H, mag_K, valid
+
 def JHK_mag_to_flux_ONLY_UKIDSS(J_mag, H_mag, K_mag):
     '''
     Since UKIDSS survey only provide J, H, K band magnitude,
@@ -263,6 +346,51 @@ def sort_up_lack999(X, lim, cube=0.2):
         reu = int(round((float(X)-lim[0])/cube))
     return reu
 
+def index_AGB_array(X, Y, a=[0,0,2,5], b=[-1,0,2,2]):
+    """
+    This function is the array version of index_AGB
+    X is IR2-IR3, Y is IR3-MP1 of all sources
+    """
+    X = np.asarray(X, dtype=float)
+    Y = np.asarray(Y, dtype=float)
+    cutY = np.zeros(len(X))
+    for i in range(len(a)-1):
+        segment = (a[i] < X) & (X < a[i+1])
+        if np.any(segment):
+            cutY[segment] = b[i] + (b[i+1]-b[i]) / (a[i+1]-a[i]) * (X[segment]-a[i])
+    result = np.where((X < a[0]) | (X > a[len(a)-1]), -1, Y - cutY)
+    return result
+
+def AGB_mask_array(mag_array, valid, IR2_mag_ID, IR3_mag_ID, MP1_mag_ID):
+    """
+    This function is to determine if objects are AGB or not (array version of Remove_AGB)
+    Only objects with IR2, IR3, MP1 magnitudes all valid can be AGB
+    """
+    AGB_mask = np.zeros(len(mag_array), dtype=bool)
+    if (IR2_mag_ID is np.nan) or (IR3_mag_ID is np.nan) or (MP1_mag_ID is np.nan):
+        return AGB_mask
+    check = valid[:, IR2_mag_ID] & valid[:, IR3_mag_ID] & valid[:, MP1_mag_ID]
+    X23 = mag_array[check, IR2_mag_ID] - mag_array[check, IR3_mag_ID]
+    Y35 = mag_array[check, IR3_mag_ID] - mag_array[check, MP1_mag_ID]
+    AGB_mask[check] = (index_AGB_array(X23, Y35, [0, 0, 2, 5], [-1, 0, 2, 2]) < 0)
+    return AGB_mask
+
+def sort_up_lack999_array(mag_array, valid, axlim_list, cube=0.2):
+    '''
+    This function is the array version of sort_up_lack999
+    (N, band) magnitudes are turned into (N, band) position vectors
+    Lack: -999, Bright: -9999, Faint: 9999
+    '''
+    mag_array = np.asarray(mag_array, dtype=float)
+    lim_lower = np.array([lim[0] for lim in axlim_list], dtype=float)
+    lim_upper = np.array([lim[1] for lim in axlim_list], dtype=float)
+    mag_array = np.where(valid, mag_array, lim_lower)
+    pos_array = np.rint((mag_array - lim_lower) / cube).astype(np.int64)
+    pos_array[mag_array < lim_lower] = -9999
+    pos_array[mag_array > lim_upper] = 9999
+    pos_array[~valid] = -999
+    return pos_array
+
 def bin_to_mag(X, lim, cube=0.2):
     '''
     This function is to transform from binned data to original magnitude
@@ -4,7 +4,7 @@
 Abstract:
     This is to store all paths of programs/catalogs
 ---------------------------------------------------------------------
-Latest update : 2019/05/27 Jordan Wu
+Latest update : 2026/10/18 Jordan Wu
 '''
 
 # All_Table_Prefix
@@ -79,6 +79,11 @@ SPITZER_UKIDSS_2MASS_BR_path = '{}All_Converted_Catalog/UKIDSS_DR11PLUS_WI_2MASS
 # SPITZER HREL catalog + 2MASS transformed to UKIDSS system
 SPITER_2MASS_To_UKIDSS_path  = '{}All_Converted_Catalog/2MASS_TO_UKIDSS'.format(New_Table_Prefix)
 
+# PATH FOR
+#   - SOP_00_Gal_Prob_Model/Do_Gaussian_Smooth_Construct_Bin.py
+#====================================================================
+Beam_Cache_path = "{}All_GP_Beam_Cache/".format(New_Table_Prefix)
+
 # Main Programs
 #====================================================================
 if __name__ == '__main__':
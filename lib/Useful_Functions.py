@@ -9,6 +9,11 @@ from __future__ import print_function
 from __future__ import division
 from numba import jit
 from sklearn.neighbors import KDTree
+from joblib import Parallel, delayed, cpu_count
+from scipy.signal import fftconvolve
+from itertools import islice, combinations
+from fractions import Fraction
+from os import path, makedirs, rename
 import numpy as np
 import pickle
 import sys
@@ -22,6 +27,41 @@ def drawProgressBar(percent, barLen = 50):
     sys.stdout.write("[{:<{}}] {:.3f}%".format("=" * int(barLen * percent), barLen, (percent * 100)))
     sys.stdout.flush()
 
+def make_gaussian_beam(dim, sigma, bond, refD):
+    '''
+    This is to build truncated gaussian beam of any dimension, rows of [offsets..., G] with |offsets| <= bond
+    sigma is corrected for dimension effect by (dim/refD)**0.5 (G = 1 at center)
+    '''
+    # Dimension Effect Correction Factor
+    if float(refD) >= float(dim):
+        Mfactor = (float(dim)/refD)**0.5
+    else:
+        Mfactor = 1/((float(dim)/refD)**0.5)
+    axis  = np.arange(-bond, bond+1)
+    r_sqa = sum(np.square(axis).reshape([-1 if k == i else 1 for k in range(dim)]) for i in range(dim))
+    inside  = np.nonzero(r_sqa <= bond**2)
+    offsets = np.transpose(inside) - bond
+    G = np.exp(-(r_sqa[inside].astype(float)/(2*(sigma * Mfactor)**2)))
+    return np.column_stack([offsets, G]).astype(float)
+
+def load_gaussian_beam(dim, sigma, bond, refD, cache_dir=None):
+    '''
+    This is to load gaussian beam from disk cache keyed by (dim, sigma, bond, refD)
+    Beam is built by make_gaussian_beam and saved into cache_dir if it is not cached yet
+    '''
+    if cache_dir is None:
+        return make_gaussian_beam(dim, sigma, bond, refD)
+    beam_name = path.join(cache_dir, '{:d}d_beam_sigma{:d}_bond{:d}_refD{:d}.npy'.format(dim, sigma, bond, refD))
+    if path.isfile(beam_name):
+        return np.load(beam_name)
+    beam = make_gaussian_beam(dim, sigma, bond, refD)
+    if not path.isdir(cache_dir):
+        makedirs(cache_dir)
+    # Write then rename, so other runs never read partial beam
+    np.save(beam_name + '.tmp.npy', beam)
+    rename(beam_name + '.tmp.npy', beam_name)
+    return beam
+
 @jit(nopython=True)
 def cal_smooth_beam(pos_array, num_array, no_lack_ind, beam):
     '''
@@ -50,6 +90,226 @@ def cal_smooth_beam(pos_array, num_array, no_lack_ind, beam):
             after_beam_smooth_num.append(float(num_array) * weight)
     return after_beam_smooth_pos, after_beam_smooth_num
 
+@jit(nopython=True)
+def hash_table_add(table_keys, table_nums, key, num, bits):
+    '''
+    This is to add num on key in open-addressing hash table (linear probing)
+    Empty slot is marked by key -1, return 1 if key is new otherwise 0
+    '''
+    mask = (1 << bits) - 1
+    slot = np.int64((np.uint64(key) * np.uint64(11400714819323198485)) >> np.uint64(64 - bits))
+    while True:
+        if table_keys[slot] == key:
+            table_nums[slot] += num
+            return 0
+        if table_keys[slot] == -1:
+            table_keys[slot] = key
+            table_nums[slot] = num
+            return 1
+        slot = (slot + 1) & mask
+
+@jit(nopython=True)
+def smooth_beam_hash(input_pos, input_num, beam, shape):
+    '''
+    This is to smooth every point with gaussian beam and add weighted number straight into \
+    open-addressing hash table keyed by packed position (same encoding as pack_pos_vec)
+    Return deduplicated smoothed position/number sorted by packed key
+    Note: memory scales with occupied smoothed cells instead of points x beam size
+    '''
+    dim   = input_pos.shape[1]
+    radix = shape.astype(np.int64) + 1
+    bits  = 10
+    table_keys = -np.ones(1 << bits, dtype=np.int64)
+    table_nums = np.zeros(1 << bits)
+    used  = 0
+    digit = np.zeros(dim, dtype=np.int64)
+    for i in range(len(input_pos)):
+        for j in range(len(beam)):
+            #=========================================================
+            # Make new key from relative position (lack band keeps digit 0)
+            inside = True
+            m = 0
+            for k in range(dim):
+                if input_pos[i, k] == -999:
+                    digit[k] = 0
+                else:
+                    new_pos = int(input_pos[i, k]) + int(beam[j, m])
+                    m += 1
+                    if new_pos < 0 or new_pos >= shape[k]:
+                        inside = False
+                        break
+                    digit[k] = new_pos + 1
+            if not inside:
+                continue
+            key = 0
+            for k in range(dim):
+                key = key * radix[k] + digit[k]
+            used += hash_table_add(table_keys, table_nums, key, float(input_num[i]) * beam[j, -1], bits)
+            #=========================================================
+            # Grow hash table (keep load factor below 0.5)
+            if 2 * used > len(table_keys):
+                old_keys, old_nums = table_keys, table_nums
+                bits += 1
+                table_keys = -np.ones(1 << bits, dtype=np.int64)
+                table_nums = np.zeros(1 << bits)
+                for n in range(len(old_keys)):
+                    if old_keys[n] != -1:
+                        hash_table_add(table_keys, table_nums, old_keys[n], old_nums[n], bits)
+    #=========================================================
+    # Unpack keys into position vectors
+    occupied = np.where(table_keys != -1)[0]
+    keys = table_keys[occupied]
+    sort_ind = np.argsort(keys)
+    keys = keys[sort_ind]
+    after_smooth_num = table_nums[occupied][sort_ind]
+    after_smooth_pos = np.zeros((len(keys), dim), dtype=np.int64)
+    for n in range(len(keys)):
+        key = keys[n]
+        for k in range(dim-1, -1, -1):
+            after_smooth_pos[n, k] = key % radix[k] - 1
+            if after_smooth_pos[n, k] == -1:
+                after_smooth_pos[n, k] = -999
+            key = key // radix[k]
+    return after_smooth_pos, after_smooth_num
+
+def smooth_beam_dense(input_pos, input_num, beam, shape):
+    '''
+    This is to smooth points of one lack pattern by filling dense histogram on non-lack bands \
+    and convolving it with gaussian beam (FFT), nonzero cells are extracted as output
+    Return smoothed position/number in the same format as smooth_beam_hash (sorted by packed key)
+    Note: numbers agree with smooth_beam_hash up to round-off of FFT
+    '''
+    input_pos = np.asarray(input_pos, dtype=np.int64)
+    input_num = np.asarray(input_num, dtype=float)
+    beam      = np.asarray(beam, dtype=float)
+    if len(input_pos) == 0:
+        return np.zeros((0, len(shape)), dtype=np.int64), np.zeros(0)
+    no_lack_ind = np.where(input_pos[0] != -999)[0]
+    grid_shape  = tuple(int(shape[i]) for i in no_lack_ind)
+    # Fill histogram of input points
+    grid = np.zeros(grid_shape)
+    np.add.at(grid, tuple(input_pos[:, no_lack_ind].T), input_num)
+    # Beam as kernel centered at (half, half, ...)
+    rel_pos = beam[:, :-1].astype(np.int64)
+    half    = int(np.max(np.abs(rel_pos))) if len(rel_pos) > 0 else 0
+    kernel  = np.zeros((2*half+1,) * len(no_lack_ind))
+    np.add.at(kernel, tuple((rel_pos + half).T), beam[:, -1])
+    smooth_grid = fftconvolve(grid, kernel, mode='full')
+    smooth_grid = smooth_grid[tuple(slice(half, half + n) for n in grid_shape)]
+    # Smallest true contribution is far above FFT round-off
+    positive_num = input_num[input_num > 0]
+    if len(positive_num) == 0 or not np.any(beam[:, -1] > 0):
+        return np.zeros((0, len(shape)), dtype=np.int64), np.zeros(0)
+    threshold = 0.5 * np.min(positive_num) * np.min(beam[:, -1][beam[:, -1] > 0])
+    nonzero   = np.nonzero(smooth_grid > threshold)
+    after_smooth_pos = np.full((len(nonzero[0]), len(shape)), -999, dtype=np.int64)
+    for i, band in enumerate(no_lack_ind):
+        after_smooth_pos[:, band] = nonzero[i]
+    return after_smooth_pos, smooth_grid[nonzero]
+
+def get_smooth_grid_cells(no_lack_ind, beam, shape):
+    '''
+    This is to get number of cells of grid on non-lack bands and of the grid padded by beam radius
+    '''
+    half = int(np.max(np.abs(np.asarray(beam)[:, :-1]))) if len(beam) > 0 else 0
+    cells     = float(np.prod([int(shape[i]) for i in no_lack_ind]))
+    pad_cells = float(np.prod([int(shape[i]) + 2*half for i in no_lack_ind]))
+    return cells, pad_cells
+
+def pick_smooth_backend(pos_num, beam_num, pad_cells, mem_limit=2e9):
+    '''
+    This is to pick smoothing backend from number of points, beam size and padded grid size
+    '''
+    # real grid + complex spectrum of grid/kernel + output
+    dense_mem  = pad_cells * 8 * 4
+    # Note: one FFT step per cell is about 10 times cheaper than one hash insertion
+    dense_cost = pad_cells * np.log2(max(pad_cells, 2.)) / 10.
+    sparse_cost = float(pos_num) * beam_num
+    if dense_mem <= mem_limit and dense_cost < sparse_cost:
+        return 'dense'
+    return 'sparse'
+
+def choose_smooth_backend(input_pos, beam, shape, mem_limit=2e9):
+    '''
+    This is to choose smoothing backend ("dense" or "sparse") from estimated grid size
+    Dense (FFT convolution) is chosen if padded grid fits in mem_limit (bytes) \
+    and costs less than scattering every point with beam
+    '''
+    input_pos = np.asarray(input_pos)
+    if len(input_pos) == 0 or len(np.unique(get_lack_bits(input_pos))) != 1:
+        return 'sparse'
+    no_lack_ind = np.where(input_pos[0] != -999)[0]
+    cells, pad_cells = get_smooth_grid_cells(no_lack_ind, beam, shape)
+    return pick_smooth_backend(len(input_pos), len(beam), pad_cells, mem_limit)
+
+def estimate_smooth_slice(pos_num, no_lack_ind, beam, shape, slice_num=1, backend='auto'):
+    '''
+    This is to estimate one slice of smoothing (pos_num points of one lack pattern cut into slice_num slices)
+    Return backend, peak memory (bytes), work (hash insertions or FFT cell steps) and smoothed cells of one slice
+    '''
+    dim = len(shape)
+    slice_pos_num = int(np.ceil(pos_num / float(slice_num)))
+    cells, pad_cells = get_smooth_grid_cells(no_lack_ind, beam, shape)
+    if backend == 'auto':
+        backend = pick_smooth_backend(slice_pos_num, len(beam), pad_cells)
+    out_num = min(float(slice_pos_num) * len(beam), cells)
+    # input copy + smoothed pos/num
+    peak_mem = slice_pos_num * (8*dim + 8) + out_num * (8*dim + 8)
+    if backend == 'dense':
+        peak_mem += pad_cells * 8 * 4
+        work      = pad_cells * np.log2(max(pad_cells, 2.))
+    else:
+        # hash table (key + number) at load factor 0.5, old and new table when growing, sort of keys
+        slots     = 2. ** max(10, int(np.ceil(np.log2(max(2 * out_num, 1.)))))
+        peak_mem += slots * 16 * 1.5 + out_num * 16
+        work      = float(slice_pos_num) * len(beam)
+    return backend, peak_mem, work, out_num
+
+def estimate_smooth_memory(pos_num, no_lack_ind, beam, shape, slice_num=1, n_proc=1, spill=False, backend='auto'):
+    '''
+    This is to estimate peak memory (bytes) of smoothing one band combination in slice_num slices \
+    by n_proc processes, with smoothed slices kept in memory (or spilled to disk) until merged
+    '''
+    dim = len(shape)
+    backend, slice_mem, work, out_num = estimate_smooth_slice(pos_num, no_lack_ind, beam, shape, slice_num, backend)
+    cells, pad_cells = get_smooth_grid_cells(no_lack_ind, beam, shape)
+    # sorted runs (key + number) waiting for merge, merged key/number/pos
+    run_mem   = 0. if spill else slice_num * out_num * 16
+    merge_mem = min(float(pos_num) * len(beam), cells) * (8*dim + 16)
+    return min(n_proc, slice_num) * slice_mem + run_mem + merge_mem
+
+def advise_slice_num(input_list, beam_list, shape, mem_limit, n_proc=1, spill=False, backend='auto', max_slice=1024):
+    '''
+    This is to choose the smallest slice number with which every band combination fits in mem_limit (bytes)
+    input_list: input position arrays of band combinations, beam_list: beam of each band combination
+    '''
+    band_list = [(len(input_pos), np.where(np.asarray(input_pos[0]) != -999)[0], beam) \
+                 for input_pos, beam in zip(input_list, beam_list) if len(input_pos) > 0]
+    for slice_num in range(1, max_slice+1):
+        if all(estimate_smooth_memory(pos_num, no_lack_ind, beam, shape, slice_num, n_proc, spill, backend) <= mem_limit \
+               for pos_num, no_lack_ind, beam in band_list):
+            return slice_num
+    return max_slice
+
+def smooth_beam(input_pos, input_num, beam, shape, backend='auto'):
+    '''
+    This is to smooth points with gaussian beam by chosen backend ("sparse", "dense" or "auto")
+    Return smoothed position/number (already cascaded) and backend used
+    '''
+    if len(input_pos) == 0:
+        return np.zeros((0, len(shape)), dtype=np.int64), np.zeros(0), backend
+    if backend == 'auto':
+        backend = choose_smooth_backend(input_pos, beam, shape)
+    if backend == 'dense':
+        after_smooth_pos, after_smooth_num = smooth_beam_dense(input_pos, input_num, beam, shape)
+    elif backend == 'sparse':
+        after_smooth_pos, after_smooth_num = smooth_beam_hash(\
+                                             np.array(input_pos, dtype=np.int64), np.array(input_num, dtype=float),\
+                                             np.array(beam, dtype=float), np.array(shape, dtype=np.int64))
+    else:
+        raise ValueError('Wrong smoothing backend: {}'.format(backend))
+    return after_smooth_pos, after_smooth_num, backend
+
 def sort_up_array_element(input_array):
     '''
     Use this to sort up array (MUST DO before cascade array)
@@ -152,6 +412,278 @@ def find_pos_id_in_gal_pos_KD_Tree(gal_pos, target):
     id_array = np.array(pos_ind)
     return id_array
 
+def get_column_array(row_lists, column_ID, dtype=str):
+    '''
+    This is to extract columns of all rows (split catalog lines) into (N, len(column_ID)) array
+    '''
+    column_array = np.array([[row_list[ID] for ID in column_ID] for row_list in row_lists], dtype=dtype)
+    return column_array.reshape(len(row_lists), len(column_ID))
+
+def get_pos_vec_radix(axlim_list, cube):
+    '''
+    This is to get radix of each band for packing position vectors
+    Note: digit 0 is reserved for lack (-999) component
+    '''
+    radix = np.array([int(round((lim[1] - lim[0]) / cube)) + 2 for lim in axlim_list], dtype=np.uint64)
+    return radix
+
+def get_lack_bits(pos_array):
+    '''
+    This is to get lack pattern of position vectors as bit mask (bit i -> band i is -999)
+    '''
+    pos_array = np.atleast_2d(pos_array)
+    lack_bits = np.dot((pos_array == -999).astype(np.int64), 1 << np.arange(pos_array.shape[1], dtype=np.int64))
+    return lack_bits
+
+def group_pos_vec_by_lack(pos_array):
+    '''
+    This is to group position vectors by number of lack bands and then by lack pattern in one stable sort
+    Return sort index, slices of lack levels {lack number: slice} and of lack patterns {lack bits: slice} in sorted array
+    Note: order of position vectors in every group is kept
+    '''
+    dim = pos_array.shape[1]
+    lack_num  = np.sum(pos_array == -999, axis=1).astype(np.int64)
+    group_key = (lack_num << dim) | get_lack_bits(pos_array)
+    sort_ind  = np.argsort(group_key, kind='stable')
+    uni_key, start, count = np.unique(group_key[sort_ind], return_index=True, return_counts=True)
+    level_slice, bits_slice = {}, {}
+    for key, first, size in zip(uni_key, start, count):
+        bits_slice[int(key & ((1 << dim) - 1))] = slice(int(first), int(first + size))
+        level = int(key >> dim)
+        level_first = level_slice[level].start if level in level_slice else int(first)
+        level_slice[level] = slice(level_first, int(first + size))
+    return sort_ind, level_slice, bits_slice
+
+def get_all_lack_bits(dim, max_lack):
+    '''
+    This is to get all lack patterns (bit mask) with at most max_lack lack bands
+    '''
+    lack_bits = np.arange(1 << dim, dtype=np.int64)
+    lack_nums = np.array([bin(lack_bit).count('1') for lack_bit in lack_bits])
+    return lack_bits[lack_nums <= max_lack]
+
+def pack_pos_vec(pos_array, radix):
+    '''
+    This is to pack position vectors (N, dim) into 1-D keys (mixed-radix encoding)
+    Lack (-999) component is stored as digit 0, others are shifted by 1
+    '''
+    pos_array = np.atleast_2d(pos_array).astype(np.int64)
+    digit = np.where(pos_array == -999, 0, pos_array + 1)
+    if np.any(digit < 0) or np.any(digit >= radix.astype(np.int64)):
+        raise ValueError('Position vector out of packing range (bright/faint sources can not be packed)')
+    keys = np.zeros(len(pos_array), dtype=np.uint64)
+    for i in range(pos_array.shape[1]):
+        keys = keys * radix[i] + digit[:, i].astype(np.uint64)
+    return keys
+
+def unpack_pos_vec(keys, radix):
+    '''
+    This is to unpack 1-D keys (from pack_pos_vec) into position vectors (N, dim)
+    Digit 0 is unpacked as lack (-999)
+    '''
+    keys = np.asarray(keys, dtype=np.uint64).reshape(-1)
+    pos_array = np.zeros((len(keys), len(radix)), dtype=np.int64)
+    for i in range(len(radix)-1, -1, -1):
+        digit = (keys % radix[i]).astype(np.int64)
+        pos_array[:, i] = np.where(digit == 0, -999, digit - 1)
+        keys = keys // radix[i]
+    return pos_array
+
+def cascade_pos_vec(pos_array, num_array, radix):
+    '''
+    This is to cascade repeated position vectors (sum their numbers) by packed keys (1-D sort instead of lexsort)
+    Return position vectors sorted by packed key and summed numbers (in dtype of num_array)
+    '''
+    pos_array = np.asarray(pos_array).reshape(-1, len(radix))
+    num_array = np.asarray(num_array).reshape(-1)
+    uni_keys, uni_inv = np.unique(pack_pos_vec(pos_array, radix), return_inverse=True)
+    uni_num = np.bincount(uni_inv.reshape(-1), weights=num_array, minlength=len(uni_keys))
+    return unpack_pos_vec(uni_keys, radix), uni_num.astype(num_array.dtype)
+
+def project_pos_vec(pos_array, num_array, drop_num, radix):
+    '''
+    This is to project position vectors onto drop_num more lack bands (every combination of non-lack bands to drop)
+    Dropped columns of each lack pattern group are masked at once, projected numbers are summed by packed key
+    Return cascaded projected position vectors (sorted by packed key) and numbers
+    '''
+    dim = len(radix)
+    pos_array = np.asarray(pos_array, dtype=np.int64).reshape(-1, dim)
+    num_array = np.asarray(num_array).reshape(-1)
+    sort_ind, _, bits_slice = group_pos_vec_by_lack(pos_array)
+    proj_pos_list, proj_num_list = [], []
+    for lack_bits, group in bits_slice.items():
+        group_pos = pos_array[sort_ind[group]]
+        group_num = num_array[sort_ind[group]]
+        no_lack_ind = [k for k in range(dim) if not (lack_bits >> k) & 1]
+        for comb in combinations(no_lack_ind, drop_num):
+            proj_pos = group_pos.copy()
+            proj_pos[:, list(comb)] = -999
+            proj_pos_list.append(proj_pos)
+            proj_num_list.append(group_num)
+    if len(proj_pos_list) == 0:
+        return np.zeros((0, dim), dtype=np.int64), np.zeros(0, dtype=num_array.dtype)
+    return cascade_pos_vec(np.concatenate(proj_pos_list), np.concatenate(proj_num_list), radix)
+
+def merge_sorted_runs(run_list, block_size=1000000):
+    '''
+    This is to merge sorted runs [(keys, nums), ...] (keys unique in each run) into one sorted run \
+    and sum numbers of equal keys (k-way merge)
+    Runs are read block by block, so memory-mapped runs are merged out of core in one pass
+    '''
+    ptr_list = [0] * len(run_list)
+    out_keys, out_nums = [], []
+    while True:
+        active = [i for i in range(len(run_list)) if ptr_list[i] < len(run_list[i][0])]
+        if len(active) == 0:
+            break
+        # Every key <= bound in all runs is in this round
+        block_keys = [np.asarray(run_list[i][0][ptr_list[i]:ptr_list[i]+block_size]) for i in active]
+        open_ends  = [block[-1] for i, block in zip(active, block_keys) if ptr_list[i] + len(block) < len(run_list[i][0])]
+        bound = min(open_ends) if len(open_ends) > 0 else None
+        keys_list, nums_list = [], []
+        for i, block in zip(active, block_keys):
+            take = len(block) if bound is None else int(np.searchsorted(block, bound, side='right'))
+            keys_list.append(block[:take])
+            nums_list.append(np.asarray(run_list[i][1][ptr_list[i]:ptr_list[i]+take], dtype=float))
+            ptr_list[i] += take
+        keys = np.concatenate(keys_list)
+        nums = np.concatenate(nums_list)
+        sort_ind = np.argsort(keys, kind='stable')
+        keys, nums = keys[sort_ind], nums[sort_ind]
+        start = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        out_keys.append(keys[start])
+        out_nums.append(np.add.reduceat(nums, start))
+    if len(out_keys) == 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0)
+    return np.concatenate(out_keys), np.concatenate(out_nums)
+
+def merge_unique_pos_vec(pos_array_list, dim):
+    '''
+    This is to merge position vectors of several inputs and keep unique ones (look up only once)
+    Return unique position vectors and index list of each input in unique ones
+    '''
+    pos_array_list = [np.asarray(pos_array, dtype=np.int64).reshape(-1, dim) for pos_array in pos_array_list]
+    uni_pos, uni_inv = np.unique(np.concatenate(pos_array_list), axis=0, return_inverse=True)
+    split_ind = np.cumsum([len(pos_array) for pos_array in pos_array_list])[:-1]
+    return uni_pos, np.split(uni_inv.reshape(-1), split_ind)
+
+def save_gp_store(store_prefix, pos_array, num_array, radix):
+    '''
+    This is to save galaxy probability store (sorted packed keys + values + radix in .npy)
+    Repeated position vectors keep the last value (same as dictionary update)
+    '''
+    keys = pack_pos_vec(pos_array, radix)
+    nums = np.asarray(num_array, dtype=float).reshape(-1)
+    uni_keys, last_ind = np.unique(keys[::-1], return_index=True)
+    np.save('{}_key.npy'.format(store_prefix), uni_keys)
+    np.save('{}_num.npy'.format(store_prefix), nums[::-1][last_ind])
+    np.save('{}_radix.npy'.format(store_prefix), np.asarray(radix, dtype=np.uint64))
+    return uni_keys, nums[::-1][last_ind]
+
+def load_gp_store(store_prefix, mmap=True):
+    '''
+    This is to load galaxy probability store (keys/values memory-mapped by default)
+    '''
+    mmap_mode = 'r' if mmap else None
+    store_keys  = np.load('{}_key.npy'.format(store_prefix), mmap_mode=mmap_mode)
+    store_nums  = np.load('{}_num.npy'.format(store_prefix), mmap_mode=mmap_mode)
+    store_radix = np.load('{}_radix.npy'.format(store_prefix))
+    return store_keys, store_nums, store_radix
+
+def gp_dict_to_store(gp_dict_list, radix):
+    '''
+    This is to convert galaxy probability dictionaries (key in tuple) into store arrays
+    '''
+    keys_list, nums_list = [], []
+    for gp_dict in gp_dict_list:
+        pos_array = np.array(list(gp_dict.keys()), dtype=np.int64).reshape(len(gp_dict), len(radix))
+        keys_list.append(pack_pos_vec(pos_array, radix))
+        nums_list.append(np.array(list(gp_dict.values()), dtype=float))
+    keys, nums = np.concatenate(keys_list), np.concatenate(nums_list)
+    uni_keys, last_ind = np.unique(keys[::-1], return_index=True)
+    return uni_keys, nums[::-1][last_ind]
+
+def search_gp_store(store_keys, store_nums, pos_array, radix):
+    '''
+    This is to look up values of position vectors in galaxy probability store in one batch
+    Return values (NaN if not found) and found mask
+    '''
+    pos_keys = pack_pos_vec(pos_array, radix)
+    values   = np.full(len(pos_keys), np.nan)
+    if len(store_keys) == 0:
+        return values, np.zeros(len(pos_keys), dtype=bool)
+    ind   = np.minimum(np.searchsorted(store_keys, pos_keys), len(store_keys)-1)
+    found = (store_keys[ind] == pos_keys)
+    values[found] = store_nums[ind[found]]
+    return values, found
+
+def get_lattice_step(direction, max_denominator=1000):
+    '''
+    This is to turn rational direction (e.g. [1, 0.5, 0]) into smallest integer step on lattice (e.g. [2, 1, 0])
+    '''
+    frac_list = [Fraction(str(comp)).limit_denominator(max_denominator) for comp in direction]
+    if all([frac == 0 for frac in frac_list]):
+        raise ValueError('Zero direction: {}'.format(direction))
+    denom     = int(np.lcm.reduce([frac.denominator for frac in frac_list]))
+    step      = np.array([int(frac * denom) for frac in frac_list], dtype=np.int64)
+    return step // int(np.gcd.reduce(step))
+
+def walk_lattice_lines(origin_array, step, upper_bd, lower_bd=None):
+    '''
+    This is to walk lattice lines from all origins along integer step (N-d Bresenham-style DDA)
+    Major axis (largest |step|) moves one cell per step, other axes move round(k*step/|step_major|) (half up)
+    Lines stop when leaving [lower_bd, upper_bd), return cells of all lines (origin order) and their line id
+    '''
+    origin_array = np.atleast_2d(np.asarray(origin_array, dtype=np.int64))
+    step         = np.asarray(step, dtype=np.int64)
+    upper_bd     = np.asarray(upper_bd, dtype=np.int64)
+    lower_bd     = np.zeros(len(upper_bd), dtype=np.int64) if lower_bd is None else np.asarray(lower_bd, dtype=np.int64)
+    major        = int(np.max(np.abs(step)))
+    # Major axis moves one cell per step, so lines are not longer than its extent
+    max_len      = int(np.max(upper_bd - lower_bd)) if len(origin_array) > 0 else 0
+    walk         = (2 * np.arange(max_len, dtype=np.int64)[:, None] * step + major) // (2 * major)
+    cells        = origin_array[:, None, :] + walk[None, :, :]
+    in_box       = np.all((cells >= lower_bd) & (cells < upper_bd), axis=2)
+    # Keep cells before line leaves the box
+    in_line      = np.cumprod(in_box, axis=1).astype(bool)
+    line_id      = np.repeat(np.arange(len(origin_array)), np.sum(in_line, axis=1))
+    return cells[in_line], line_id
+
+def read_catalog_blocks(catalog_name, block_size=100000):
+    '''
+    This is to read lines of catalog in blocks (at most block_size lines each) \
+    without loading whole catalog into memory
+    '''
+    with open(catalog_name, 'r') as table:
+        while True:
+            catalog_block = list(islice(table, block_size))
+            if len(catalog_block) == 0:
+                break
+            yield catalog_block
+
+def resolve_n_proc(n_proc):
+    '''
+    This is to resolve number of processes (negative: all cores as joblib, e.g. -1), 0 is not allowed
+    '''
+    n_proc = int(n_proc)
+    if n_proc == 0:
+        raise ValueError('Wrong number of processes: 0')
+    return max(1, cpu_count() + 1 + n_proc) if n_proc < 0 else n_proc
+
+def run_catalog_shards(catalog_lines, classify_func, classify_args=(), n_proc=1):
+    '''
+    This is to run classify_func(shard_lines, *classify_args) on contiguous shards of catalog lines \
+    by a pool of processes, output lines of shards are merged in original order
+    Note: large numpy arrays in classify_args are memory-mapped read-only and shared by processes
+    '''
+    n_proc = resolve_n_proc(n_proc)
+    if n_proc == 1 or len(catalog_lines) <= 1:
+        return classify_func(catalog_lines, *classify_args)
+    shard_bd = np.linspace(0, len(catalog_lines), min(n_proc, len(catalog_lines))+1).astype(int)
+    out_shards = Parallel(n_jobs=n_proc, mmap_mode='r')(delayed(classify_func)(catalog_lines[start:end], *classify_args) \
+                                                        for start, end in zip(shard_bd[:-1], shard_bd[1:]))
+    return [out_line for out_lines in out_shards for out_line in out_lines]
+
 def fill_up_list_WI_z(input_list, max_column_num=246):
     '''
     This is to fill up list with "z" to prevent list index error